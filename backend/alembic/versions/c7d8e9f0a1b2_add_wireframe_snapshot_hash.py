@@ -0,0 +1,25 @@
+"""add wireframe snapshot hash to projects
+
+Revision ID: c7d8e9f0a1b2
+Revises: merge_heads_001
+Create Date: 2025-12-15 00:00:00.000000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c7d8e9f0a1b2"
+down_revision: Union[str, None] = "merge_heads_001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("projects", sa.Column("wireframe_snapshot_hash", sa.String(length=32), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("projects", "wireframe_snapshot_hash")
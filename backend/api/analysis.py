@@ -2,6 +2,7 @@
 Analysis endpoints - анализ схожести и валидация карты
 """
 import logging
+from collections import Counter
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session, joinedload
 from slowapi import Limiter
@@ -264,8 +265,11 @@ def generate_analysis_summary(
     parts.append(f"Всего историй: {total_stories}.")
     
     # Проблемы валидации
-    error_count = sum(1 for i in validation.issues if i.severity.value == "error")
-    warning_count = sum(1 for i in validation.issues if i.severity.value == "warning")
+    severity_counts = validation.stats.get("issues_by_severity")
+    if severity_counts is None:
+        severity_counts = Counter(i.severity.value for i in validation.issues)
+    error_count = severity_counts.get("error", 0)
+    warning_count = severity_counts.get("warning", 0)
     
     if error_count > 0:
         parts.append(f"Критических проблем: {error_count}.")
@@ -17,7 +17,8 @@ from services.auth_service import (
     get_password_hash,
     authenticate_user,
     create_access_token,
-    create_refresh_token
+    create_refresh_token,
+    invalidate_user_cache
 )
 from dependencies import get_current_active_user
 
@@ -85,6 +86,7 @@ def register(user_data: UserCreate, request: Request, db: Session = Depends(get_
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    invalidate_user_cache(db_user.email)
     
     return UserResponse(
         id=db_user.id,
@@ -156,7 +158,11 @@ def refresh_token_endpoint(
     if refresh_token.revoked:
         raise HTTPException(status_code=401, detail="Token revoked")
     
-    if refresh_token.expires_at < datetime.now(timezone.utc):
+    # SQLite возвращает DateTime(timezone=True) без tzinfo - в БД пишем UTC
+    expires_at = refresh_token.expires_at
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    if expires_at < datetime.now(timezone.utc):
         raise HTTPException(status_code=401, detail="Token expired")
     
     # Генерируем новый access token
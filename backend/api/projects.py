@@ -9,6 +9,7 @@ from slowapi import Limiter
 from slowapi.util import get_remote_address
 
 from utils.database import get_db
+from utils.redis_client import get_redis_client
 from models import User, Project, Activity, UserTask, Release, UserStory
 from schemas import (
     RequirementsInput,
@@ -35,6 +36,27 @@ router = APIRouter(prefix="", tags=["projects"])
 limiter = Limiter(key_func=get_remote_address)
 logger = logging.getLogger(__name__)
 
+# Границы размера требований (те же, что проверяет ai_service перед запросом к AI)
+REQUIREMENTS_MIN_LENGTH = 10
+REQUIREMENTS_MAX_LENGTH = 10000
+
+
+def _validate_requirements_text(text: str) -> None:
+    """Проверяет размер требований до обращения к AI (400 независимо от настройки провайдеров)"""
+    if not text or not text.strip():
+        raise HTTPException(status_code=400, detail="Requirements text cannot be empty")
+    if len(text.strip()) < REQUIREMENTS_MIN_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Requirements text is too short. Please provide at least {REQUIREMENTS_MIN_LENGTH} characters."
+        )
+    if len(text) > REQUIREMENTS_MAX_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Requirements text is too long. Maximum {REQUIREMENTS_MAX_LENGTH} characters allowed."
+        )
+
+
 # Lazy import для wireframe сервисов (чтобы не ломать импорт если Redis недоступен)
 WIREFRAME_AVAILABLE = False
 enqueue_wireframe_job = None
@@ -113,32 +135,6 @@ def format_project_response(project: Project) -> ProjectResponse:
     )
 
 
-def get_redis_client():
-    """Получает Redis клиент или возвращает None если недоступен"""
-    try:
-        import redis
-        from config import settings
-        redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
-        redis_client.ping()
-        return redis_client
-    except Exception as e:
-        # В production это критичная проблема - логируем как error
-        if settings.ENVIRONMENT == "production":
-            logger.error(f"❌ Redis unavailable in production: {e}. Caching disabled!")
-            # В production можно отправить alert в Sentry
-            try:
-                import sentry_sdk
-                sentry_sdk.capture_message(
-                    f"Redis connection failed: {e}",
-                    level="error"
-                )
-            except ImportError:
-                pass
-        else:
-            logger.warning(f"⚠️ Redis not available in development: {e}. Caching disabled.")
-        return None
-
-
 @router.post("/enhance-requirements", response_model=EnhancementResponse)
 @limiter.limit("30/hour")
 def enhance_requirements_endpoint(
@@ -158,8 +154,7 @@ def enhance_requirements_endpoint(
     """
     
     # Валидация входных данных
-    if not req.text or not req.text.strip():
-        raise HTTPException(status_code=400, detail="Requirements text cannot be empty")
+    _validate_requirements_text(req.text)
     
     try:
         redis_client = get_redis_client()
@@ -207,8 +202,7 @@ def generate_map(
     """
     
     # Валидация входных данных
-    if not req.text or not req.text.strip():
-        raise HTTPException(status_code=400, detail="Requirements text cannot be empty")
+    _validate_requirements_text(req.text)
     
     # Получаем Redis клиент
     redis_client = get_redis_client()
@@ -284,22 +278,22 @@ def generate_map(
     
     # 2. Создаем проект (привязываем к текущему пользователю)
     try:
+        # 3. Стандартные релизы создаются вместе с проектом (один flush через relationship)
+        mvp_release = Release(title="MVP", position=0)
+        release1 = Release(title="Release 1", position=1)
+        later_release = Release(title="Later", position=2)
         project = Project(
             name=ai_data.get("productName", "New Project"),
             raw_requirements=req.text,
-            user_id=current_user.id
+            user_id=current_user.id,
+            releases=[mvp_release, release1, later_release]
         )
         db.add(project)
         db.flush()
         
-        # 3. Создаем стандартные релизы
-        mvp_release = Release(project_id=project.id, title="MVP", position=0)
-        release1 = Release(project_id=project.id, title="Release 1", position=1)
-        later_release = Release(project_id=project.id, title="Later", position=2)
-        db.add_all([mvp_release, release1, later_release])
-        db.flush()
-        
-        # 4. Сохраняем структуру карты
+        # 4. Сохраняем структуру карты: по одному add_all + flush на уровень
+        # (activities → tasks → stories), а не flush на каждый объект
+        activities = []  # (activity, tasks)
         for act_idx, activity_item in enumerate(ai_data.get("map", [])):
             if not isinstance(activity_item, dict):
                 logger.warning(f"Skipping invalid activity item at index {act_idx}: {type(activity_item)}")
@@ -310,15 +304,17 @@ def generate_map(
                 title=activity_item.get("activity", ""),
                 position=act_idx
             )
-            db.add(activity)
-            db.flush()
-            
-            tasks = activity_item.get("tasks", [])
-            if not isinstance(tasks, list):
+            activities.append((activity, activity_item.get("tasks", [])))
+        db.add_all([activity for activity, _ in activities])
+        db.flush()
+        
+        tasks = []  # (task, stories, act_idx, task_idx)
+        for act_idx, (activity, task_items) in enumerate(activities):
+            if not isinstance(task_items, list):
                 logger.warning(f"Invalid tasks format for activity {act_idx}")
                 continue
                 
-            for task_idx, task_item in enumerate(tasks):
+            for task_idx, task_item in enumerate(task_items):
                 if not isinstance(task_item, dict):
                     logger.warning(f"Skipping invalid task item at activity {act_idx}, task {task_idx}")
                     continue
@@ -328,38 +324,40 @@ def generate_map(
                     title=task_item.get("taskTitle", ""),
                     position=task_idx
                 )
-                db.add(task)
-                db.flush()
+                tasks.append((task, task_item.get("stories", []), act_idx, task_idx))
+        db.add_all([task for task, *_ in tasks])
+        db.flush()
+        
+        stories = []
+        for task, story_items, act_idx, task_idx in tasks:
+            if not isinstance(story_items, list):
+                logger.warning(f"Invalid stories format for task {task_idx}")
+                continue
                 
-                stories = task_item.get("stories", [])
-                if not isinstance(stories, list):
-                    logger.warning(f"Invalid stories format for task {task_idx}")
+            for story_idx, story_item in enumerate(story_items):
+                if not isinstance(story_item, dict):
+                    logger.warning(f"Skipping invalid story item at activity {act_idx}, task {task_idx}, story {story_idx}")
                     continue
-                    
-                for story_idx, story_item in enumerate(stories):
-                    if not isinstance(story_item, dict):
-                        logger.warning(f"Skipping invalid story item at activity {act_idx}, task {task_idx}, story {story_idx}")
-                        continue
-                    
-                    # Определяем релиз по приоритету
-                    priority = story_item.get("priority", "Later").upper()
-                    if "MVP" in priority:
-                        target_release = mvp_release
-                    elif "RELEASE" in priority or "1" in priority:
-                        target_release = release1
-                    else:
-                        target_release = later_release
-                    
-                    story = UserStory(
-                        task_id=task.id,
-                        release_id=target_release.id,
-                        title=story_item.get("title", ""),
-                        description=story_item.get("description", ""),
-                        priority=story_item.get("priority", "Later"),
-                        acceptance_criteria=story_item.get("acceptanceCriteria", []),
-                        position=story_idx
-                    )
-                    db.add(story)
+                
+                # Определяем релиз по приоритету
+                priority = story_item.get("priority", "Later").upper()
+                if "MVP" in priority:
+                    target_release = mvp_release
+                elif "RELEASE" in priority or "1" in priority:
+                    target_release = release1
+                else:
+                    target_release = later_release
+                
+                stories.append(UserStory(
+                    task_id=task.id,
+                    release_id=target_release.id,
+                    title=story_item.get("title", ""),
+                    description=story_item.get("description", ""),
+                    priority=story_item.get("priority", "Later"),
+                    acceptance_criteria=story_item.get("acceptanceCriteria", []),
+                    position=story_idx
+                ))
+        db.add_all(stories)
         
         db.commit()
         db.refresh(project)
@@ -409,8 +407,7 @@ def generate_map_demo(
     """
 
     # Валидация входных данных
-    if not req.text or not req.text.strip():
-        raise HTTPException(status_code=400, detail="Requirements text cannot be empty")
+    _validate_requirements_text(req.text)
 
     # Получаем Redis клиент
     redis_client = get_redis_client()
@@ -493,8 +490,7 @@ async def generate_map_stream(
     """
 
     # Валидация входных данных
-    if not req.text or not req.text.strip():
-        raise HTTPException(status_code=400, detail="Requirements text cannot be empty")
+    _validate_requirements_text(req.text)
 
     logger.info(f"[SSE] Starting streaming generation for user {current_user.id}")
 
@@ -569,11 +565,15 @@ def generate_project_wireframe(
     if not project.activities:
         raise HTTPException(status_code=400, detail="Project has no activities to generate wireframe")
 
+    # "pending" фиксируем до постановки в очередь: воркер может завершить задачу
+    # (например, карта не менялась) раньше, чем мы вернемся из enqueue, и его
+    # "success" не должен перезаписываться
+    project.wireframe_status = "pending"
+    project.wireframe_error = None
+    db.commit()
+
     try:
         job_id = enqueue_wireframe_job(project_id, current_user.id)
-        project.wireframe_status = "pending"
-        project.wireframe_error = None
-        db.commit()
         return {"status": "queued", "job_id": job_id}
     except HTTPException as e:
         db.rollback()
@@ -603,11 +603,18 @@ def generate_project_wireframe(
                     status_code=500,
                     detail=f"Wireframe generation failed: {error_msg}"
                 )
+        # Задача не поставлена - снимаем "pending", иначе клиент будет ждать вечно
+        project.wireframe_status = "error"
+        project.wireframe_error = f"Failed to enqueue wireframe generation job: {e.detail}"
+        db.commit()
         raise
     except Exception as e:
         db.rollback()
         error_msg = str(e) if str(e) else repr(e)
         logger.error(f"Failed to enqueue wireframe job: {error_msg}", exc_info=True)
+        project.wireframe_status = "error"
+        project.wireframe_error = f"Failed to enqueue wireframe generation job: {error_msg}"
+        db.commit()
         raise HTTPException(status_code=500, detail=f"Failed to enqueue wireframe generation job: {error_msg}")
 
 
@@ -1,56 +1,147 @@
+import threading
+
+import httpx
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
+from passlib.context import CryptContext
 
-from main import app
+from main import app, run_migrations_on_startup, prewarm_db_pool
 from api import auth, projects, stories, analysis, health
 from models import Base
+from services import auth_service
 from utils.database import get_db
 
-# Общая тестовая БД в памяти
+# Общая тестовая БД в памяти (при pytest -n у каждого воркера xdist свой процесс и своя БД)
 SQLALCHEMY_DATABASE_URL = "sqlite://"
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
+    query_cache_size=1200,  # скомпилированные запросы переиспользуются между тестами
+)
+TestingSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
 )
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+# pysqlite сам расставляет BEGIN и ломает SAVEPOINT - отдаем управление транзакциями SQLAlchemy
+@event.listens_for(engine, "connect")
+def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+@event.listens_for(engine, "begin")
+def _emit_begin(conn):
+    conn.exec_driver_sql("BEGIN")
+
+
+# Соединение с открытой транзакцией текущего теста (см. db_transaction)
+_test_connection = None
+# SAVEPOINT-ы параллельных запросов на одном соединении не должны перемежаться:
+# сессии поверх _test_connection работают по очереди. Lock (не RLock) - вход и выход
+# sync-зависимости FastAPI могут выполняться в разных потоках
+_test_connection_lock = threading.Lock()
 
 
 def override_get_db():
-    db = TestingSessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    if _test_connection is None:
+        db = TestingSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+        return
+
+    with _test_connection_lock:
+        # commit() в коде приложения фиксирует только SAVEPOINT внутри транзакции теста
+        db = TestingSessionLocal(bind=_test_connection, join_transaction_mode="create_savepoint")
+        try:
+            yield db
+        finally:
+            db.close()
 
 
-# Подменяем зависимость БД для всех тестов
-app.dependency_overrides[get_db] = override_get_db
 # Отключаем rate limiting slowapi в тестах
 if hasattr(app.state, "limiter"):
     app.state.limiter.enabled = False
 for module in (auth, projects, stories, analysis, health):
     if hasattr(module, "limiter"):
         module.limiter.enabled = False
+# Тесты работают с in-memory БД: миграции и прогрев пула реальной БД из DATABASE_URL не запускаем
+for startup_hook in (run_migrations_on_startup, prewarm_db_pool):
+    if startup_hook in app.router.on_startup:
+        app.router.on_startup.remove(startup_hook)
+# Минимальная стоимость bcrypt: register/login в тестах не упираются в CPU
+auth_service.pwd_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4)
 
 
-@pytest.fixture(autouse=True)
-def reset_db():
-    """Чистая схема перед каждым тестом."""
-    Base.metadata.drop_all(bind=engine)
+@pytest.fixture(scope="session")
+def _schema():
+    """Схема создается один раз на сессию (на воркер xdist)."""
     Base.metadata.create_all(bind=engine)
     yield
+    # In-memory БД живет, пока открыто единственное соединение StaticPool:
+    # закрываем его вместо поштучного DROP TABLE
+    engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def _db_override(_schema):
+    """Подменяет зависимость БД на тестовую на время сессии и снимает подмену в конце."""
+    app.dependency_overrides[get_db] = override_get_db
+    yield
+    app.dependency_overrides.pop(get_db, None)
+
+
+@pytest.fixture(autouse=True)
+def db_transaction(_schema, registered_user):
+    """
+    Каждый тест идет внутри транзакции, которая откатывается в конце:
+    таблицы не пересоздаются, а пользователь сессии (закоммичен до теста) сохраняется.
+    """
+    global _test_connection
+    connection = engine.connect()
+    transaction = connection.begin()
+    _test_connection = connection
+    try:
+        yield connection
+    finally:
+        _test_connection = None
+        transaction.rollback()
+        connection.close()
+
+
+@pytest.fixture(scope="session")
+def _session_client(_db_override):
+    # Startup/shutdown отрабатывают один раз на сессию
+    with TestClient(app) as session_client:
+        yield session_client
 
 
 @pytest.fixture
-def client():
-    return TestClient(app)
+def client(_session_client):
+    """Один TestClient на сессию; cookies с токенами не переносятся между тестами."""
+    _session_client.cookies.clear()
+    return _session_client
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    """Async тесты (pytest.mark.anyio) идут на asyncio, один backend на сессию."""
+    return "asyncio"
 
 
 @pytest.fixture
+async def async_client(_db_override):
+    """httpx.AsyncClient поверх ASGI-приложения - для тестов с asyncio.gather."""
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
 def test_user_credentials():
     # Пароль удовлетворяет политикам: 8+ символов, верхний/нижний регистр, цифра
     return {
@@ -61,32 +152,47 @@ def test_user_credentials():
 
 
 @pytest.fixture
-def registered_user(client, test_user_credentials):
-    # Регистрация может вернуть 400, если пользователь уже существует — это не критично
-    client.post("/register", json=test_user_credentials)
-    return test_user_credentials
+def new_user_credentials():
+    """Пользователь, которого тест регистрирует сам (откатывается после теста)."""
+    return {
+        "email": "new_user@example.com",
+        "password": "Testpass123",
+        "full_name": "New User",
+    }
 
 
-@pytest.fixture
-def tokens(client, registered_user):
+def _login(client, credentials):
     resp = client.post(
         "/token",
-        data={"username": registered_user["email"], "password": registered_user["password"]},
+        data={"username": credentials["email"], "password": credentials["password"]},
         headers={"Content-Type": "application/x-www-form-urlencoded"},
     )
     assert resp.status_code == 200
-    data = resp.json()
-    return data["access_token"], data.get("refresh_token")
+    return resp.json()
 
 
-@pytest.fixture
-def auth_headers(tokens):
-    access_token, _ = tokens
+@pytest.fixture(scope="session")
+def registered_user(_schema, _session_client, test_user_credentials):
+    # Регистрируем один раз на сессию: bcrypt-хеширование пароля дорогое
+    resp = _session_client.post("/register", json=test_user_credentials)
+    assert resp.status_code == 201
+    return test_user_credentials
+
+
+@pytest.fixture(scope="session")
+def auth_headers(_session_client, registered_user):
+    access_token = _login(_session_client, registered_user)["access_token"]
     return {"Authorization": f"Bearer {access_token}"}
 
 
+@pytest.fixture
+def tokens(client, registered_user):
+    # Свежая пара токенов на тест: test_logout отзывает refresh token
+    data = _login(client, registered_user)
+    return data["access_token"], data.get("refresh_token")
+
+
 @pytest.fixture
 def refresh_token(tokens):
     _, refresh = tokens
     return refresh
-
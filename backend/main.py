@@ -2,10 +2,12 @@
 AI User Story Mapper - Main Application
 Рефакторенная модульная версия
 """
+import asyncio
 import os
 import logging
 from pathlib import Path
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
@@ -57,7 +59,7 @@ else:
 
 # Создание таблиц в БД (только для development, в production используйте миграции Alembic)
 from models import Base
-from utils.database import engine
+from utils.database import engine, prewarm_pool
 # В production таблицы должны создаваться через миграции Alembic, а не автоматически
 # Это предотвращает создание лишних соединений при деплое
 if settings.ENVIRONMENT == "development":
@@ -72,7 +74,8 @@ if settings.ENVIRONMENT == "development":
 app = FastAPI(
     title="AI User Story Mapper",
     version="2.0.0",
-    description="Модульная версия с улучшенной архитектурой"
+    description="Модульная версия с улучшенной архитектурой",
+    default_response_class=ORJSONResponse,  # сериализация ответов в C (orjson)
 )
 
 # Rate limiting
@@ -158,6 +161,12 @@ async def run_migrations_on_startup():
         logger.info("💡 Migrations will need to be applied manually or via Build Command")
 
 
+@app.on_event("startup")
+async def prewarm_db_pool():
+    """Прогрев пула соединений с БД (после миграций, в отдельном потоке)."""
+    await asyncio.to_thread(prewarm_pool)
+
+
 logger.info(f"✅ Application started successfully")
 logger.info(f"📦 Database: {settings.DATABASE_URL.split('@')[0] if '@' in settings.DATABASE_URL else settings.DATABASE_URL.split('///')[0]}")
 logger.info(f"🤖 AI Provider: {settings.API_PROVIDER}")
@@ -20,6 +20,7 @@ class Project(Base):
     wireframe_generated_at = Column(DateTime(timezone=True), nullable=True)
     wireframe_status = Column(String, default="idle", server_default="idle")
     wireframe_error = Column(Text, nullable=True)
+    wireframe_snapshot_hash = Column(String(32), nullable=True)  # blake2b snapshot-а последней генерации
     
     # Relationships
     owner = relationship("User", back_populates="projects")
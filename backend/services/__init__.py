@@ -7,6 +7,7 @@ from .auth_service import (
     create_access_token,
     create_refresh_token,
     get_user_by_email,
+    invalidate_user_cache,
     authenticate_user,
     decode_access_token
 )
@@ -21,6 +22,7 @@ __all__ = [
     "create_access_token",
     "create_refresh_token",
     "get_user_by_email",
+    "invalidate_user_cache",
     "authenticate_user",
     "decode_access_token",
     # AI service
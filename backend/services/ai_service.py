@@ -8,7 +8,8 @@ import hashlib
 import logging
 import os
 import copy
-from typing import Optional, Dict, List
+import functools
+from typing import Optional, Dict, List, Tuple
 from datetime import datetime, timedelta
 from fastapi import HTTPException
 from openai import OpenAI, RateLimitError, APIError, APITimeoutError, APIConnectionError
@@ -54,21 +55,25 @@ class RateLimitTracker:
         key = f"{provider}:{model}" if model else provider
         return self.usage.get(key, {}).get(today, 0)
 
-    def should_skip_provider(self, provider: str, model: str = None) -> bool:
-        """Проверяет, нужно ли пропустить провайдера из-за приближения к лимиту"""
-        if provider != "gemini":
-            return False  # Пока отслеживаем только Gemini
-
+    def snapshot(self, provider: str, model: str = None) -> Tuple[int, bool]:
+        """Возвращает (количество запросов сегодня, нужно ли пропустить провайдера) за одно чтение"""
         count = self.get_count(provider, model)
+        if provider != "gemini":
+            return count, False  # Пока отслеживаем только Gemini
 
         # Проверяем лимиты для Gemini моделей
         if model and "flash" in model.lower():
-            return count >= settings.GEMINI_FLASH_LIMIT
+            limit = settings.GEMINI_FLASH_LIMIT
         elif model and "pro" in model.lower():
-            return count >= settings.GEMINI_PRO_LIMIT
+            limit = settings.GEMINI_PRO_LIMIT
+        else:
+            # По умолчанию для Gemini используем Flash лимит
+            limit = settings.GEMINI_FLASH_LIMIT
+        return count, count >= limit
 
-        # По умолчанию для Gemini используем Flash лимит
-        return count >= settings.GEMINI_FLASH_LIMIT
+    def should_skip_provider(self, provider: str, model: str = None) -> bool:
+        """Проверяет, нужно ли пропустить провайдера из-за приближения к лимиту"""
+        return self.snapshot(provider, model)[1]
 
     def cleanup_old_entries(self):
         """Очищает старые записи (старше 2 дней)"""
@@ -158,10 +163,14 @@ def get_cache_key(requirements_text: str, prefix: str = "ai_map") -> str:
     return f"{prefix}:{text_hash}"
 
 
+@functools.lru_cache(maxsize=32)
 def _get_model_for_provider(provider: str, is_enhancement: bool = False, task_type: str = None) -> str:
     """
     Возвращает модель для конкретного провайдера с учетом типа задачи
 
+    Результат кешируется: модели задаются settings/env при старте. При изменении
+    конфигурации в рантайме нужно вызвать _get_model_for_provider.cache_clear().
+
     Args:
         provider: Имя провайдера (gemini, groq, perplexity, openai)
         is_enhancement: True для Stage 1 (Enhancement)
@@ -1028,6 +1037,42 @@ def generate_markdown_wireframe(project_snapshot: dict, timeout: float = 60.0) -
         raise HTTPException(status_code=502, detail=f"Wireframe generation failed: {error_msg}")
 
 
+def generate_ai_response(prompt: str, temperature: float = 0.7, timeout: float = 60.0) -> str:
+    """
+    Текстовый ответ AI на произвольный промпт (с fallback между провайдерами).
+    Используется воркерами, которые сами собирают промпт и разбирают ответ.
+
+    Args:
+        prompt: текст запроса (user message)
+        temperature: температура генерации
+        timeout: таймаут запроса к AI
+
+    Returns:
+        str: текст ответа без пробелов по краям
+    """
+    available_providers = settings.get_available_providers()
+    if not available_providers:
+        raise HTTPException(
+            status_code=503,
+            detail="AI API key not configured. Set GROQ_API_KEY, PERPLEXITY_API_KEY, or OPENAI_API_KEY environment variable."
+        )
+
+    request_params = {
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": temperature,
+        "timeout": timeout,
+    }
+
+    completion, used_provider = _make_request_with_fallback(
+        request_params,
+        providers=available_providers,
+        is_enhancement=False,
+        task_type="generation",
+    )
+    logger.info(f"✅ AI response received from {used_provider.upper()}")
+    return (completion.choices[0].message.content or "").strip()
+
+
 def ai_improve_story_content(
     story_data: dict,
     user_prompt: str,
@@ -1,9 +1,14 @@
 """
 Authentication service - бизнес-логика для аутентификации
 """
+import hmac
 import secrets
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Optional, Tuple
+from sqlalchemy import bindparam, select
 from sqlalchemy.orm import Session
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -14,10 +19,66 @@ from models import User, RefreshToken
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Кеш результатов bcrypt-проверки: bcrypt намеренно дорогой (~50-100ms),
+# а при повторных логинах одна и та же пара (пароль, хеш) проверяется снова и снова.
+# Ключ - HMAC от пары, сам пароль в памяти не хранится.
+_VERIFY_CACHE_MAXSIZE = 1024
+_VERIFY_CACHE_TTL = 60.0  # секунд для успешных проверок
+_VERIFY_CACHE_NEGATIVE_TTL = 5.0  # неуспешные проверки кешируем совсем недолго
+_verify_cache: "OrderedDict[bytes, Tuple[bool, float]]" = OrderedDict()
+_verify_cache_lock = threading.Lock()
+
+# Кеш декодированных access токенов: token -> (user_id, exp_epoch).
+# Один и тот же bearer токен предъявляется весь срок жизни, поэтому проверку
+# подписи достаточно выполнить один раз. Запись живет до exp самого токена.
+_JWT_CACHE_MAXSIZE = 4096
+_jwt_cache: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+_jwt_cache_lock = threading.Lock()
+
+# Предсобранный запрос пользователя по email (без построения ORM-запроса на каждый логин)
+_USER_BY_EMAIL_STMT = select(User).where(User.email == bindparam("email"))
+
+# LRU email -> user_id для частых логинов. Сам пользователь берется через db.get(),
+# который сначала смотрит в identity map сессии. Кешируются только найденные
+# пользователи; после создания/изменения пользователя запись сбрасывается через
+# invalidate_user_cache, а запись на удаленный или чужой id отбрасывается при чтении.
+_USER_ID_CACHE_MAXSIZE = 1024
+_USER_ID_CACHE_TTL = 300.0  # секунд
+_user_id_cache: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+_user_id_cache_lock = threading.Lock()
+
+
+def _verify_cache_key(plain_password: str, hashed_password: str) -> bytes:
+    """HMAC-ключ для кеша проверок (секрет процесса - JWT_SECRET_KEY)"""
+    message = plain_password.encode() + b"\x00" + hashed_password.encode()
+    return hmac.new(settings.JWT_SECRET_KEY.encode(), message, "sha256").digest()
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Проверяет пароль"""
-    return pwd_context.verify(plain_password, hashed_password)
+    """Проверяет пароль (с коротким TTL-кешем результатов bcrypt)"""
+    key = _verify_cache_key(plain_password, hashed_password)
+    now = time.monotonic()
+
+    with _verify_cache_lock:
+        cached = _verify_cache.get(key)
+        if cached is not None:
+            result, expires_at = cached
+            if expires_at > now:
+                _verify_cache.move_to_end(key)
+                return result
+            del _verify_cache[key]
+
+    # Сам bcrypt выполняем вне блокировки - он CPU-bound и долгий
+    result = pwd_context.verify(plain_password, hashed_password)
+    ttl = _VERIFY_CACHE_TTL if result else _VERIFY_CACHE_NEGATIVE_TTL
+
+    with _verify_cache_lock:
+        _verify_cache[key] = (result, now + ttl)
+        _verify_cache.move_to_end(key)
+        while len(_verify_cache) > _VERIFY_CACHE_MAXSIZE:
+            _verify_cache.popitem(last=False)
+
+    return result
 
 
 def get_password_hash(password: str) -> str:
@@ -42,8 +103,9 @@ def create_refresh_token(user_id: int, db: Session) -> str:
     expires_delta = timedelta(days=settings.JWT_REFRESH_TOKEN_EXPIRE_DAYS)
     expire = datetime.now(timezone.utc) + expires_delta
     
-    # Генерируем случайный токен
-    token_str = secrets.token_urlsafe(64)
+    # Генерируем случайный токен (256 бит энтропии, 43 символа base64url).
+    # Поиск идет по уникальному индексу RefreshToken.token - короче строка, меньше индекс
+    token_str = secrets.token_urlsafe(32)
     
     refresh_token = RefreshToken(
         user_id=user_id,
@@ -52,14 +114,42 @@ def create_refresh_token(user_id: int, db: Session) -> str:
     )
     db.add(refresh_token)
     db.commit()
-    db.refresh(refresh_token)
     
     return token_str
 
 
+def invalidate_user_cache(email: str) -> None:
+    """Сбрасывает закешированный user_id для email (после создания/изменения пользователя)"""
+    with _user_id_cache_lock:
+        _user_id_cache.pop(email, None)
+
+
 def get_user_by_email(db: Session, email: str) -> Optional[User]:
     """Находит пользователя по email"""
-    return db.query(User).filter(User.email == email).first()
+    now = time.monotonic()
+    with _user_id_cache_lock:
+        cached = _user_id_cache.get(email)
+        if cached is not None and cached[1] <= now:
+            del _user_id_cache[email]
+            cached = None
+        elif cached is not None:
+            _user_id_cache.move_to_end(email)
+
+    if cached is not None:
+        user = db.get(User, cached[0])
+        if user is not None and user.email == email:
+            return user
+        # Пользователь удален или id переиспользован - запись устарела
+        invalidate_user_cache(email)
+
+    user = db.execute(_USER_BY_EMAIL_STMT, {"email": email}).scalars().first()
+    if user is not None:
+        with _user_id_cache_lock:
+            _user_id_cache[email] = (user.id, now + _USER_ID_CACHE_TTL)
+            _user_id_cache.move_to_end(email)
+            while len(_user_id_cache) > _USER_ID_CACHE_MAXSIZE:
+                _user_id_cache.popitem(last=False)
+    return user
 
 
 def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
@@ -80,12 +170,32 @@ def decode_access_token(token: str) -> int:
         headers={"WWW-Authenticate": "Bearer"},
     )
     
+    with _jwt_cache_lock:
+        cached = _jwt_cache.get(token)
+        if cached is not None:
+            user_id, exp_epoch = cached
+            if exp_epoch > time.time():
+                _jwt_cache.move_to_end(token)
+                return user_id
+            del _jwt_cache[token]
+
     try:
         payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
         user_id_str: str = payload.get("sub")
         if user_id_str is None:
             raise credentials_exception
-        return int(user_id_str)
+        user_id = int(user_id_str)
     except (JWTError, ValueError) as e:
+        # Ошибки декодирования никогда не кешируем
         raise credentials_exception
 
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)):
+        with _jwt_cache_lock:
+            _jwt_cache[token] = (user_id, float(exp))
+            _jwt_cache.move_to_end(token)
+            while len(_jwt_cache) > _JWT_CACHE_MAXSIZE:
+                _jwt_cache.popitem(last=False)
+
+    return user_id
+
@@ -4,7 +4,9 @@ Queue provider abstraction to allow switching drivers (Redis → RabbitMQ in fut
 Current implementation: Redis + RQ.
 """
 import logging
-from typing import Optional
+import threading
+import time
+from typing import Iterable, List, Optional, Sequence
 
 from fastapi import HTTPException
 
@@ -12,6 +14,9 @@ from config import settings
 
 logger = logging.getLogger(__name__)
 
+# Максимум команд в одном pipeline при пакетной постановке задач
+ENQUEUE_BATCH_SIZE = 10000
+
 try:
     import redis  # type: ignore
     from rq import Queue  # type: ignore
@@ -23,6 +28,35 @@ except ImportError as e:  # pragma: no cover - ImportError handled at runtime
     Job = None
     logger.warning(f"RQ not installed: {e}")
 
+# Один пул соединений на процесс вместо нового пула на каждый QueueAdapter
+REDIS_MAX_CONNECTIONS = 50
+REDIS_HEALTH_CHECK_INTERVAL = 30  # секунд
+PING_INTERVAL = 30.0  # секунд между явными PING
+
+_pool = None
+_pool_lock = threading.Lock()
+_last_ping_ts = 0.0
+
+
+def _get_connection_pool():
+    """Лениво создает общий redis.ConnectionPool (с TLS для rediss://)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                redis_url = settings.REDIS_URL
+                pool_kwargs = {
+                    "max_connections": REDIS_MAX_CONNECTIONS,
+                    "socket_keepalive": True,
+                    "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+                    "decode_responses": False,  # RQ требует bytes
+                }
+                # Для Upstash (rediss://) не требуется проверка сертификата
+                if redis_url.startswith("rediss://"):
+                    pool_kwargs["ssl_cert_reqs"] = None
+                _pool = redis.ConnectionPool.from_url(redis_url, **pool_kwargs)
+    return _pool
+
 
 class QueueAdapter:
     """Thin adapter to hide queue driver specifics."""
@@ -40,23 +74,13 @@ class QueueAdapter:
                 )
             try:
                 # Поддержка TLS для Upstash и других провайдеров
-                redis_url = settings.REDIS_URL
-                
-                # Если URL начинается с rediss://, используем SSL
-                use_ssl = redis_url.startswith("rediss://")
-                
-                # Парсим URL для правильной настройки соединения
-                self.connection = redis.from_url(
-                    redis_url,
-                    ssl=use_ssl,
-                    ssl_cert_reqs=None,  # Для Upstash не требуется проверка сертификата
-                    decode_responses=False  # RQ требует bytes
-                )
+                use_ssl = settings.REDIS_URL.startswith("rediss://")
+                self.connection = redis.Redis(connection_pool=_get_connection_pool())
                 
-                # Проверяем соединение с таймаутом
-                self.connection.ping()
+                # Проверяем соединение не чаще раза в PING_INTERVAL
+                self._ping_if_stale()
                 self.queue = Queue("wireframes", connection=self.connection, default_timeout=90)
-                logger.info(f"✅ QueueAdapter initialized with Redis RQ (TLS: {use_ssl})")
+                logger.debug(f"QueueAdapter initialized with Redis RQ (TLS: {use_ssl})")
             except redis.exceptions.ConnectionError as e:
                 logger.error(f"❌ Redis connection error: {e}")
                 raise HTTPException(
@@ -78,6 +102,15 @@ class QueueAdapter:
         else:
             raise HTTPException(status_code=503, detail=f"Queue driver '{driver}' is not supported yet.")
 
+    def _ping_if_stale(self) -> None:
+        """PING Redis, если с последней успешной проверки прошло больше PING_INTERVAL"""
+        global _last_ping_ts
+        now = time.monotonic()
+        if now - _last_ping_ts < PING_INTERVAL:
+            return
+        self.connection.ping()
+        _last_ping_ts = now
+
     def enqueue(self, func, *args, **kwargs):
         if not self.queue:
             raise HTTPException(status_code=503, detail="Queue is not initialized")
@@ -86,6 +119,24 @@ class QueueAdapter:
         job = self.queue.enqueue(func, *args, retry=retry, **kwargs)
         return job
 
+    def enqueue_many(self, func, args_list: Iterable[Sequence], **kwargs) -> List[Job]:
+        """
+        Ставит в очередь несколько задач одной функции.
+        Задачи отправляются через redis pipeline (один RTT на пачку), а не по одной.
+        """
+        if not self.queue:
+            raise HTTPException(status_code=503, detail="Queue is not initialized")
+        retry = kwargs.pop("retry", Retry(max=3, interval=[1, 2, 2]))
+        job_datas = [
+            Queue.prepare_data(func, args=tuple(args), retry=retry, **kwargs)
+            for args in args_list
+        ]
+
+        jobs: List[Job] = []
+        for start in range(0, len(job_datas), ENQUEUE_BATCH_SIZE):
+            jobs.extend(self.queue.enqueue_many(job_datas[start:start + ENQUEUE_BATCH_SIZE]))
+        return jobs
+
     def get_job(self, job_id: str) -> Optional[Job]:
         if not Job or not self.connection:
             return None
@@ -94,3 +145,15 @@ class QueueAdapter:
         except Exception:
             return None
 
+    def get_jobs(self, job_ids: Sequence[str]) -> List[Optional[Job]]:
+        """
+        Получает несколько задач за один RTT (pipelined HGETALL через Job.fetch_many).
+        Для отсутствующих задач возвращает None на соответствующей позиции.
+        """
+        if not Job or not self.connection:
+            return [None] * len(job_ids)
+        try:
+            return Job.fetch_many(list(job_ids), connection=self.connection)
+        except Exception:
+            return [None] * len(job_ids)
+
@@ -3,8 +3,11 @@
 """
 import logging
 import re
-from typing import List, Dict, Tuple, Optional
-from collections import defaultdict
+from typing import List, Dict, Tuple, Optional, Union
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags, issparse, spmatrix
+from scipy.sparse.csgraph import connected_components
 
 from models import Project, UserStory
 from schemas.analysis import (
@@ -19,21 +22,27 @@ logger = logging.getLogger(__name__)
 
 # Попытка импорта sklearn - может быть не установлен
 try:
-    from sklearn.feature_extraction.text import TfidfVectorizer
-    from sklearn.metrics.pairwise import cosine_similarity
+    from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
     SKLEARN_AVAILABLE = True
 except ImportError:
     SKLEARN_AVAILABLE = False
     logger.warning("scikit-learn not installed. Using fallback similarity algorithm.")
 
+# Numba (опционально) - JIT-ядро для Jaccard fallback на битовых масках
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 
 # Русские стоп-слова для TF-IDF
-RUSSIAN_STOP_WORDS = [
+RUSSIAN_STOP_WORDS = frozenset([
     'и', 'в', 'во', 'не', 'что', 'он', 'на', 'я', 'с', 'со', 'как', 'а', 'то', 'все',
     'она', 'так', 'его', 'но', 'да', 'ты', 'к', 'у', 'же', 'вы', 'за', 'бы', 'по',
     'только', 'её', 'мне', 'было', 'вот', 'от', 'меня', 'еще', 'нет', 'о', 'из',
     'ему', 'теперь', 'когда', 'уже', 'вам', 'ни', 'быть', 'был', 'него', 'до',
-    'вас', 'нибудь', 'опять', 'уж', 'вам', 'ведь', 'там', 'потом', 'себя', 'ничего',
+    'вас', 'нибудь', 'опять', 'уж', 'ведь', 'там', 'потом', 'себя', 'ничего',
     'ей', 'может', 'они', 'тут', 'где', 'есть', 'надо', 'ней', 'для', 'мы', 'тебя',
     'их', 'чем', 'была', 'сам', 'чтоб', 'без', 'будто', 'чего', 'раз', 'тоже', 'себе',
     'под', 'будет', 'ж', 'тогда', 'кто', 'этот', 'того', 'потому', 'этого', 'какой',
@@ -44,8 +53,24 @@ RUSSIAN_STOP_WORDS = [
     'впрочем', 'хорошо', 'свою', 'этой', 'перед', 'иногда', 'лучше', 'чуть', 'том',
     'нельзя', 'такой', 'им', 'более', 'всегда', 'конечно', 'всю', 'между',
     # User Story специфичные
-    'как', 'хочу', 'чтобы', 'могу', 'пользователь', 'система', 'должен', 'должна'
-]
+    'хочу', 'могу', 'пользователь', 'система', 'должен', 'должна'
+])
+
+# Предкомпилированный regex токенов
+_RE_TOKENS = re.compile(r'\w+')
+
+# Доля документов, выше которой термин считается неинформативным (аналог max_df)
+TFIDF_MAX_DF = 0.95
+
+# HashingVectorizer не хранит словарь и не требует fit - создаем один раз
+if SKLEARN_AVAILABLE:
+    _hashing_vectorizer = HashingVectorizer(
+        stop_words=sorted(RUSSIAN_STOP_WORDS),  # параметр sklearn принимает только list
+        ngram_range=(1, 2),  # Униграммы и биграммы
+        n_features=2 ** 18,
+        alternate_sign=False,
+        norm=None
+    )
 
 
 def preprocess_text(text: str) -> str:
@@ -53,16 +78,9 @@ def preprocess_text(text: str) -> str:
     if not text:
         return ""
     
-    # Приводим к нижнему регистру
-    text = text.lower()
-    
-    # Убираем специальные символы, оставляем только буквы и пробелы
-    text = re.sub(r'[^\w\s]', ' ', text)
-    
-    # Убираем множественные пробелы
-    text = re.sub(r'\s+', ' ', text)
-    
-    return text.strip()
+    # Нижний регистр + один проход regex: спецсимволы и лишние пробелы
+    # отбрасываются сами, т.к. findall возвращает только слова
+    return ' '.join(_RE_TOKENS.findall(text.lower()))
 
 
 def get_story_text(story: UserStory) -> str:
@@ -78,75 +96,173 @@ def get_story_text(story: UserStory) -> str:
     return " ".join(parts)
 
 
-def calculate_similarity_tfidf(texts: List[str]) -> List[List[float]]:
+def calculate_similarity_tfidf(
+    texts: List[str],
+    similarity_threshold: float = 0.0
+) -> Union[np.ndarray, csr_matrix]:
     """
     Рассчитывает матрицу схожести через TF-IDF + Cosine Similarity
     
+    Args:
+        texts: Предобработанные тексты историй
+        similarity_threshold: Порог группировки. Истории, у которых схожесть
+            заведомо ниже порога со всеми остальными, не участвуют в умножении
+            (их строки в результате пустые - они все равно не попадут в группы)
+    
     Returns:
-        Матрица схожести NxN
+        Матрица схожести NxN: разреженная CSR (TF-IDF) или np.ndarray (fallback)
     """
     if not SKLEARN_AVAILABLE:
         return calculate_similarity_fallback(texts)
     
     if len(texts) < 2:
-        return [[1.0]]
-    
-    # Создаем TF-IDF векторизатор
-    vectorizer = TfidfVectorizer(
-        stop_words=RUSSIAN_STOP_WORDS,
-        ngram_range=(1, 2),  # Униграммы и биграммы
-        min_df=1,
-        max_df=0.95
-    )
+        return np.ones((1, 1))
     
     try:
-        # Векторизуем тексты
-        tfidf_matrix = vectorizer.fit_transform(texts)
+        # Векторизуем тексты (счетчики термов без построения словаря)
+        counts = _hashing_vectorizer.transform(texts)
+        
+        # Отбрасываем термины, встречающиеся почти во всех документах (max_df)
+        doc_freq = np.bincount(counts.indices, minlength=counts.shape[1])
+        too_common = doc_freq > TFIDF_MAX_DF * len(texts)
+        if too_common.any():
+            counts.data[too_common[counts.indices]] = 0
+            counts.eliminate_zeros()
+        if counts.nnz == 0:
+            raise ValueError("After pruning, no terms remain")
         
-        # Рассчитываем косинусное сходство
-        similarity_matrix = cosine_similarity(tfidf_matrix)
+        tfidf_matrix = TfidfTransformer().fit_transform(counts)
+        tfidf_matrix = _prune_by_upper_bound(tfidf_matrix, similarity_threshold)
         
-        return similarity_matrix.tolist()
+        # Строки уже L2-нормированы, поэтому косинусное сходство = X @ X.T.
+        # Результат остается разреженным: пары без общих термов не хранятся.
+        return (tfidf_matrix @ tfidf_matrix.T).tocsr()
     except Exception as e:
         logger.warning(f"TF-IDF calculation failed: {e}. Using fallback.")
         return calculate_similarity_fallback(texts)
 
 
-def calculate_similarity_fallback(texts: List[str]) -> List[List[float]]:
+def _prune_by_upper_bound(tfidf_matrix: csr_matrix, similarity_threshold: float) -> csr_matrix:
+    """
+    Обнуляет строки, которые не могут дать схожесть >= порога ни с одной историей.
+
+    Для неотрицательных векторов x·y <= max(x) * sum(y), поэтому
+    cos(i, j) <= min(max_i * max_{j!=i}(sum_j), sum_i * max_{j!=i}(max_j)) - оценка
+    за O(nnz), без вычисления скалярных произведений. Сама строка i в максимум не
+    входит: для L2-нормированной строки max_i * sum_i >= 1, и оценка ничего бы не отсекала.
+    """
+    if similarity_threshold <= 0 or tfidf_matrix.shape[0] < 2:
+        return tfidf_matrix
+    
+    row_max = tfidf_matrix.max(axis=1).toarray().ravel()
+    row_sum = np.asarray(tfidf_matrix.sum(axis=1)).ravel()
+    upper_bound = np.minimum(row_max * _max_of_others(row_sum), row_sum * _max_of_others(row_max))
+    
+    candidates = upper_bound >= similarity_threshold
+    if candidates.all():
+        return tfidf_matrix
+    return (diags(candidates.astype(np.float64)) @ tfidf_matrix).tocsr()
+
+
+def _max_of_others(values: np.ndarray) -> np.ndarray:
+    """Для каждого элемента - максимум по всем остальным (два наибольших значения, O(n))."""
+    second, first = np.partition(values, -2)[-2:]
+    result = np.full_like(values, first)
+    result[np.argmax(values)] = second
+    return result
+
+
+if NUMBA_AVAILABLE:
+    # Константы uint64, чтобы numba не приводила битовые операции к float
+    _M1 = np.uint64(0x5555555555555555)
+    _M2 = np.uint64(0x3333333333333333)
+    _M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+    _H01 = np.uint64(0x0101010101010101)
+    _S1 = np.uint64(1)
+    _S2 = np.uint64(2)
+    _S4 = np.uint64(4)
+    _S56 = np.uint64(56)
+
+    @njit(cache=True)
+    def _popcount64(x):
+        """Количество установленных бит в uint64 (SWAR)"""
+        x = x - ((x >> _S1) & _M1)
+        x = (x & _M2) + ((x >> _S2) & _M2)
+        x = (x + (x >> _S4)) & _M4
+        return np.int64((x * _H01) >> _S56)
+
+    @njit(parallel=True, cache=True)
+    def _jaccard_bitmaps(bitmaps):
+        """Матрица Jaccard по битовым маскам токенов (истории × слова uint64)"""
+        n, words = bitmaps.shape
+        matrix = np.zeros((n, n))
+        for i in prange(n):
+            matrix[i, i] = 1.0
+            for j in range(i + 1, n):
+                intersection = 0
+                union = 0
+                for w in range(words):
+                    a = bitmaps[i, w]
+                    b = bitmaps[j, w]
+                    intersection += _popcount64(a & b)
+                    union += _popcount64(a | b)
+                if union > 0:
+                    similarity = intersection / union
+                    matrix[i, j] = similarity
+                    matrix[j, i] = similarity
+        return matrix
+
+
+def _pack_bitmaps(occurrence: np.ndarray) -> np.ndarray:
+    """Упаковывает бинарную матрицу вхождений в uint64 битовые маски по строкам"""
+    packed = np.packbits(occurrence, axis=1)
+    pad = (-packed.shape[1]) % 8
+    if pad:
+        packed = np.pad(packed, ((0, 0), (0, pad)))
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+
+def calculate_similarity_fallback(texts: List[str]) -> np.ndarray:
     """
     Fallback алгоритм схожести на основе Jaccard similarity
     Используется если sklearn не установлен
     """
     n = len(texts)
     if n == 0:
-        return []
+        return np.zeros((0, 0))
     
     # Токенизируем тексты
     tokenized = []
     for text in texts:
-        words = set(preprocess_text(text).split())
+        words = set(_RE_TOKENS.findall(text.lower())) if text else set()
         # Убираем стоп-слова
-        words = words - set(RUSSIAN_STOP_WORDS)
+        words = words - RUSSIAN_STOP_WORDS
         tokenized.append(words)
     
-    # Рассчитываем Jaccard similarity
-    matrix = [[0.0] * n for _ in range(n)]
-    
-    for i in range(n):
-        for j in range(n):
-            if i == j:
-                matrix[i][j] = 1.0
-            elif i < j:
-                set1, set2 = tokenized[i], tokenized[j]
-                if not set1 or not set2:
-                    similarity = 0.0
-                else:
-                    intersection = len(set1 & set2)
-                    union = len(set1 | set2)
-                    similarity = intersection / union if union > 0 else 0.0
-                
-                matrix[i][j] = similarity
-                matrix[j][i] = similarity
+    # Бинарная матрица вхождений токенов (истории × словарь)
+    vocab: Dict[str, int] = {}
+    for words in tokenized:
+        for word in words:
+            vocab.setdefault(word, len(vocab))
+    
+    occurrence = np.zeros((n, len(vocab)), dtype=np.uint8)
+    for i, words in enumerate(tokenized):
+        if words:
+            occurrence[i, [vocab[w] for w in words]] = 1
+    
+    if NUMBA_AVAILABLE:
+        return _jaccard_bitmaps(_pack_bitmaps(occurrence))
+    
+    # Jaccard для всех пар за одно матричное умножение:
+    # |A ∩ B| = M @ M.T, |A ∪ B| = |A| + |B| - |A ∩ B|
+    occurrence = occurrence.astype(np.int32)
+    intersection = occurrence @ occurrence.T
+    row_sums = occurrence.sum(axis=1)
+    union = row_sums[:, None] + row_sums[None, :] - intersection
+    
+    matrix = np.zeros((n, n), dtype=np.float64)
+    np.divide(intersection, union, out=matrix, where=union > 0)
+    np.fill_diagonal(matrix, 1.0)
     
     return matrix
 
@@ -197,7 +313,7 @@ def analyze_similarity(
     texts = [preprocess_text(sd["text"]) for sd in stories_data]
     
     # Рассчитываем матрицу схожести
-    similarity_matrix = calculate_similarity_tfidf(texts)
+    similarity_matrix = calculate_similarity_tfidf(texts, similarity_threshold)
     
     # Находим группы похожих историй
     similar_groups = find_similar_groups(
@@ -231,7 +347,7 @@ def analyze_similarity(
 
 def find_similar_groups(
     stories_data: List[Dict],
-    similarity_matrix: List[List[float]],
+    similarity_matrix: Union[np.ndarray, spmatrix],
     similarity_threshold: float,
     duplicate_threshold: float
 ) -> List[SimilarityGroup]:
@@ -239,76 +355,58 @@ def find_similar_groups(
     Находит группы похожих историй на основе матрицы схожести
     
     Использует алгоритм:
-    1. Находим все пары с similarity >= threshold
-    2. Группируем связанные истории (union-find)
+    1. Находим все пары с similarity >= threshold (матрица смежности)
+    2. Группируем связанные истории (connected components)
     3. Классифицируем группы как duplicates или similar
     """
-    n = len(stories_data)
     groups: List[SimilarityGroup] = []
     
-    # Union-Find для группировки
-    parent = list(range(n))
-    
-    def find(x):
-        if parent[x] != x:
-            parent[x] = find(parent[x])
-        return parent[x]
-    
-    def union(x, y):
-        px, py = find(x), find(y)
-        if px != py:
-            parent[px] = py
-    
-    # Находим пары с высокой схожестью
-    pairs_with_similarity: List[Tuple[int, int, float]] = []
-    
-    for i in range(n):
-        for j in range(i + 1, n):
-            sim = similarity_matrix[i][j]
-            if sim >= similarity_threshold:
-                union(i, j)
-                pairs_with_similarity.append((i, j, sim))
-    
-    # Группируем по компонентам
-    components: Dict[int, List[int]] = defaultdict(list)
-    for i in range(n):
-        components[find(i)].append(i)
-    
-    # Формируем группы
-    for component_id, indices in components.items():
+    # Граф: ребро между историями со схожестью выше порога
+    if issparse(similarity_matrix):
+        sim = csr_matrix(similarity_matrix)
+        adjacency = sim.copy()
+        adjacency.data = (adjacency.data >= similarity_threshold).astype(np.int8)
+        adjacency.eliminate_zeros()
+    else:
+        sim = np.asarray(similarity_matrix, dtype=np.float64)
+        adjacency = csr_matrix(np.triu(sim >= similarity_threshold, k=1))
+    n_components, labels = connected_components(adjacency, directed=False)
+    
+    # Формируем группы (компоненты нумеруются в порядке первой истории)
+    for component_id in range(n_components):
+        indices = np.flatnonzero(labels == component_id)
         if len(indices) < 2:
             continue
         
-        # Определяем тип группы (duplicate или similar)
-        max_similarity = 0.0
-        for i, idx1 in enumerate(indices):
-            for idx2 in indices[i + 1:]:
-                sim = similarity_matrix[idx1][idx2]
-                max_similarity = max(max_similarity, sim)
+        # Компоненты небольшие - для них достаточно плотной подматрицы
+        if issparse(sim):
+            sub = sim[indices][:, indices].toarray()
+        else:
+            sub = sim[np.ix_(indices, indices)]
+        
+        # Определяем тип группы (duplicate или similar): максимум по парам без диагонали
+        upper = sub[np.triu_indices(len(indices), k=1)]
+        max_similarity = float(upper.max())
         
         is_duplicate = max_similarity >= duplicate_threshold
         group_type = "duplicate" if is_duplicate else "similar"
         
+        # Средняя схожесть каждой истории с остальными в группе: диагональ обнуляем
+        # (sub - копия), чтобы суммировать только значения вне диагонали
+        np.fill_diagonal(sub, 0.0)
+        avg_sims = sub.sum(axis=1) / (len(indices) - 1)
+        
         # Формируем список историй в группе
         similar_stories = []
-        for idx in indices:
+        for idx, avg_sim in zip(indices, avg_sims):
             sd = stories_data[idx]
             story = sd["story"]
             
-            # Находим среднюю схожесть с остальными в группе
-            avg_sim = 0.0
-            count = 0
-            for other_idx in indices:
-                if other_idx != idx:
-                    avg_sim += similarity_matrix[idx][other_idx]
-                    count += 1
-            avg_sim = avg_sim / count if count > 0 else 1.0
-            
             similar_stories.append(SimilarStory(
                 id=story.id,
                 title=story.title,
                 description=story.description,
-                similarity=round(avg_sim, 2),
+                similarity=round(float(avg_sim), 2),
                 task_title=sd["task_title"],
                 activity_title=sd["activity_title"]
             ))
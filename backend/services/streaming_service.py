@@ -10,22 +10,42 @@ Streaming Service для SSE (Server-Sent Events) генерации User Story
 Отправляет SSE события клиенту в реальном времени.
 """
 
-import json
 import logging
 import asyncio
-from typing import AsyncGenerator, Optional, Dict, Any
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncGenerator, Optional, Dict, Any, List
+
+import orjson
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 
-from services.ai_service import enhance_requirements, generate_ai_map, generate_map_with_agent
+from services.ai_service import enhance_requirements, generate_ai_map
+from services.agent_service import generate_map_with_agent
 from services.validation_service import validate_project_map
 from services.similarity_service import analyze_similarity
-from models import Project, Release, Activity, Task, Story
-from config import get_redis_client
+from models import Project, Release, Activity, UserTask as Task, UserStory as Story
+from utils.redis_client import get_redis_client
 
 logger = logging.getLogger(__name__)
 
+# Отдельный пул для CPU-bound анализа (валидация, TF-IDF/similarity), чтобы он не
+# конкурировал с долгими I/O вызовами AI в дефолтном executor. NumPy/SciPy
+# отпускают GIL в матричных операциях, поэтому потоков достаточно.
+CPU_EXECUTOR = ThreadPoolExecutor(
+    max_workers=os.cpu_count() or 1,
+    thread_name_prefix="sse-analysis"
+)
+
+# Сколько готовых SSE событий может ждать медленного клиента
+SSE_QUEUE_SIZE = 16
+
+# Обрамление SSE события - байтовые константы, чтобы не собирать их на каждый event
+DATA_PREFIX = b"data: "
+SSE_SUFFIX = b"\n\n"
 
-def sse_event(event_type: str, data: Dict[str, Any]) -> str:
+
+def sse_event(event_type: str, data: Dict[str, Any]) -> bytes:
     """
     Форматирует SSE event.
 
@@ -34,10 +54,22 @@ def sse_event(event_type: str, data: Dict[str, Any]) -> str:
         data: Данные события
 
     Returns:
-        Строка в формате SSE: "data: {...}\n\n"
+        Байты в формате SSE: b"data: {...}\n\n" (UTF-8, без \\u-экранирования)
     """
     payload = {"type": event_type, **data}
-    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    # join выделяет итоговый буфер один раз (два "+" создают промежуточную копию payload)
+    return b"".join((DATA_PREFIX, orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS), SSE_SUFFIX))
+
+
+# Неизменные события этапов сериализуются один раз при импорте
+_EVENT_ENHANCING = sse_event("enhancing", {"progress": 10, "stage": "enhancement"})
+_EVENT_GENERATING_20 = sse_event("generating", {"progress": 20, "stage": "generation"})
+_EVENT_GENERATING_30 = sse_event("generating", {"progress": 30, "stage": "generation"})
+_EVENT_GENERATING_60 = sse_event("generating", {"progress": 60, "stage": "generation"})
+_EVENT_VALIDATING_75 = sse_event("validating", {"progress": 75, "stage": "validation"})
+_EVENT_VALIDATING_80 = sse_event("validating", {"progress": 80})
+_EVENT_SAVING_90 = sse_event("saving", {"progress": 90, "stage": "saving"})
+_EVENT_SAVING_95 = sse_event("saving", {"progress": 95})
 
 
 async def generate_map_streaming(
@@ -46,7 +78,7 @@ async def generate_map_streaming(
     use_agent: bool,
     user_id: int,
     db: Session
-) -> AsyncGenerator[str, None]:
+) -> AsyncGenerator[bytes, None]:
     """
     Async генератор для SSE streaming генерации карты.
 
@@ -70,6 +102,56 @@ async def generate_map_streaming(
         - {type: "complete", project_id: int, project_name: str}
         - {type: "error", message: str}
     """
+    # Генерация идет в отдельной задаче и складывает события в ограниченную очередь:
+    # если клиент читает медленно, продюсер ждет на put и события не копятся в памяти
+    queue: asyncio.Queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+    producer = asyncio.create_task(_produce_events(
+        queue,
+        _generate_map_events(requirements_text, use_enhancement, use_agent, user_id, db)
+    ))
+    try:
+        while (event := await queue.get()) is not None:
+            yield event
+            await _yield_to_event_loop()
+        await producer  # пробрасывает исключение продюсера, если оно было
+    finally:
+        # Клиент отключился - останавливаем генерацию
+        if not producer.done():
+            producer.cancel()
+
+
+async def _yield_to_event_loop() -> None:
+    """
+    Отдает управление event loop после каждого события: иначе соседние
+    yield без await между ними Starlette/Uvicorn склеивают в одну запись
+    в сокет, и прогресс доходит до клиента пачками.
+    """
+    await asyncio.sleep(0)
+
+
+async def _produce_events(queue: asyncio.Queue, events: AsyncGenerator[bytes, None]) -> None:
+    """Перекладывает события в очередь; None в конце - сигнал потребителю."""
+    try:
+        async for event in events:
+            await queue.put(event)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        await queue.put(None)
+        raise
+    finally:
+        await events.aclose()
+    await queue.put(None)
+
+
+async def _generate_map_events(
+    requirements_text: str,
+    use_enhancement: bool,
+    use_agent: bool,
+    user_id: int,
+    db: Session
+) -> AsyncGenerator[bytes, None]:
+    """Последовательность SSE событий генерации (см. generate_map_streaming)."""
 
     redis_client = get_redis_client()
     generation_text = requirements_text
@@ -79,7 +161,7 @@ async def generate_map_streaming(
         # ============= STAGE 1: ENHANCEMENT =============
         if use_enhancement:
             logger.info(f"[SSE] Stage 1: Enhancing requirements for user {user_id}")
-            yield sse_event("enhancing", {"progress": 10, "stage": "enhancement"})
+            yield _EVENT_ENHANCING
 
             # Запускаем в executor т.к. enhance_requirements синхронная
             loop = asyncio.get_event_loop()
@@ -103,16 +185,13 @@ async def generate_map_streaming(
                 "used_enhancement": generation_text != requirements_text,
                 "progress": 20
             })
-
-            # Небольшая задержка для UX (чтобы пользователь видел переход)
-            await asyncio.sleep(0.5)
         else:
             logger.info(f"[SSE] Stage 1 skipped (use_enhancement=False)")
-            yield sse_event("generating", {"progress": 20, "stage": "generation"})
+            yield _EVENT_GENERATING_20
 
         # ============= STAGE 2: AI GENERATION =============
         logger.info(f"[SSE] Stage 2: Generating map for user {user_id}")
-        yield sse_event("generating", {"progress": 30, "stage": "generation"})
+        yield _EVENT_GENERATING_30
 
         # Запускаем генерацию в executor
         loop = asyncio.get_event_loop()
@@ -130,19 +209,21 @@ async def generate_map_streaming(
                 lambda: generate_ai_map(generation_text, redis_client=redis_client)
             )
 
-        yield sse_event("generating", {"progress": 60, "stage": "generation"})
+        yield _EVENT_GENERATING_60
 
         # Парсим результат
         product_name = ai_result.get("productName", "Untitled Project")
         map_data = ai_result.get("map", {})
 
-        activities_count = len(map_data.get("activities", []))
-        tasks_count = sum(len(act.get("tasks", [])) for act in map_data.get("activities", []))
-        stories_count = sum(
-            len(task.get("stories", []))
-            for act in map_data.get("activities", [])
-            for task in act.get("tasks", [])
-        )
+        # Один проход по карте вместо трех вложенных sum(...)
+        activities = map_data.get("activities", [])
+        activities_count = len(activities)
+        tasks_count = stories_count = 0
+        for act in activities:
+            tasks = act.get("tasks", [])
+            tasks_count += len(tasks)
+            for task in tasks:
+                stories_count += len(task.get("stories", []))
 
         logger.info(f"[SSE] Generated: {activities_count} activities, {tasks_count} tasks, {stories_count} stories")
         yield sse_event("generating", {
@@ -152,30 +233,36 @@ async def generate_map_streaming(
             "stories": stories_count
         })
 
-        await asyncio.sleep(0.3)
-
         # ============= STAGE 3: VALIDATION & ANALYSIS =============
         logger.info(f"[SSE] Stage 3: Validating and analyzing")
-        yield sse_event("validating", {"progress": 75, "stage": "validation"})
+        yield _EVENT_VALIDATING_75
+
+        # Карта еще не сохранена: валидируем и анализируем ее несохраненную копию
+        project = _build_transient_project(product_name, map_data)
 
-        # Валидация (синхронная, запускаем в executor)
+        # Валидация (синхронная, запускаем в executor; db=None - граф уже в памяти)
         validation_result = await loop.run_in_executor(
-            None,
-            lambda: validate_project_map(map_data)
+            CPU_EXECUTOR,
+            validate_project_map,
+            project,
+            None
         )
 
-        yield sse_event("validating", {"progress": 80})
+        yield _EVENT_VALIDATING_80
 
         # Анализ дубликатов (синхронная, запускаем в executor)
         similarity_result = await loop.run_in_executor(
-            None,
-            lambda: analyze_similarity(map_data)
+            CPU_EXECUTOR,
+            analyze_similarity,
+            project
         )
 
-        duplicates_count = len(similarity_result.get("duplicate_groups", []))
-        similar_count = len(similarity_result.get("similar_groups", []))
-        overall_score = validation_result.get("overall_score", 0)
-        issues = validation_result.get("issues", [])
+        duplicates_count = sum(
+            1 for group in similarity_result.similar_groups if group.group_type == "duplicate"
+        )
+        similar_count = len(similarity_result.similar_groups) - duplicates_count
+        overall_score = validation_result.score
+        issues = [issue.message for issue in validation_result.issues]
 
         logger.info(f"[SSE] Analysis: score={overall_score}, duplicates={duplicates_count}, similar={similar_count}")
 
@@ -189,11 +276,9 @@ async def generate_map_streaming(
             "total_issues": len(issues)
         })
 
-        await asyncio.sleep(0.5)
-
         # ============= STAGE 4: SAVE TO DATABASE =============
         logger.info(f"[SSE] Stage 4: Saving to database")
-        yield sse_event("saving", {"progress": 90, "stage": "saving"})
+        yield _EVENT_SAVING_90
 
         # Сохраняем в БД (синхронная операция)
         project_id = await loop.run_in_executor(
@@ -209,9 +294,7 @@ async def generate_map_streaming(
         )
 
         logger.info(f"[SSE] Project saved with ID: {project_id}")
-        yield sse_event("saving", {"progress": 95})
-
-        await asyncio.sleep(0.3)
+        yield _EVENT_SAVING_95
 
         # ============= STAGE 5: COMPLETE =============
         logger.info(f"[SSE] Generation complete. Project ID: {project_id}")
@@ -237,6 +320,77 @@ async def generate_map_streaming(
         })
 
 
+def _bulk_insert_returning_ids(db: Session, model, rows: List[Dict[str, Any]]) -> List[int]:
+    """
+    Вставляет строки одним пакетным INSERT и возвращает их id в порядке rows.
+
+    Если диалект не умеет executemany + RETURNING с сохранением порядка,
+    используется bulk_save_objects(return_defaults=True).
+    """
+    if not rows:
+        return []
+
+    dialect = db.get_bind().dialect
+    if dialect.insert_executemany_returning_sort_by_parameter_order:
+        stmt = insert(model).returning(model.id, sort_by_parameter_order=True)
+        return list(db.execute(stmt, rows).scalars())
+
+    objects = [model(**row) for row in rows]
+    db.bulk_save_objects(objects, return_defaults=True)
+    return [obj.id for obj in objects]
+
+
+def _release_position(priority: str) -> int:
+    """Позиция дефолтного релиза (MVP, Release 1, Later) по priority истории от AI"""
+    if priority == "MVP":
+        return 0
+    if priority == "Release 1":
+        return 1
+    return 2
+
+
+def _build_transient_project(product_name: str, map_data: dict) -> Project:
+    """
+    Собирает карту от AI в несохраненный Project с дефолтными релизами.
+
+    Объекты не добавляются в сессию; id релизов и историй временные
+    (нужны валидации и анализу схожести, в БД не попадают).
+    """
+    releases = [
+        Release(id=position + 1, title=title, position=position)
+        for position, title in enumerate(("MVP", "Release 1", "Later"))
+    ]
+
+    story_id = 0
+    activities = []
+    for act_idx, act_data in enumerate(map_data.get("activities", [])):
+        tasks = []
+        for task_idx, task_data in enumerate(act_data.get("tasks", [])):
+            stories = []
+            for story_idx, story_data in enumerate(task_data.get("stories", [])):
+                story_id += 1
+                stories.append(Story(
+                    id=story_id,
+                    title=story_data.get("title", f"Story {story_idx + 1}"),
+                    description=story_data.get("description", ""),
+                    acceptance_criteria=story_data.get("acceptanceCriteria", []),
+                    release_id=_release_position(story_data.get("priority", "MVP")) + 1,
+                    position=story_idx,
+                ))
+            tasks.append(Task(
+                title=task_data.get("title", f"Task {task_idx + 1}"),
+                position=task_idx,
+                stories=stories,
+            ))
+        activities.append(Activity(
+            title=act_data.get("title", f"Activity {act_idx + 1}"),
+            position=act_idx,
+            tasks=tasks,
+        ))
+
+    return Project(name=product_name, releases=releases, activities=activities)
+
+
 def _save_project_to_db(
     product_name: str,
     raw_requirements: str,
@@ -260,11 +414,17 @@ def _save_project_to_db(
         ID созданного проекта
     """
 
-    # Создаем проект
+    # Создаем проект вместе с дефолтными релизами: один flush на оба INSERT
+    default_releases = [
+        Release(title="MVP", position=0),
+        Release(title="Release 1", position=1),
+        Release(title="Later", position=2)
+    ]
     new_project = Project(
         name=product_name,
         raw_requirements=raw_requirements,
-        user_id=user_id
+        user_id=user_id,
+        releases=default_releases
     )
 
     # Если было улучшение - сохраняем метаданные
@@ -273,62 +433,55 @@ def _save_project_to_db(
         new_project.enhancement_confidence = enhancement_data.get("confidence", 0)
 
     db.add(new_project)
-    db.flush()  # Получаем project.id
-
-    # Создаем дефолтные релизы
-    default_releases = [
-        Release(project_id=new_project.id, title="MVP", position=0),
-        Release(project_id=new_project.id, title="Release 1", position=1),
-        Release(project_id=new_project.id, title="Later", position=2)
-    ]
-    db.add_all(default_releases)
-    db.flush()
+    db.flush()  # Получаем project.id и id релизов
 
     # Маппинг позиций релизов на ID
     release_map = {r.position: r.id for r in default_releases}
 
-    # Создаем Activities → Tasks → Stories
+    # Создаем Activities → Tasks → Stories: по одному пакетному INSERT на уровень
     activities_data = map_data.get("activities", [])
 
-    for act_idx, act_data in enumerate(activities_data):
-        activity = Activity(
-            project_id=new_project.id,
-            title=act_data.get("title", f"Activity {act_idx + 1}"),
-            position=act_idx
-        )
-        db.add(activity)
-        db.flush()
+    activity_rows = [
+        {
+            "project_id": new_project.id,
+            "title": act_data.get("title", f"Activity {act_idx + 1}"),
+            "position": act_idx,
+        }
+        for act_idx, act_data in enumerate(activities_data)
+    ]
+    activity_ids = _bulk_insert_returning_ids(db, Activity, activity_rows)
 
+    task_rows = []
+    task_stories = []
+    for activity_id, act_data in zip(activity_ids, activities_data):
         for task_idx, task_data in enumerate(act_data.get("tasks", [])):
-            task = Task(
-                activity_id=activity.id,
-                title=task_data.get("title", f"Task {task_idx + 1}"),
-                position=task_idx
-            )
-            db.add(task)
-            db.flush()
-
-            for story_idx, story_data in enumerate(task_data.get("stories", [])):
-                # Определяем release_id по priority
-                priority = story_data.get("priority", "MVP")
-                if priority == "MVP":
-                    release_id = release_map[0]
-                elif priority == "Release 1":
-                    release_id = release_map[1]
-                else:
-                    release_id = release_map[2]
-
-                story = Story(
-                    task_id=task.id,
-                    title=story_data.get("title", f"Story {story_idx + 1}"),
-                    description=story_data.get("description", ""),
-                    acceptance_criteria=story_data.get("acceptanceCriteria", []),
-                    priority=priority,
-                    release_id=release_id,
-                    position=story_idx,
-                    status="todo"
-                )
-                db.add(story)
+            task_rows.append({
+                "activity_id": activity_id,
+                "title": task_data.get("title", f"Task {task_idx + 1}"),
+                "position": task_idx,
+            })
+            task_stories.append(task_data.get("stories", []))
+    task_ids = _bulk_insert_returning_ids(db, Task, task_rows)
+
+    story_rows = []
+    for task_id, stories_data in zip(task_ids, task_stories):
+        for story_idx, story_data in enumerate(stories_data):
+            # Определяем release_id по priority
+            priority = story_data.get("priority", "MVP")
+            release_id = release_map[_release_position(priority)]
+
+            story_rows.append({
+                "task_id": task_id,
+                "title": story_data.get("title", f"Story {story_idx + 1}"),
+                "description": story_data.get("description", ""),
+                "acceptance_criteria": story_data.get("acceptanceCriteria", []),
+                "priority": priority,
+                "release_id": release_id,
+                "position": story_idx,
+                "status": "todo",
+            })
+    if story_rows:
+        db.execute(insert(Story), story_rows)
 
     db.commit()
 
@@ -2,8 +2,10 @@
 Сервис валидации структуры User Story Map
 """
 import logging
+from collections import Counter, defaultdict
 from typing import List, Dict, Any
-from sqlalchemy.orm import Session
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session, joinedload
 
 from models import Project, Activity, UserTask, UserStory, Release
 from schemas.analysis import (
@@ -15,8 +17,55 @@ from schemas.analysis import (
 
 logger = logging.getLogger(__name__)
 
+# Штраф к оценке за одну проблему каждого уровня
+SEVERITY_PENALTY = {
+    IssueSeverity.ERROR: 20,
+    IssueSeverity.WARNING: 5,
+    IssueSeverity.INFO: 1,
+}
+# Порядок уровней для фильтра min_severity
+SEVERITY_RANK = {
+    IssueSeverity.INFO: 0,
+    IssueSeverity.WARNING: 1,
+    IssueSeverity.ERROR: 2,
+}
+# Максимальный бонус за полноту описаний и acceptance criteria
+MAX_COMPLETENESS_BONUS = 10
 
-def validate_project_map(project: Project, db: Session) -> ValidationResult:
+
+def _ensure_project_graph_loaded(project: Project, db: Session) -> Project:
+    """
+    Гарантирует, что activities → tasks → stories и releases загружены.
+    Если вызывающий код не сделал eager load, перезапрашивает проект одним
+    набором запросов вместо lazy-load SELECT на каждую Activity и Task.
+    """
+    state = inspect(project, raiseerr=False)
+    if state is None or db is None:
+        return project
+    
+    unloaded = state.unloaded
+    if "activities" not in unloaded and "releases" not in unloaded:
+        return project
+    
+    return (
+        db.query(Project)
+        .options(
+            joinedload(Project.activities)
+            .subqueryload(Activity.tasks)
+            .subqueryload(UserTask.stories),
+            joinedload(Project.releases),
+        )
+        .filter(Project.id == project.id)
+        .one()
+    )
+
+
+def validate_project_map(
+    project: Project,
+    db: Session,
+    *,
+    min_severity: IssueSeverity = IssueSeverity.INFO
+) -> ValidationResult:
     """
     Валидирует структуру User Story Map проекта
     
@@ -30,12 +79,27 @@ def validate_project_map(project: Project, db: Session) -> ValidationResult:
     Args:
         project: Объект проекта с загруженными связями
         db: Сессия базы данных
+        min_severity: Минимальный уровень проблем, попадающих в issues
+            (более мелкие только учитываются в stats и score)
     
     Returns:
         ValidationResult: Результат валидации
     """
+    project = _ensure_project_graph_loaded(project, db)
+    
     issues: List[ValidationIssue] = []
     recommendations: List[str] = []
+    severity_counts: Counter = Counter()
+    
+    min_rank = SEVERITY_RANK[min_severity]
+    
+    def _add(**fields) -> None:
+        """Добавляет проблему и сразу учитывает ее уровень (без повторных проходов)"""
+        severity = fields["severity"]
+        severity_counts[severity] += 1
+        if SEVERITY_RANK[severity] >= min_rank:
+            # Поля формируем сами, поэтому валидацию pydantic пропускаем
+            issues.append(ValidationIssue.model_construct(**fields))
     
     # Собираем статистику
     stats = {
@@ -50,36 +114,35 @@ def validate_project_map(project: Project, db: Session) -> ValidationResult:
     
     # Получаем все релизы
     releases = project.releases
-    release_ids = [r.id for r in releases]
+    release_ids = frozenset(r.id for r in releases)
     release_titles = {r.id: r.title for r in releases}
     
-    # Инициализируем счетчики по релизам
-    for release in releases:
-        stats["stories_per_release"][release.title] = 0
+    # id релизов всех историй - считаем одним Counter после обхода
+    story_release_ids: List[int] = []
     
     # Собираем все названия историй для проверки дубликатов
-    all_story_titles: Dict[str, List[int]] = {}
+    all_story_titles: Dict[str, List[int]] = defaultdict(list)
     
     # === Проверка Activities ===
     if not project.activities:
-        issues.append(ValidationIssue(
+        _add(
             type=IssueType.EMPTY_ACTIVITY,
             severity=IssueSeverity.ERROR,
             message="Проект не содержит ни одной Activity",
             location={"project_id": project.id}
-        ))
+        )
     
     stats["total_activities"] = len(project.activities)
     
     for activity in project.activities:
         # Проверка пустых Activity
         if not activity.tasks:
-            issues.append(ValidationIssue(
+            _add(
                 type=IssueType.EMPTY_ACTIVITY,
                 severity=IssueSeverity.WARNING,
                 message=f"Activity '{activity.title}' не содержит задач (Tasks)",
                 location={"activity_id": activity.id, "activity_title": activity.title}
-            ))
+            )
             continue
         
         stats["total_tasks"] += len(activity.tasks)
@@ -87,7 +150,7 @@ def validate_project_map(project: Project, db: Session) -> ValidationResult:
         for task in activity.tasks:
             # Проверка пустых Task
             if not task.stories:
-                issues.append(ValidationIssue(
+                _add(
                     type=IssueType.EMPTY_TASK,
                     severity=IssueSeverity.WARNING,
                     message=f"Task '{task.title}' в Activity '{activity.title}' не содержит историй",
@@ -97,82 +160,88 @@ def validate_project_map(project: Project, db: Session) -> ValidationResult:
                         "activity_id": activity.id,
                         "activity_title": activity.title
                     }
-                ))
+                )
                 continue
             
             # Проверяем покрытие релизов для этого Task
-            stories_by_release = {rid: [] for rid in release_ids}
+            task_release_ids: List[int] = []
+            task_title = task.title
             
             for story in task.stories:
                 stats["total_stories"] += 1
+                story_id = story.id
+                story_title = story.title
+                description = story.description
+                criteria = story.acceptance_criteria
+                title_stripped = (story_title or "").strip()
                 
-                # Считаем по релизам
-                if story.release_id:
-                    stories_by_release[story.release_id].append(story)
-                    release_title = release_titles.get(story.release_id, "Unknown")
-                    if release_title in stats["stories_per_release"]:
-                        stats["stories_per_release"][release_title] += 1
+                # Считаем по релизам (истории с чужим/удаленным релизом пропускаем)
+                release_id = story.release_id
+                if release_id in release_ids:
+                    task_release_ids.append(release_id)
                 
                 # Проверка описания
-                if story.description and len(story.description.strip()) > 10:
+                if description and len(description.strip()) > 10:
                     stats["stories_with_description"] += 1
                 else:
-                    issues.append(ValidationIssue(
+                    _add(
                         type=IssueType.MISSING_DESCRIPTION,
                         severity=IssueSeverity.INFO,
-                        message=f"История '{story.title}' не имеет описания",
+                        message=f"История '{story_title}' не имеет описания",
                         location={
-                            "story_id": story.id,
-                            "story_title": story.title,
-                            "task_title": task.title
+                            "story_id": story_id,
+                            "story_title": story_title,
+                            "task_title": task_title
                         }
-                    ))
+                    )
                 
                 # Проверка acceptance criteria
-                if story.acceptance_criteria and len(story.acceptance_criteria) > 0:
+                if criteria:
                     stats["stories_with_criteria"] += 1
                 else:
-                    issues.append(ValidationIssue(
+                    _add(
                         type=IssueType.MISSING_CRITERIA,
                         severity=IssueSeverity.WARNING,
-                        message=f"История '{story.title}' не имеет acceptance criteria",
+                        message=f"История '{story_title}' не имеет acceptance criteria",
                         location={
-                            "story_id": story.id,
-                            "story_title": story.title,
-                            "task_title": task.title
+                            "story_id": story_id,
+                            "story_title": story_title,
+                            "task_title": task_title
                         }
-                    ))
+                    )
                 
                 # Проверка длины названия
-                if len(story.title.strip()) < 5:
-                    issues.append(ValidationIssue(
+                if len(title_stripped) < 5:
+                    _add(
                         type=IssueType.SHORT_TITLE,
                         severity=IssueSeverity.INFO,
-                        message=f"Слишком короткое название истории: '{story.title}'",
-                        location={"story_id": story.id}
-                    ))
+                        message=f"Слишком короткое название истории: '{story_title}'",
+                        location={"story_id": story_id}
+                    )
                 
                 # Собираем для проверки дубликатов
-                title_lower = story.title.lower().strip()
-                if title_lower not in all_story_titles:
-                    all_story_titles[title_lower] = []
-                all_story_titles[title_lower].append(story.id)
+                all_story_titles[title_stripped.casefold()].append(story_id)
             
             # Проверяем пустые ячейки (Task + Release без Stories)
-            for release_id, stories in stories_by_release.items():
-                if not stories:
-                    stats["empty_cells"] += 1
-                    # Не добавляем как issue - пустые ячейки это нормально
+            # Не добавляем как issue - пустые ячейки это нормально
+            stats["empty_cells"] += len(release_ids) - len(set(task_release_ids))
+            story_release_ids.extend(task_release_ids)
+    
+    per_release_counts = Counter(story_release_ids)
+    for release_id, title in release_titles.items():
+        stats["stories_per_release"][title] = (
+            stats["stories_per_release"].get(title, 0) + per_release_counts[release_id]
+        )
     
     # === Проверка дубликатов названий ===
     for title, story_ids in all_story_titles.items():
         if len(story_ids) > 1:
-            issues.append(ValidationIssue(
+            _add(
                 type=IssueType.DUPLICATE_TITLE,
                 severity=IssueSeverity.WARNING,
                 message=f"Найдены истории с одинаковым названием: '{title}'",
                 story_ids=story_ids
-            ))
+            )
     
     # === Проверка баланса релизов ===
     if stats["total_stories"] > 0:
@@ -183,19 +252,19 @@ def validate_project_map(project: Project, db: Session) -> ValidationResult:
             
             # Если разница больше 3x - предупреждаем
             if max_count > 0 and min_count == 0:
-                issues.append(ValidationIssue(
+                _add(
                     type=IssueType.UNBALANCED_RELEASES,
                     severity=IssueSeverity.INFO,
                     message="Некоторые релизы пустые. Проверьте распределение историй по релизам.",
                     location={"stats": stats["stories_per_release"]}
-                ))
+                )
             elif max_count > min_count * 3 and min_count > 0:
-                issues.append(ValidationIssue(
+                _add(
                     type=IssueType.UNBALANCED_RELEASES,
                     severity=IssueSeverity.INFO,
                     message="Истории неравномерно распределены по релизам",
                     location={"stats": stats["stories_per_release"]}
-                ))
+                )
     
     # === Генерация рекомендаций ===
     if stats["total_stories"] == 0:
@@ -227,11 +296,15 @@ def validate_project_map(project: Project, db: Session) -> ValidationResult:
             "Рекомендуется сократить MVP до 10-15 историй."
         )
     
+    stats["issues_by_severity"] = {
+        severity.value: severity_counts[severity] for severity in IssueSeverity
+    }
+    
     # === Расчет оценки ===
-    score = calculate_validation_score(issues, stats)
+    score = calculate_validation_score(severity_counts, stats)
     
     # Определяем валидность (нет критических ошибок)
-    has_errors = any(issue.severity == IssueSeverity.ERROR for issue in issues)
+    has_errors = severity_counts[IssueSeverity.ERROR] > 0
     
     logger.info(
         f"Validation completed for project {project.id}: "
@@ -247,9 +320,9 @@ def validate_project_map(project: Project, db: Session) -> ValidationResult:
     )
 
 
-def calculate_validation_score(issues: List[ValidationIssue], stats: dict) -> int:
+def calculate_validation_score(severity_counts: Dict[IssueSeverity, int], stats: dict) -> int:
     """
-    Рассчитывает оценку качества карты на основе найденных проблем
+    Рассчитывает оценку качества карты по количеству проблем каждого уровня
     
     Формула:
     - Базовый score: 100
@@ -261,13 +334,12 @@ def calculate_validation_score(issues: List[ValidationIssue], stats: dict) -> in
     score = 100
     
     # Штрафы за проблемы
-    for issue in issues:
-        if issue.severity == IssueSeverity.ERROR:
-            score -= 20
-        elif issue.severity == IssueSeverity.WARNING:
-            score -= 5
-        elif issue.severity == IssueSeverity.INFO:
-            score -= 1
+    for severity, penalty in SEVERITY_PENALTY.items():
+        score -= penalty * severity_counts.get(severity, 0)
+    
+    # Бонус не больше MAX_COMPLETENESS_BONUS - ниже этой границы результат всегда 0
+    if score <= -MAX_COMPLETENESS_BONUS:
+        return 0
     
     # Бонусы за полноту
     if stats.get("total_stories", 0) > 0:
@@ -294,8 +366,12 @@ def get_validation_summary(result: ValidationResult) -> str:
     else:
         quality = "требует улучшения"
     
-    error_count = sum(1 for i in result.issues if i.severity == IssueSeverity.ERROR)
-    warning_count = sum(1 for i in result.issues if i.severity == IssueSeverity.WARNING)
+    counts = result.stats.get("issues_by_severity")
+    if counts is None:
+        # ValidationResult собран не через validate_project_map - считаем по списку
+        counts = Counter(issue.severity.value for issue in result.issues)
+    error_count = counts.get(IssueSeverity.ERROR.value, 0)
+    warning_count = counts.get(IssueSeverity.WARNING.value, 0)
     
     summary = f"Качество карты: {quality} ({result.score}/100). "
     
@@ -10,7 +10,13 @@ Features:
 который можно реализовать под другой драйвер без изменений API слоёв.
 """
 from datetime import datetime
+import hashlib
+import json
 import logging
+import threading
+import time
+import uuid
+from operator import attrgetter
 from typing import Dict, Any, Optional, List
 
 from fastapi import HTTPException
@@ -28,33 +34,35 @@ logger = logging.getLogger(__name__)
 # ---------------------------------------------------------------------------
 # Snapshot helpers
 # ---------------------------------------------------------------------------
-def _story_payload(story: UserStory) -> Dict[str, Any]:
-    """Компактный payload истории - только ключевая информация для wireframe."""
-    # Ограничиваем длину описания для wireframe (не нужны все детали)
-    description = story.description or ""
-    if len(description) > 200:
-        description = description[:200] + "..."
-    
-    # Берем только первые 3 acceptance criteria (для wireframe достаточно)
-    ac = story.acceptance_criteria or []
-    if len(ac) > 3:
-        ac = ac[:3]
-    
-    return {
-        "id": story.id,
-        "title": story.title or "",
-        "description": description,
-        "priority": story.priority or "",
-        "status": story.status or "todo",
-        "acceptance_criteria": ac,
-    }
+# Ограничения payload истории: для wireframe не нужны все детали
+STORY_DESCRIPTION_LIMIT = 200
+STORY_CRITERIA_LIMIT = 3
+
+_story_attrs = attrgetter(
+    "id", "title", "description", "priority", "status", "acceptance_criteria"
+)
 
 
 def _task_payload(task: UserTask) -> Dict[str, Any]:
+    """Payload задачи с компактными историями (только ключевая информация)."""
     return {
         "id": task.id,
         "title": task.title or "",
-        "stories": [_story_payload(s) for s in task.stories],
+        "stories": [
+            {
+                "id": story_id,
+                "title": title or "",
+                "description": (
+                    description[:STORY_DESCRIPTION_LIMIT] + "..."
+                    if description and len(description) > STORY_DESCRIPTION_LIMIT
+                    else description or ""
+                ),
+                "priority": priority or "",
+                "status": status or "todo",
+                "acceptance_criteria": (ac or [])[:STORY_CRITERIA_LIMIT],
+            }
+            for story_id, title, description, priority, status, ac in map(_story_attrs, task.stories)
+        ],
     }
 
 
@@ -76,22 +84,108 @@ def build_project_snapshot(project: Project) -> Dict[str, Any]:
     }
 
 
+def snapshot_hash(snapshot: Dict[str, Any]) -> str:
+    """Хеш содержимого snapshot (канонический JSON) для пропуска повторной генерации."""
+    canonical = json.dumps(snapshot, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+
 # ---------------------------------------------------------------------------
 # Queue and job processing
 # ---------------------------------------------------------------------------
+# Статусы RQ, при которых новый запрос подсаживается на уже поставленную задачу.
+# "started" сюда не входит: такая задача уже сняла snapshot карты и правки
+# пользователя после него не увидит
+_COALESCE_JOB_STATUSES = {"queued", "deferred", "scheduled"}
+# Короткая блокировка (SET NX) на проверку + постановку задачи, секунд
+ENQUEUE_LOCK_TTL = 10
+ENQUEUE_LOCK_POLL_INTERVAL = 0.05  # секунд между попытками взять блокировку
+# Сколько хранится ссылка на последнюю задачу проекта, секунд
+LATEST_JOB_TTL = 86400
+
+_queue_adapter: Optional[QueueAdapter] = None
+_queue_adapter_lock = threading.Lock()
+
+
+def _get_queue_adapter() -> QueueAdapter:
+    """Один QueueAdapter на процесс (соединения берутся из общего пула)."""
+    global _queue_adapter
+    if _queue_adapter is None:
+        with _queue_adapter_lock:
+            if _queue_adapter is None:
+                _queue_adapter = QueueAdapter(driver="redis")
+    return _queue_adapter
+
+
+def _reset_queue_adapter() -> None:
+    global _queue_adapter
+    with _queue_adapter_lock:
+        _queue_adapter = None
+
+
+def _latest_job_key(project_id: int, user_id: int) -> str:
+    """Ключ Redis с id последней задачи генерации wireframe для проекта пользователя."""
+    return f"wireframe-latest:{project_id}-{user_id}"
+
+
+def _acquire_enqueue_lock(connection, lock_key: str) -> bool:
+    """
+    Берет блокировку постановки (SET NX EX). Если ее держит параллельный запрос,
+    ждет, пока он поставит задачу, - не дольше TTL блокировки.
+    """
+    deadline = time.monotonic() + ENQUEUE_LOCK_TTL
+    while not connection.set(lock_key, b"1", nx=True, ex=ENQUEUE_LOCK_TTL):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(ENQUEUE_LOCK_POLL_INTERVAL)
+    return True
+
+
 def enqueue_wireframe_job(project_id: int, user_id: int) -> str:
     """
     Создаёт задачу генерации wireframe.
+    Если для проекта уже есть задача, которая ещё ждёт в очереди, - возвращает её id,
+    повторные запросы подсаживаются на неё вместо отдельного вызова AI.
+    Проверка и постановка выполняются под блокировкой Redis (SET NX с TTL),
+    поэтому параллельные запросы не ставят одну задачу дважды.
+
+    Каждая задача получает новый id (ссылка на последнюю хранится в Redis):
+    hash завершённой задачи живёт result_ttl, и задача с тем же id унаследовала
+    бы его EXPIRE и могла пропасть из очереди.
     Возвращает job_id из выбранного адаптера очереди.
     """
     try:
-        adapter = QueueAdapter(driver="redis")
-        job = adapter.enqueue(process_wireframe_job, project_id, user_id)
-        return job.id
+        adapter = _get_queue_adapter()
+        connection = adapter.connection
+        latest_key = _latest_job_key(project_id, user_id)
+
+        lock_key = f"{latest_key}:enqueue-lock"
+        if not _acquire_enqueue_lock(connection, lock_key):
+            raise HTTPException(
+                status_code=503,
+                detail="Wireframe job is being enqueued by another request, please retry."
+            )
+
+        try:
+            latest_id = connection.get(latest_key)
+            if latest_id:
+                existing = adapter.get_job(latest_id.decode())
+                if existing is not None and existing.get_status(refresh=False) in _COALESCE_JOB_STATUSES:
+                    logger.info(f"Wireframe job {existing.id} is already queued, reusing it")
+                    return existing.id
+
+            job_id = f"wireframe-{project_id}-{user_id}-{uuid.uuid4().hex[:12]}"
+            job = adapter.enqueue(process_wireframe_job, project_id, user_id, job_id=job_id)
+            connection.set(latest_key, job.id, ex=LATEST_JOB_TTL)
+            return job.id
+        finally:
+            connection.delete(lock_key)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Failed to enqueue wireframe job: {e}", exc_info=True)
+        # Следующий вызов пересоздаст адаптер (и заново проверит Redis)
+        _reset_queue_adapter()
         raise HTTPException(
             status_code=503,
             detail=f"Failed to enqueue wireframe job: {str(e)}. Redis may be unavailable."
@@ -103,53 +197,70 @@ def process_wireframe_job(project_id: int, user_id: int) -> Optional[str]:
     Запускается воркером (RQ). Генерирует markdown wireframe и сохраняет в БД.
     Возвращает markdown текст при успехе.
     """
-    db: Session = SessionLocal()
-    try:
-        project: Project = (
-            db.query(Project)
-            .options(
-                joinedload(Project.activities)
-                .subqueryload(Activity.tasks)
-                .subqueryload(UserTask.stories),
-                joinedload(Project.releases),
+    with SessionLocal() as db:
+        try:
+            project: Project = (
+                db.query(Project)
+                .options(
+                    joinedload(Project.activities)
+                    .subqueryload(Activity.tasks)
+                    .subqueryload(UserTask.stories),
+                    joinedload(Project.releases),
+                )
+                .filter(Project.id == project_id, Project.user_id == user_id)
+                .first()
             )
-            .filter(Project.id == project_id, Project.user_id == user_id)
-            .first()
-        )
 
-        if not project:
-            raise HTTPException(status_code=404, detail="Project not found or access denied")
+            if not project:
+                raise HTTPException(status_code=404, detail="Project not found or access denied")
 
-        snapshot = build_project_snapshot(project)
-        logger.info(f"Generating wireframe for project {project_id} (activities={len(snapshot.get('activities', []))})")
+            snapshot = build_project_snapshot(project)
+            snap_hash = snapshot_hash(snapshot)
 
-        markdown = generate_markdown_wireframe(snapshot)
+            # Карта не менялась с последней успешной генерации - AI не вызываем
+            if project.wireframe_markdown and project.wireframe_snapshot_hash == snap_hash:
+                logger.info(f"Wireframe for project {project_id} is up to date, skipping generation")
+                markdown = project.wireframe_markdown
+                project.wireframe_status = "success"
+                project.wireframe_error = None
+                db.commit()
+                return markdown
 
-        project.wireframe_markdown = markdown
-        project.wireframe_generated_at = datetime.utcnow()
-        project.wireframe_status = "success"
-        project.wireframe_error = None
-        db.commit()
+            logger.info(f"Generating wireframe for project {project_id} (activities={len(snapshot.get('activities', []))})")
 
-        return markdown
-    except HTTPException:
-        raise
-    except Exception as e:  # pragma: no cover - сохраняем ошибку в БД и прокидываем
-        error_msg = str(e) if str(e) else repr(e)
-        logger.error(f"Wireframe job failed: {error_msg}", exc_info=True)
+            markdown = generate_markdown_wireframe(snapshot)
+
+            project.wireframe_markdown = markdown
+            project.wireframe_snapshot_hash = snap_hash
+            project.wireframe_generated_at = datetime.utcnow()
+            project.wireframe_status = "success"
+            project.wireframe_error = None
+            db.commit()
+
+            return markdown
+        except HTTPException:
+            raise
+        except Exception as e:  # pragma: no cover - сохраняем ошибку в БД и прокидываем
+            db.rollback()
+            error_msg = str(e) if str(e) else repr(e)
+            logger.error(f"Wireframe job failed: {error_msg}", exc_info=True)
+            _mark_wireframe_error(project_id, user_id, error_msg)
+            raise
+
+
+def _mark_wireframe_error(project_id: int, user_id: int, error_msg: str) -> None:
+    """
+    Сохраняет ошибку генерации одним UPDATE в отдельной короткой сессии
+    (сессия задачи после ошибки может быть в сломанной транзакции).
+    """
+    with SessionLocal() as db:
         try:
-            project = (
-                db.query(Project)
-                .filter(Project.id == project_id, Project.user_id == user_id)
-                .first()
+            db.query(Project).filter(
+                Project.id == project_id, Project.user_id == user_id
+            ).update(
+                {"wireframe_status": "error", "wireframe_error": error_msg},
+                synchronize_session=False,
             )
-            if project:
-                project.wireframe_status = "error"
-                project.wireframe_error = error_msg
-                db.commit()
+            db.commit()
         except Exception:
             db.rollback()
-        raise
-    finally:
-        db.close()
-
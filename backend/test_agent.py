@@ -9,6 +9,11 @@ import json
 import logging
 from services.agent_service import SimpleAgent
 
+try:
+    import orjson
+except ImportError:  # stdlib json как запасной вариант
+    orjson = None
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -18,20 +23,29 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def _make_serializable(obj):
-    """Конвертирует ValidationIssue и другие объекты в dict для JSON"""
+def _json_default(obj):
+    """default-хук сериализации: ValidationIssue и другие объекты в dict"""
+    if hasattr(obj, 'model_dump'):
+        return obj.model_dump()
     if hasattr(obj, 'dict'):
         return obj.dict()
-    elif hasattr(obj, '__dict__'):
-        return {k: _make_serializable(v) for k, v in obj.__dict__.items()}
-    elif isinstance(obj, dict):
-        return {k: _make_serializable(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [_make_serializable(item) for item in obj]
-    elif isinstance(obj, (str, int, float, bool, type(None))):
-        return obj
-    else:
-        return str(obj)
+    if hasattr(obj, '__dict__'):
+        return obj.__dict__
+    return str(obj)
+
+
+def _save_result(result, path):
+    """Сохраняет результат агента в JSON без промежуточной копии дерева"""
+    if orjson is None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, default=_json_default, ensure_ascii=False, indent=2)
+        return
+    with open(path, 'wb') as f:
+        f.write(orjson.dumps(
+            result,
+            default=_json_default,
+            option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+        ))
 
 
 def test_simple_requirements():
@@ -90,9 +104,7 @@ def test_simple_requirements():
                 print(f"         → {stories_count} stories")
 
         # Сохраняем результат (конвертируем ValidationIssue в dict)
-        result_serializable = _make_serializable(result)
-        with open('/tmp/agent_test_result_1.json', 'w', encoding='utf-8') as f:
-            json.dump(result_serializable, f, ensure_ascii=False, indent=2)
+        _save_result(result, '/tmp/agent_test_result_1.json')
         print(f"\n💾 Результат сохранен в /tmp/agent_test_result_1.json")
 
         return True
@@ -152,9 +164,7 @@ def test_complex_requirements():
         print(f"  - Всего stories: {total_stories}")
 
         # Сохраняем результат (конвертируем ValidationIssue в dict)
-        result_serializable = _make_serializable(result)
-        with open('/tmp/agent_test_result_2.json', 'w', encoding='utf-8') as f:
-            json.dump(result_serializable, f, ensure_ascii=False, indent=2)
+        _save_result(result, '/tmp/agent_test_result_2.json')
         print(f"\n💾 Результат сохранен в /tmp/agent_test_result_2.json")
 
         return True
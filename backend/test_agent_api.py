@@ -1,108 +1,163 @@
 """
 Тест API с использованием агента
 """
-import requests
-import json
+import asyncio
+import os
+import random
 import sys
+import time
+import uuid
+
+import httpx
+import orjson
+import pytest
 
 API_URL = "http://localhost:8000"
+# Тест ходит в запущенный сервер и живой AI - под pytest только по явному RUN_LIVE=1
+RUN_LIVE = os.getenv("RUN_LIVE") == "1"
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+REQUIREMENTS = """
+    Мобильное приложение для доставки еды.
+    Пользователи могут заказывать еду из ресторанов, отслеживать заказы, оплачивать онлайн.
+    Курьеры принимают заказы и доставляют их.
+    """
+# Тело запроса генерации сериализуется один раз при импорте
+GENERATE_BODY = orjson.dumps({
+    "text": REQUIREMENTS,
+    "use_agent": True,  # ← Включаем агента
+    "skip_enhancement": False
+})
+
 
+@pytest.mark.skipif(not RUN_LIVE, reason="Нужен запущенный сервер на :8000 и RUN_LIVE=1")
 def test_agent_api():
     """Тестирует API с use_agent=true"""
-    
+    assert asyncio.run(_run_agent_api()), "Agent API test failed (see output)"
+
+
+async def _run_agent_api() -> bool:
     print("="*80)
     print("ТЕСТ API: Генерация карты с агентом (use_agent=true)")
     print("="*80)
     
-    # Сначала нужно получить токен (регистрация или логин)
-    # Для теста используем простой подход - сначала регистрация
-    # Используем abs() чтобы гарантировать положительное число (hash может быть отрицательным)
-    test_email = f"test_agent_{abs(hash('test')) % 10000}@test.com"
-    test_password = "test123456"
+    # Каждый запуск регистрирует нового пользователя - без ветки "уже существует"
+    test_email = f"test_agent_{uuid.uuid4().hex[:8]}@test.com"
+    test_password = "Test123456"  # удовлетворяет политике паролей
     
-    print(f"\n1. Регистрация тестового пользователя: {test_email}")
-    try:
-        register_response = requests.post(
-            f"{API_URL}/register",
-            json={
-                "email": test_email,
-                "password": test_password,
-                "full_name": "Test User"
-            },
-            timeout=5
-        )
+    print(f"\n1-2. Регистрация и логин тестового пользователя: {test_email}")
+    # Один клиент на весь скрипт: соединение переиспользуется через keep-alive
+    limits = httpx.Limits(max_connections=16, max_keepalive_connections=16)
+    async with httpx.AsyncClient(base_url=API_URL, timeout=5, limits=limits) as client:
+        if not await _wait_for_server(client):
+            print("   ❌ Не удалось подключиться к серверу")
+            print("   Запустите сервер: cd backend && python main.py")
+            return False
+        access_token = await _register_and_login(client, test_email, test_password)
+        if not access_token:
+            return False
+        print("   ✅ Токен получен")
+        client.headers["Authorization"] = f"Bearer {access_token}"
         
-        # Обрабатываем разные статусы регистрации
-        if register_response.status_code in [200, 201]:
-            # Успешная регистрация, продолжаем
-            pass
-        elif register_response.status_code == 400:
-            # Пользователь уже существует, пробуем логин
-            print("   Пользователь уже существует, логинимся...")
-        else:
-            # Другая ошибка регистрации
-            print(f"   Ошибка регистрации: {register_response.status_code}")
-            print(f"   Ответ: {register_response.text}")
+        return await _generate_with_agent(client)
+
+
+def _backoff_delays(initial: float, cap: float = 10.0, jitter: float = 0.2):
+    """Экспоненциальные задержки (x2 до cap) с джиттером ±jitter"""
+    delay = initial
+    while True:
+        yield delay * (1 + random.uniform(-jitter, jitter))
+        delay = min(delay * 2, cap)
+
+
+async def _wait_for_server(client: httpx.AsyncClient, deadline: float = 30.0) -> bool:
+    """
+    Ждет, пока сервер ответит на /health: экспоненциальная задержка
+    от 50ms до 10s с джиттером, чтобы не заваливать прогревающийся сервер.
+    """
+    started = time.monotonic()
+    for delay in _backoff_delays(0.05):
+        if time.monotonic() - started >= deadline:
             return False
-    except requests.exceptions.ConnectionError:
+        try:
+            response = await client.get("/health", timeout=1)
+            if response.status_code == 200:
+                return True
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(delay)
+
+
+async def _post_with_progress(client: httpx.AsyncClient, url: str, **kwargs) -> httpx.Response:
+    """
+    POST с выводом прогресса: /generate-map синхронный и отвечает одним телом,
+    поэтому пока ждем ответа, печатаем прошедшее время с растущим интервалом.
+    Результат возвращается сразу после ответа сервера, интервал на это не влияет.
+    """
+    started = time.monotonic()
+    request = asyncio.ensure_future(client.post(url, **kwargs))
+    for delay in _backoff_delays(1.0):
+        done, _ = await asyncio.wait({request}, timeout=delay)
+        if done:
+            return request.result()
+        print(f"   ... ждем ответа: {time.monotonic() - started:.1f}s")
+
+
+async def _login(client: httpx.AsyncClient, email: str, password: str):
+    return await client.post(
+        "/token",
+        data={"username": email, "password": password},
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+
+
+async def _register_and_login(client: httpx.AsyncClient, email: str, password: str):
+    """Регистрирует нового пользователя и получает access token"""
+    try:
+        register_response = await client.post(
+            "/register",
+            content=orjson.dumps({"email": email, "password": password, "full_name": "Test User"}),
+            headers=JSON_HEADERS,
+        )
+    except httpx.ConnectError:
         print("   ❌ Не удалось подключиться к серверу")
         print("   Запустите сервер: cd backend && python main.py")
-        return False
+        return None
     except Exception as e:
         print(f"   Ошибка: {e}")
-        return False
+        return None
+    
+    if register_response.status_code not in (200, 201):
+        print(f"   Ошибка регистрации: {register_response.status_code}")
+        print(f"   Ответ: {register_response.text}")
+        return None
     
-    # Логин
-    print("\n2. Логин...")
     try:
-        login_response = requests.post(
-            f"{API_URL}/token",
-            data={
-                "username": test_email,
-                "password": test_password
-            },
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-            timeout=5
-        )
-        
+        login_response = await _login(client, email, password)
         if login_response.status_code != 200:
             print(f"   ❌ Ошибка логина: {login_response.status_code}")
             print(f"   Ответ: {login_response.text}")
-            return False
-        
-        token_data = login_response.json()
-        access_token = token_data.get("access_token")
+            return None
         
+        access_token = orjson.loads(login_response.content).get("access_token")
         if not access_token:
             print("   ❌ Токен не получен")
-            return False
-        
-        print("   ✅ Токен получен")
-        
+        return access_token
     except Exception as e:
         print(f"   ❌ Ошибка: {e}")
-        return False
-    
-    # Генерация карты с агентом
+        return None
+
+
+async def _generate_with_agent(client: httpx.AsyncClient) -> bool:
+    """Генерация карты с агентом и проверка метаданных агента"""
     print("\n3. Генерация карты с агентом (use_agent=true)...")
-    requirements = """
-    Мобильное приложение для доставки еды.
-    Пользователи могут заказывать еду из ресторанов, отслеживать заказы, оплачивать онлайн.
-    Курьеры принимают заказы и доставляют их.
-    """
     
     try:
-        generate_response = requests.post(
-            f"{API_URL}/generate-map",
-            json={
-                "text": requirements,
-                "use_agent": True,  # ← Включаем агента
-                "skip_enhancement": False
-            },
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
-            },
+        generate_response = await _post_with_progress(
+            client,
+            "/generate-map",
+            content=GENERATE_BODY,
+            headers=JSON_HEADERS,
             timeout=60
         )
         
@@ -111,7 +166,7 @@ def test_agent_api():
             print(f"   Ответ: {generate_response.text}")
             return False
         
-        result = generate_response.json()
+        result = orjson.loads(generate_response.content)
         
         print("   ✅ Генерация успешна!")
         print(f"\n   📊 Результат:")
@@ -166,7 +221,7 @@ def test_agent_api():
 if __name__ == "__main__":
     print("\n🧪 ТЕСТИРОВАНИЕ API С АГЕНТОМ\n")
     
-    success = test_agent_api()
+    success = asyncio.run(_run_agent_api())
     
     if success:
         print("\n" + "="*80)
@@ -1,23 +1,21 @@
-import pytest
-
+import asyncio
 
-def test_health(client):
-    response = client.get("/health")
-    assert response.status_code == 200
+import pytest
 
 
-def test_ready(client):
-    response = client.get("/ready")
+@pytest.mark.parametrize("endpoint", ["/health", "/ready"])
+def test_liveness(client, endpoint):
+    response = client.get(endpoint)
     assert response.status_code == 200
     assert "status" in response.json()
 
 
-def test_register(client, test_user_credentials):
-    response = client.post("/register", json=test_user_credentials)
+def test_register(client, new_user_credentials):
+    response = client.post("/register", json=new_user_credentials)
     assert response.status_code == 201
     data = response.json()
-    assert data["email"] == test_user_credentials["email"]
-    assert data["full_name"] == test_user_credentials["full_name"]
+    assert data["email"] == new_user_credentials["email"]
+    assert data["full_name"] == new_user_credentials["full_name"]
 
 
 def test_login(client, registered_user):
@@ -65,3 +63,19 @@ def test_projects(client, auth_headers):
     assert "items" in body
     assert isinstance(body["items"], list)
 
+
+@pytest.mark.anyio
+async def test_concurrent_logins(async_client, registered_user):
+    """Параллельные логины одного пользователя получают разные refresh токены."""
+    form = {"username": registered_user["email"], "password": registered_user["password"]}
+    responses = await asyncio.gather(*(
+        async_client.post("/token", data=form) for _ in range(5)
+    ))
+
+    assert [r.status_code for r in responses] == [200] * 5
+    refresh_tokens = {r.json()["refresh_token"] for r in responses}
+    assert len(refresh_tokens) == 5
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -1,20 +1,36 @@
-from unittest.mock import patch
+import pytest
 from fastapi import HTTPException
 
-
-def test_generate_map_no_api_key(client, auth_headers):
-    """Если нет ключа, сервис должен вернуть 503."""
-    with patch("api.projects.generate_ai_map") as mock_generate:
-        mock_generate.side_effect = HTTPException(
-            status_code=503, detail="AI API key not configured"
-        )
-        response = client.post(
-            "/generate-map",
-            json={"text": "Test requirements"},
-            headers=auth_headers,
-        )
-    assert response.status_code == 503
-    assert "AI API key not configured" in response.json()["detail"]
+VALID_TEXT = "Valid requirements text with enough characters"
+LONG_TEXT = "a" * 10001
+
+
+@pytest.fixture
+def failing_generate(monkeypatch):
+    """Подменяет generate_ai_map на функцию, падающую с заданным HTTPException."""
+    def _fail(status_code, detail):
+        def _raise(*args, **kwargs):
+            raise HTTPException(status_code=status_code, detail=detail)
+        monkeypatch.setattr("api.projects.generate_ai_map", _raise)
+    return _fail
+
+
+@pytest.mark.parametrize("status_code,detail", [
+    (503, "AI API key not configured"),
+    (429, "Rate limit exceeded"),
+    (504, "AI request timed out"),
+    (502, "Invalid AI response"),
+])
+def test_generate_map_ai_errors(client, auth_headers, failing_generate, status_code, detail):
+    """Ошибки AI сервиса (нет ключа, rate limit, таймаут, невалидный ответ) прокидываются клиенту."""
+    failing_generate(status_code, detail)
+    response = client.post(
+        "/generate-map",
+        json={"text": VALID_TEXT},
+        headers=auth_headers,
+    )
+    assert response.status_code == status_code
+    assert response.json()["detail"] == detail
 
 
 def test_generate_map_empty_text(client, auth_headers):
@@ -39,10 +55,9 @@ def test_generate_map_short_text(client, auth_headers):
 
 def test_generate_map_long_text(client, auth_headers):
     """Тест с слишком длинным текстом"""
-    long_text = "a" * 10001
     response = client.post(
         "/generate-map", 
-        json={"text": long_text}, 
+        json={"text": LONG_TEXT}, 
         headers=auth_headers
     )
     assert response.status_code == 400
@@ -62,47 +77,3 @@ def test_list_projects_empty(client, auth_headers):
     # Список проектов возвращает dict с items, а не просто список
     assert "items" in response.json()
     assert isinstance(response.json()["items"], list)
-
-
-def test_generate_map_rate_limit(client, auth_headers):
-    """При rate limit должен вернуться 429."""
-    with patch("api.projects.generate_ai_map") as mock_generate:
-        mock_generate.side_effect = HTTPException(
-            status_code=429, detail="Rate limit exceeded"
-        )
-        response = client.post(
-            "/generate-map",
-            json={"text": "Valid requirements text with enough characters"},
-            headers=auth_headers,
-        )
-    assert response.status_code == 429
-    assert "rate limit" in response.json()["detail"].lower()
-
-
-def test_generate_map_timeout(client, auth_headers):
-    """При таймауте должен вернуться 504."""
-    with patch("api.projects.generate_ai_map") as mock_generate:
-        mock_generate.side_effect = HTTPException(
-            status_code=504, detail="AI request timed out"
-        )
-        response = client.post(
-            "/generate-map",
-            json={"text": "Valid requirements text with enough characters"},
-            headers=auth_headers,
-        )
-    assert response.status_code == 504
-
-
-def test_generate_map_invalid_json(client, auth_headers):
-    """При невалидном ответе должен вернуться 502."""
-    with patch("api.projects.generate_ai_map") as mock_generate:
-        mock_generate.side_effect = HTTPException(
-            status_code=502, detail="Invalid AI response"
-        )
-        response = client.post(
-            "/generate-map",
-            json={"text": "Valid requirements text with enough characters"},
-            headers=auth_headers,
-        )
-    assert response.status_code == 502
-
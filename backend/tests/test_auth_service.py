@@ -0,0 +1,210 @@
+"""
+Тесты для auth_service.py - кеши проверки пароля, JWT и email -> user_id.
+
+Проверяем:
+1. Повторная успешная проверка пароля не вызывает bcrypt
+2. Неуспешная проверка кешируется не дольше _VERIFY_CACHE_NEGATIVE_TTL
+3. Истекший JWT не отдается из кеша
+4. Вытеснение старых записей по maxsize
+5. Устаревшая запись email -> user_id отбрасывается
+"""
+
+import pytest
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+from fastapi import HTTPException
+
+from services import auth_service
+from services.auth_service import (
+    create_access_token,
+    decode_access_token,
+    get_user_by_email,
+    verify_password,
+)
+
+
+class _Clock:
+    """Управляемые часы вместо модуля time в auth_service (глобальный time не трогаем)."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    for cache in (auth_service._verify_cache, auth_service._jwt_cache, auth_service._user_id_cache):
+        cache.clear()
+    yield
+    for cache in (auth_service._verify_cache, auth_service._jwt_cache, auth_service._user_id_cache):
+        cache.clear()
+
+
+@pytest.fixture
+def clock():
+    clock = _Clock()
+    with patch.object(auth_service, "time", clock):
+        yield clock
+
+
+@pytest.fixture
+def bcrypt():
+    """pwd_context с подменным verify: считаем реальные вызовы bcrypt."""
+    with patch.object(auth_service, "pwd_context") as context:
+        context.verify.return_value = True
+        yield context.verify
+
+
+class TestVerifyPasswordCache:
+    """Тесты кеша результатов bcrypt."""
+
+    def test_positive_hit_skips_bcrypt(self, clock, bcrypt):
+        assert verify_password("secret", "hash") is True
+        assert verify_password("secret", "hash") is True
+
+        assert bcrypt.call_count == 1
+
+    def test_positive_expires_after_ttl(self, clock, bcrypt):
+        verify_password("secret", "hash")
+        clock.now += auth_service._VERIFY_CACHE_TTL + 0.1
+        verify_password("secret", "hash")
+
+        assert bcrypt.call_count == 2
+
+    def test_wrong_password_not_cached_beyond_negative_ttl(self, clock, bcrypt):
+        bcrypt.return_value = False
+
+        assert verify_password("wrong", "hash") is False
+        clock.now += auth_service._VERIFY_CACHE_NEGATIVE_TTL - 0.1
+        assert verify_password("wrong", "hash") is False
+        assert bcrypt.call_count == 1
+
+        # После короткого TTL пароль проверяется заново (например, пользователь его сменил)
+        bcrypt.return_value = True
+        clock.now += 0.2
+        assert verify_password("wrong", "hash") is True
+        assert bcrypt.call_count == 2
+
+    def test_different_hash_is_different_key(self, clock, bcrypt):
+        verify_password("secret", "hash-1")
+        verify_password("secret", "hash-2")
+
+        assert bcrypt.call_count == 2
+
+    def test_maxsize_evicts_least_recent(self, clock, bcrypt):
+        with patch.object(auth_service, "_VERIFY_CACHE_MAXSIZE", 2):
+            verify_password("one", "hash")
+            verify_password("two", "hash")
+            verify_password("one", "hash")  # "one" становится самой свежей
+            verify_password("three", "hash")  # вытесняет "two"
+
+            assert len(auth_service._verify_cache) == 2
+            assert bcrypt.call_count == 3
+
+            verify_password("one", "hash")
+            assert bcrypt.call_count == 3
+            verify_password("two", "hash")
+            assert bcrypt.call_count == 4
+
+
+class TestDecodeAccessTokenCache:
+    """Тесты кеша декодированных JWT."""
+
+    def test_valid_token_cached_until_exp(self):
+        token = create_access_token({"sub": "42"})
+
+        assert decode_access_token(token) == 42
+        assert token in auth_service._jwt_cache
+
+        with patch.object(auth_service.jwt, "decode") as decode:
+            assert decode_access_token(token) == 42
+            decode.assert_not_called()
+
+    def test_expired_token_not_served_from_cache(self):
+        # Токен попал в кеш, пока был валиден, и с тех пор истек
+        token = create_access_token({"sub": "42"}, expires_delta=timedelta(seconds=-1))
+        auth_service._jwt_cache[token] = (42, 1.0)
+
+        with pytest.raises(HTTPException) as exc_info:
+            decode_access_token(token)
+
+        assert exc_info.value.status_code == 401
+        assert token not in auth_service._jwt_cache
+
+    def test_invalid_token_not_cached(self):
+        with pytest.raises(HTTPException):
+            decode_access_token("not-a-jwt")
+
+        assert "not-a-jwt" not in auth_service._jwt_cache
+
+    def test_maxsize_evicts_oldest(self):
+        tokens = [create_access_token({"sub": str(i)}) for i in range(3)]
+
+        with patch.object(auth_service, "_JWT_CACHE_MAXSIZE", 2):
+            for token in tokens:
+                decode_access_token(token)
+
+        assert list(auth_service._jwt_cache) == tokens[1:]
+
+
+class TestUserIdCache:
+    """Тесты кеша email -> user_id."""
+
+    @staticmethod
+    def _db(found_user, cached_user=None):
+        """Сессия: db.get() отдает cached_user, запрос по email - found_user."""
+        db = Mock()
+        db.get.return_value = cached_user
+        db.execute.return_value.scalars.return_value.first.return_value = found_user
+        return db
+
+    def test_found_user_cached(self, clock):
+        user = SimpleNamespace(id=1, email="a@example.com")
+        db = self._db(user, cached_user=user)
+
+        assert get_user_by_email(db, "a@example.com") is user
+        assert get_user_by_email(db, "a@example.com") is user
+
+        assert db.execute.call_count == 1
+        db.get.assert_called_once()
+
+    def test_missing_user_not_cached(self, clock):
+        db = self._db(None)
+
+        assert get_user_by_email(db, "new@example.com") is None
+        assert "new@example.com" not in auth_service._user_id_cache
+
+    def test_stale_entry_dropped_when_id_reused(self, clock):
+        # id 1 закеширован за a@example.com, но теперь принадлежит другому пользователю
+        auth_service._user_id_cache["a@example.com"] = (1, clock.now + 60)
+        other = SimpleNamespace(id=1, email="b@example.com")
+        actual = SimpleNamespace(id=7, email="a@example.com")
+        db = self._db(actual, cached_user=other)
+
+        assert get_user_by_email(db, "a@example.com") is actual
+        assert auth_service._user_id_cache["a@example.com"][0] == 7
+
+    def test_expired_entry_requeried(self, clock):
+        user = SimpleNamespace(id=1, email="a@example.com")
+        db = self._db(user, cached_user=user)
+
+        get_user_by_email(db, "a@example.com")
+        clock.now += auth_service._USER_ID_CACHE_TTL + 1
+        get_user_by_email(db, "a@example.com")
+
+        assert db.execute.call_count == 2
+        db.get.assert_not_called()
+
+    def test_maxsize_evicts_oldest(self, clock):
+        with patch.object(auth_service, "_USER_ID_CACHE_MAXSIZE", 2):
+            for i in range(3):
+                email = f"user{i}@example.com"
+                get_user_by_email(self._db(SimpleNamespace(id=i, email=email)), email)
+
+        assert list(auth_service._user_id_cache) == ["user1@example.com", "user2@example.com"]
@@ -0,0 +1,183 @@
+"""
+Тесты для queue_provider.py - адаптер очереди Redis + RQ.
+
+Проверяем:
+1. enqueue_many: пачки по ENQUEUE_BATCH_SIZE, порядок задач, передачу retry
+2. get_jobs: одна pipeline на все id, None для отсутствующих задач
+3. Общий пул соединений и PING не чаще PING_INTERVAL
+"""
+
+import pytest
+from unittest.mock import MagicMock, Mock, patch
+from fastapi import HTTPException
+from rq import Retry
+from rq.job import Job
+
+from services import queue_provider
+from services.queue_provider import QueueAdapter
+
+
+def _task(story_id):
+    """Функция задачи (RQ сохраняет ее по имени)"""
+    return story_id
+
+
+class _Clock:
+    """Управляемые часы вместо модуля time в queue_provider (глобальный time не трогаем)."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def shared_state(monkeypatch):
+    """Сбрасывает общий пул и время последнего PING между тестами."""
+    monkeypatch.setattr(queue_provider, "_pool", None)
+    monkeypatch.setattr(queue_provider, "_last_ping_ts", 0.0)
+
+
+@pytest.fixture
+def redis_mock(shared_state):
+    """redis.ConnectionPool и redis.Redis заменены моками (Queue RQ - настоящая)."""
+    with patch.object(queue_provider.redis, "ConnectionPool") as pool_cls, \
+            patch.object(queue_provider.redis, "Redis") as redis_cls:
+        yield pool_cls, redis_cls
+
+
+@pytest.fixture
+def adapter(redis_mock):
+    return QueueAdapter()
+
+
+class TestEnqueueMany:
+    """Пакетная постановка задач."""
+
+    def test_batches_keep_order(self, adapter):
+        adapter.queue = Mock()
+        adapter.queue.enqueue_many.side_effect = lambda datas: [data.args[0] for data in datas]
+
+        with patch.object(queue_provider, "ENQUEUE_BATCH_SIZE", 2):
+            jobs = adapter.enqueue_many(_task, [(i,) for i in range(5)])
+
+        assert jobs == [0, 1, 2, 3, 4]
+        batch_sizes = [len(call.args[0]) for call in adapter.queue.enqueue_many.call_args_list]
+        assert batch_sizes == [2, 2, 1]
+
+    def test_default_retry(self, adapter):
+        adapter.queue = Mock()
+        adapter.queue.enqueue_many.side_effect = lambda datas: list(datas)
+
+        (data,) = adapter.enqueue_many(_task, [(1,)])
+
+        assert data.retry.max == 3
+        assert data.retry.intervals == [1, 2, 2]
+
+    def test_custom_retry_and_kwargs_passed_through(self, adapter):
+        adapter.queue = Mock()
+        adapter.queue.enqueue_many.side_effect = lambda datas: list(datas)
+        retry = Retry(max=5)
+
+        datas = adapter.enqueue_many(_task, [(1,), (2,)], retry=retry, result_ttl=60)
+
+        assert all(data.retry is retry for data in datas)
+        assert all(data.result_ttl == 60 for data in datas)
+        assert [data.args for data in datas] == [(1,), (2,)]
+
+    def test_empty_list_sends_nothing(self, adapter):
+        adapter.queue = Mock()
+
+        assert adapter.enqueue_many(_task, []) == []
+        adapter.queue.enqueue_many.assert_not_called()
+
+
+class TestGetJobs:
+    """Пакетное чтение задач через pipeline."""
+
+    @staticmethod
+    def _job_hash(job_id):
+        """HGETALL-ответ Redis для сохраненной задачи"""
+        job = Job.create(_task, args=(1,), id=job_id, connection=MagicMock())
+        return {
+            key.encode(): value if isinstance(value, bytes) else str(value).encode()
+            for key, value in job.to_dict().items()
+        }
+
+    def test_one_pipeline_and_none_for_missing(self, adapter):
+        connection = MagicMock()
+        pipeline = connection.pipeline.return_value.__enter__.return_value
+        pipeline.execute.return_value = [self._job_hash("a"), {}, self._job_hash("c")]
+        adapter.connection = connection
+
+        jobs = adapter.get_jobs(["a", "missing", "c"])
+
+        assert [job.id if job else None for job in jobs] == ["a", None, "c"]
+        assert jobs[0].args == (1,)
+        connection.pipeline.assert_called_once()
+        assert pipeline.hgetall.call_count == 3
+
+    def test_redis_error_returns_none_per_id(self, adapter):
+        connection = MagicMock()
+        connection.pipeline.return_value.__enter__.return_value.execute.side_effect = \
+            queue_provider.redis.exceptions.ConnectionError("down")
+        adapter.connection = connection
+
+        assert adapter.get_jobs(["a", "b"]) == [None, None]
+
+    def test_without_connection(self, adapter):
+        adapter.connection = None
+
+        assert adapter.get_jobs(["a"]) == [None]
+
+
+class TestConnectionPool:
+    """Общий пул соединений и редкий PING."""
+
+    def test_pool_shared_between_adapters(self, redis_mock):
+        pool_cls, redis_cls = redis_mock
+
+        QueueAdapter()
+        QueueAdapter()
+
+        pool_cls.from_url.assert_called_once()
+        pools = {call.kwargs["connection_pool"] for call in redis_cls.call_args_list}
+        assert pools == {pool_cls.from_url.return_value}
+
+    def test_tls_pool_options(self, redis_mock, monkeypatch):
+        pool_cls, _ = redis_mock
+        monkeypatch.setattr(queue_provider.settings, "REDIS_URL", "rediss://example:6380/0")
+
+        QueueAdapter()
+
+        kwargs = pool_cls.from_url.call_args.kwargs
+        assert kwargs["ssl_cert_reqs"] is None
+        assert kwargs["max_connections"] == queue_provider.REDIS_MAX_CONNECTIONS
+        assert kwargs["decode_responses"] is False
+
+    def test_ping_throttled(self, redis_mock):
+        _, redis_cls = redis_mock
+        clock = _Clock()
+
+        with patch.object(queue_provider, "time", clock):
+            QueueAdapter()
+            clock.now += queue_provider.PING_INTERVAL - 1
+            QueueAdapter()
+            assert redis_cls.return_value.ping.call_count == 1
+
+            clock.now += 2
+            QueueAdapter()
+            assert redis_cls.return_value.ping.call_count == 2
+
+    def test_failed_ping_is_retried_next_time(self, redis_mock):
+        _, redis_cls = redis_mock
+        redis_cls.return_value.ping.side_effect = queue_provider.redis.exceptions.ConnectionError("down")
+
+        with pytest.raises(HTTPException) as exc_info:
+            QueueAdapter()
+        assert exc_info.value.status_code == 503
+
+        redis_cls.return_value.ping.side_effect = None
+        QueueAdapter()
+        assert redis_cls.return_value.ping.call_count == 2
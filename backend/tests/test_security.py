@@ -0,0 +1,199 @@
+"""
+Тесты для utils/security.py - маскировка чувствительных данных в логах.
+
+Проверяем:
+1. mask_string: все паттерны за один проход
+2. mask_dict: вложенные словари и списки
+3. get_safe_log_message: маскировка сериализованного JSON
+4. SecureLoggingMiddleware: логирование только в DEBUG
+"""
+
+import asyncio
+import logging
+
+from utils.security import (
+    mask_string,
+    mask_dict,
+    mask_headers,
+    get_safe_log_message,
+    SecureLoggingMiddleware,
+)
+
+
+class TestMaskString:
+    """Тесты маскировки строк."""
+
+    def test_masks_all_patterns(self):
+        text = (
+            'Bearer abc.def-1 key sk-ABC123 pplx-XYZ eyJa.eyJb.c '
+            '{"password": "x y", "refresh_token": "abcdefghijklmnopqrstuvwx"}'
+        )
+
+        assert mask_string(text) == (
+            'Bearer [MASKED] key [MASKED_API_KEY] [MASKED_API_KEY] [MASKED_JWT] '
+            '{"password": "[MASKED]", "refresh_token": "[MASKED]"}'
+        )
+
+    def test_api_key_followed_by_other_token(self):
+        """API ключ вплотную к JWT / Bearer токену не оставляет их открытыми."""
+        api_key = "sk-" + "a" * 30
+
+        assert mask_string(api_key + "eyJhbGciOi.eyJzdWIiOjF9.sig") == "[MASKED_API_KEY][MASKED_JWT]"
+        assert mask_string(api_key + "Bearer abc.def-123") == "[MASKED_API_KEY] [MASKED]"
+
+    def test_text_without_secrets_unchanged(self):
+        text = "GET /projects 200 OK"
+        assert mask_string(text) == text
+
+
+class TestMaskDict:
+    """Тесты маскировки словарей."""
+
+    def test_nested_structures(self):
+        data = {
+            "email": "user@example.com",
+            "password": "supersecret123",
+            "profile": {"api_key": "abcdefgh", "name": "User"},
+            "sessions": [{"access_token": "tok"}, "plain"],
+        }
+
+        assert mask_dict(data) == {
+            "email": "user@example.com",
+            "password": "supe****23",
+            "profile": {"api_key": "abcd****", "name": "User"},
+            "sessions": [{"access_token": "****"}, "plain"],
+        }
+
+    def test_input_not_mutated(self):
+        data = {"token": "abcdefghijkl", "nested": {"secret": "abcdefghijkl"}}
+
+        mask_dict(data)
+
+        assert data == {"token": "abcdefghijkl", "nested": {"secret": "abcdefghijkl"}}
+
+    def test_shared_and_cyclic_dicts(self):
+        """Общий вложенный dict маскируется один раз, цикл не зацикливает обход."""
+        shared = {"password": "supersecret123"}
+        data = {"a": shared, "b": [shared]}
+        data["self"] = data
+
+        masked = mask_dict(data)
+
+        assert masked["a"] == {"password": "supe****23"}
+        assert masked["b"][0] is masked["a"]
+        assert masked["self"] is masked
+
+    def test_deep_nesting(self):
+        """Глубина вложенности не ограничена лимитом рекурсии."""
+        data = leaf = {}
+        for _ in range(5000):
+            leaf["child"] = {}
+            leaf = leaf["child"]
+        leaf["token"] = "abcdefghijkl"
+
+        masked = mask_dict(data)
+        for _ in range(5000):
+            masked = masked["child"]
+
+        assert masked == {"token": "abcd****kl"}
+
+
+class TestMaskHeaders:
+    """Тесты маскировки заголовков."""
+
+    def test_case_insensitive_substring_match(self):
+        headers = {
+            "Authorization": "Bearer abcdefghijkl",
+            "X-Api-Key-Id": "abcdefghijkl",
+            "X-Refresh-Token": "",
+            "Content-Type": "application/json",
+        }
+
+        assert mask_headers(headers) == {
+            "Authorization": "Bear****kl",
+            "X-Api-Key-Id": "abcdefghijkl",  # "api-key" != "api_key"
+            "X-Refresh-Token": "",
+            "Content-Type": "application/json",
+        }
+
+
+class TestSafeLogMessage:
+    """Тесты get_safe_log_message."""
+
+    def test_dict_masked_as_json(self):
+        data = {
+            "email": "user@example.com",
+            "Api_Key": "abcdefghijkl",
+            "nested": {"access_token": "tok", "note": 'say "hi"'},
+            "auth": "Bearer abcdefghijkl",
+        }
+
+        message = get_safe_log_message("Login", data)
+
+        assert message == (
+            'Login | Data: {"email":"user@example.com","Api_Key":"abcd****kl",'
+            '"nested":{"access_token":"****","note":"say \\"hi\\""},'
+            '"auth":"Bearer [MASKED]"}'
+        )
+
+    def test_password_never_partially_shown(self):
+        message = get_safe_log_message("Register", {"password": "supersecret123"})
+
+        assert "supe" not in message
+        assert '"password": "[MASKED]"' in message
+
+    def test_unserializable_dict_falls_back_to_mask_dict(self):
+        marker = object()
+
+        message = get_safe_log_message("Event", {"token": "abcdefghijkl", "obj": marker})
+
+        assert "abcd****kl" in message
+        assert "abcdefghijkl" not in message
+
+
+class TestSecureLoggingMiddleware:
+    """Тесты ASGI middleware логирования."""
+
+    @staticmethod
+    def _run(middleware, method="GET"):
+        scope = {
+            "type": "http",
+            "method": method,
+            "path": "/projects",
+            "headers": [(b"authorization", b"Bearer abcdefghijkl")],
+        }
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(middleware(scope, receive, send))
+        return sent
+
+    @staticmethod
+    async def _app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 204, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    def test_debug_logs_masked_request_and_status(self, caplog):
+        caplog.set_level(logging.DEBUG, logger="utils.security")
+
+        sent = self._run(SecureLoggingMiddleware(self._app))
+
+        assert [m["type"] for m in sent] == ["http.response.start", "http.response.body"]
+        assert "Request: GET /projects" in caplog.text
+        assert "Bear****kl" in caplog.text
+        assert "abcdefghijkl" not in caplog.text
+        assert "Response: GET /projects Status: 204" in caplog.text
+
+    def test_passthrough_without_debug(self, caplog):
+        caplog.set_level(logging.INFO, logger="utils.security")
+
+        sent = self._run(SecureLoggingMiddleware(self._app))
+
+        assert len(sent) == 2
+        assert caplog.text == ""
+
@@ -0,0 +1,160 @@
+"""
+Тесты для similarity_service.py - матрица схожести и группировка историй.
+
+Проверяем:
+1. Jaccard fallback (значения и диагональ)
+2. Группировку связанных историй в компоненты
+3. Классификацию групп (duplicate / similar) и среднюю схожесть
+4. Отсечение строк TF-IDF по верхней оценке схожести
+"""
+
+import numpy as np
+import pytest
+from unittest.mock import Mock
+from scipy.sparse import csr_matrix
+
+from services.similarity_service import (
+    calculate_similarity_fallback,
+    find_similar_groups,
+    _prune_by_upper_bound
+)
+
+
+def _stories_data(n):
+    """Минимальные stories_data для find_similar_groups."""
+    data = []
+    for i in range(n):
+        story = Mock()
+        story.id = i + 1
+        story.title = f"Story {i + 1}"
+        story.description = None
+        data.append({
+            "story": story,
+            "task_title": "Task",
+            "activity_title": "Activity",
+            "text": story.title
+        })
+    return data
+
+
+class TestJaccardFallback:
+    """Тесты fallback алгоритма схожести."""
+
+    def test_fallback_values(self):
+        """Jaccard = |A ∩ B| / |A ∪ B|, диагональ = 1."""
+        matrix = calculate_similarity_fallback([
+            "оплата картой онлайн",
+            "оплата картой",
+            "регистрация аккаунта"
+        ])
+
+        assert matrix[0][0] == 1.0
+        assert matrix[0][1] == pytest.approx(2 / 3)
+        assert matrix[1][0] == pytest.approx(2 / 3)
+        assert matrix[0][2] == 0.0
+
+    def test_fallback_empty_text(self):
+        """Пустой текст не похож ни на что, кроме себя."""
+        matrix = calculate_similarity_fallback(["", "оплата картой"])
+
+        assert matrix[0][1] == 0.0
+        assert matrix[0][0] == 1.0
+
+    def test_fallback_no_texts(self):
+        assert len(calculate_similarity_fallback([])) == 0
+
+
+class TestFindSimilarGroups:
+    """Тесты группировки похожих историй."""
+
+    def test_transitive_grouping(self):
+        """0-1 и 1-2 выше порога → одна группа из трех историй."""
+        matrix = [
+            [1.0, 0.8, 0.1, 0.0],
+            [0.8, 1.0, 0.75, 0.0],
+            [0.1, 0.75, 1.0, 0.0],
+            [0.0, 0.0, 0.0, 1.0],
+        ]
+
+        groups = find_similar_groups(_stories_data(4), matrix, 0.7, 0.9)
+
+        assert len(groups) == 1
+        group = groups[0]
+        assert group.group_type == "similar"
+        assert sorted(s.id for s in group.stories) == [1, 2, 3]
+        # Средняя схожесть story 2 = (0.8 + 0.75) / 2
+        story_2 = next(s for s in group.stories if s.id == 2)
+        assert story_2.similarity == round((0.8 + 0.75) / 2, 2)
+
+    def test_duplicates_sorted_first(self):
+        """Группы дубликатов идут перед группами похожих."""
+        matrix = [
+            [1.0, 0.75, 0.0, 0.0],
+            [0.75, 1.0, 0.0, 0.0],
+            [0.0, 0.0, 1.0, 0.95],
+            [0.0, 0.0, 0.95, 1.0],
+        ]
+
+        groups = find_similar_groups(_stories_data(4), matrix, 0.7, 0.9)
+
+        assert [g.group_type for g in groups] == ["duplicate", "similar"]
+        assert sorted(s.id for s in groups[0].stories) == [3, 4]
+
+    def test_sparse_matrix_same_as_dense(self):
+        """Разреженная матрица (TF-IDF путь) дает те же группы, что и плотная."""
+        matrix = [
+            [1.0, 0.8, 0.1, 0.0],
+            [0.8, 1.0, 0.75, 0.0],
+            [0.1, 0.75, 1.0, 0.0],
+            [0.0, 0.0, 0.0, 1.0],
+        ]
+
+        dense_groups = find_similar_groups(_stories_data(4), matrix, 0.7, 0.9)
+        sparse_groups = find_similar_groups(_stories_data(4), csr_matrix(matrix), 0.7, 0.9)
+
+        assert [
+            [(s.id, s.similarity) for s in g.stories] for g in sparse_groups
+        ] == [
+            [(s.id, s.similarity) for s in g.stories] for g in dense_groups
+        ]
+
+    def test_no_groups_below_threshold(self):
+        matrix = [
+            [1.0, 0.3],
+            [0.3, 1.0],
+        ]
+
+        assert find_similar_groups(_stories_data(2), matrix, 0.7, 0.9) == []
+
+
+class TestPruneByUpperBound:
+    """Тесты отсечения строк, которые не могут пройти порог схожести."""
+
+    def test_row_below_bound_is_zeroed(self):
+        """Строка из 4 равных термов с однотермовыми строками: cos <= 0.5 < 0.7."""
+        matrix = csr_matrix([
+            [0.5, 0.5, 0.5, 0.5, 0.0],
+            [0.0, 0.0, 0.0, 0.0, 1.0],
+            [0.0, 0.0, 0.0, 0.0, 1.0],
+        ])
+
+        pruned = _prune_by_upper_bound(matrix, 0.7)
+
+        assert pruned[0].nnz == 0
+        assert (pruned[1:] != matrix[1:]).nnz == 0
+
+    def test_pairs_above_threshold_kept(self):
+        """Пары со схожестью >= порога не теряются."""
+        rng = np.random.default_rng(0)
+        dense = rng.random((30, 12)) * (rng.random((30, 12)) < 0.3)
+        dense /= np.maximum(np.linalg.norm(dense, axis=1, keepdims=True), 1e-12)
+        matrix = csr_matrix(dense)
+
+        pruned = _prune_by_upper_bound(matrix, 0.6)
+
+        full = (matrix @ matrix.T).toarray()
+        kept = (pruned @ pruned.T).toarray()
+        np.fill_diagonal(full, 0.0)
+        np.fill_diagonal(kept, 0.0)
+        mask = full >= 0.6
+        assert np.allclose(kept[mask], full[mask])
@@ -6,20 +6,94 @@
 2. Формат данных в событиях
 3. Обработку ошибок
 4. Корректность analysis event
+5. Сохранение карты в реальную (SQLite) БД: связи уровней и релизы
 """
 
 import pytest
 import json
-from unittest.mock import Mock, patch, MagicMock
+import numpy as np
+import orjson
+from contextlib import ExitStack
+from types import SimpleNamespace
+from unittest.mock import Mock, patch, MagicMock, AsyncMock
+
 from sqlalchemy.orm import Session
 
+from models import Project, User
+from schemas.analysis import (
+    IssueSeverity,
+    IssueType,
+    SimilarityGroup,
+    SimilarityResult,
+    ValidationIssue,
+    ValidationResult,
+)
 from services.streaming_service import (
+    DATA_PREFIX,
+    SSE_SUFFIX,
     sse_event,
     generate_map_streaming,
     _save_project_to_db
 )
 
 
+class _FakeSession:
+    """
+    Легкая замена Session: только методы, которые вызывает _save_project_to_db.
+
+    MagicMock(spec=Session)/create_autospec интроспектируют весь класс Session,
+    а тестам нужны лишь несколько вызовов.
+    """
+
+    def __init__(self):
+        self.add = Mock()
+        self.add_all = Mock()
+        self.flush = Mock()
+        self.commit = Mock()
+        self.rollback = Mock()
+        # get_bind().dialect... и execute(...).scalars() - цепочки атрибутов
+        self.get_bind = MagicMock()
+        self.execute = MagicMock()
+
+    def reset_mock(self):
+        for attr in vars(self).values():
+            if isinstance(attr, Mock):
+                attr.reset_mock()
+
+
+# Стандартные результаты подмененных стадий (только для чтения: тест, которому
+# нужны другие данные, присваивает свой return_value)
+_GEN_RESULT_EMPTY = {"productName": "Test Product", "map": {"activities": []}}
+def _validation(score, messages=()):
+    """ValidationResult с оценкой score и предупреждениями messages"""
+    return ValidationResult(
+        is_valid=True,
+        score=score,
+        issues=[
+            ValidationIssue(type=IssueType.MISSING_CRITERIA, severity=IssueSeverity.WARNING, message=message)
+            for message in messages
+        ],
+    )
+
+
+def _similarity(duplicates=0, similar=0):
+    """SimilarityResult с заданным числом групп дубликатов и похожих историй"""
+    return SimilarityResult(similar_groups=[
+        SimilarityGroup(stories=[], group_type=group_type, recommendation="")
+        for group_type, count in (("duplicate", duplicates), ("similar", similar))
+        for _ in range(count)
+    ])
+
+
+_VAL_RESULT_OK = _validation(90)
+_SIM_RESULT_EMPTY = _similarity()
+
+
+def _parse_event(event: bytes) -> dict:
+    """Разбирает SSE событие: срезает b"data: " и b"\\n\\n" и декодирует JSON."""
+    return orjson.loads(event[len(DATA_PREFIX):-len(SSE_SUFFIX)])
+
+
 class TestSSEEventFormat:
     """Тесты форматирования SSE событий."""
 
@@ -27,9 +101,9 @@ class TestSSEEventFormat:
         """Проверка базового формата SSE события."""
         result = sse_event("test_type", {"progress": 50, "message": "Test"})
 
-        # Формат: "data: {...}\n\n"
-        assert result.startswith("data: ")
-        assert result.endswith("\n\n")
+        # Формат: b"data: {...}\n\n"
+        assert result.startswith(b"data: ")
+        assert result.endswith(b"\n\n")
 
         # Парсим JSON
         json_str = result[6:-2]  # Убираем "data: " и "\n\n"
@@ -47,21 +121,25 @@ class TestSSEEventFormat:
         data = json.loads(json_str)
 
         assert data["message"] == "Улучшаю требования"
-        assert "\\u" not in result  # ensure_ascii=False работает
+        assert b"\\u" not in result  # UTF-8 без \u-экранирования
+        assert "Улучшаю требования".encode() in result
+
+    def test_sse_event_non_str_keys(self):
+        """Словари с int ключами (например, счетчики по позициям) сериализуются."""
+        result = sse_event("analysis", {"by_position": {1: 2}})
 
+        data = json.loads(result[6:-2])
+        assert data["by_position"] == {"1": 2}
 
-@pytest.mark.asyncio
+
+@pytest.mark.anyio
 class TestStreamingGeneration:
     """Тесты генерации карты с SSE потоком."""
 
     @pytest.fixture
     def mock_db(self):
         """Mock database session."""
-        db = MagicMock(spec=Session)
-        db.add = Mock()
-        db.flush = Mock()
-        db.commit = Mock()
-        return db
+        return _FakeSession()
 
     @pytest.fixture
     def mock_redis(self):
@@ -71,7 +149,24 @@ class TestStreamingGeneration:
             mock.return_value = redis_mock
             yield redis_mock
 
-    async def test_event_sequence_without_enhancement(self, mock_db, mock_redis):
+    @pytest.fixture
+    def streaming_mocks(self):
+        """
+        Подменяет генерацию, валидацию и анализ схожести со стандартными результатами.
+
+        Тест переопределяет только нужные ему return_value (присваиванием нового
+        объекта - общие шаблоны модуля не мутируются).
+        """
+        with ExitStack() as stack:
+            gen = stack.enter_context(patch('services.streaming_service.generate_ai_map'))
+            val = stack.enter_context(patch('services.streaming_service.validate_project_map'))
+            sim = stack.enter_context(patch('services.streaming_service.analyze_similarity'))
+            gen.return_value = _GEN_RESULT_EMPTY
+            val.return_value = _VAL_RESULT_OK
+            sim.return_value = _SIM_RESULT_EMPTY
+            yield SimpleNamespace(gen=gen, val=val, sim=sim)
+
+    async def test_event_sequence_without_enhancement(self, mock_db, mock_redis, streaming_mocks):
         """
         Проверка последовательности событий БЕЗ enhancement.
 
@@ -87,78 +182,65 @@ class TestStreamingGeneration:
         9. saving (95%)
         10. complete (100%)
         """
-        with patch('services.streaming_service.generate_ai_map') as mock_gen, \
-             patch('services.streaming_service.validate_project_map') as mock_val, \
-             patch('services.streaming_service.analyze_similarity') as mock_sim:
-
-            # Mock AI generation результат
-            mock_gen.return_value = {
-                "productName": "Test Product",
-                "map": {
-                    "activities": [
-                        {
-                            "title": "Activity 1",
-                            "tasks": [
-                                {
-                                    "title": "Task 1",
-                                    "stories": [
-                                        {"title": "Story 1", "priority": "MVP"}
-                                    ]
-                                }
-                            ]
-                        }
-                    ]
-                }
+        # Mock AI generation результат
+        streaming_mocks.gen.return_value = {
+            "productName": "Test Product",
+            "map": {
+                "activities": [
+                    {
+                        "title": "Activity 1",
+                        "tasks": [
+                            {
+                                "title": "Task 1",
+                                "stories": [
+                                    {"title": "Story 1", "priority": "MVP"}
+                                ]
+                            }
+                        ]
+                    }
+                ]
             }
+        }
 
-            # Mock validation
-            mock_val.return_value = {
-                "overall_score": 85,
-                "issues": ["Issue 1", "Issue 2"]
-            }
+        # Mock validation
+        streaming_mocks.val.return_value = _validation(85, ["Issue 1", "Issue 2"])
 
-            # Mock similarity
-            mock_sim.return_value = {
-                "duplicate_groups": [],
-                "similar_groups": [["Story A", "Story B"]]
-            }
+        # Mock similarity
+        streaming_mocks.sim.return_value = _similarity(similar=1)
 
-            # Собираем все события
-            events = []
-            async for event_str in generate_map_streaming(
-                requirements_text="Test requirements",
-                use_enhancement=False,
-                use_agent=False,
-                user_id=1,
-                db=mock_db
-            ):
-                events.append(event_str)
+        # Собираем все события
+        events = []
+        async for event_str in generate_map_streaming(
+            requirements_text="Test requirements",
+            use_enhancement=False,
+            use_agent=False,
+            user_id=1,
+            db=mock_db
+        ):
+            events.append(event_str)
 
-            # Парсим события
-            parsed_events = []
-            for event_str in events:
-                json_str = event_str[6:-2]  # Убираем "data: " и "\n\n"
-                parsed_events.append(json.loads(json_str))
+        # Парсим события
+        parsed_events = [_parse_event(e) for e in events]
 
-            # Проверяем типы событий
-            event_types = [e["type"] for e in parsed_events]
+        # Проверяем типы событий
+        event_types = [e["type"] for e in parsed_events]
 
-            assert "generating" in event_types
-            assert "validating" in event_types
-            assert "analysis" in event_types
-            assert "saving" in event_types
-            assert "complete" in event_types
+        assert "generating" in event_types
+        assert "validating" in event_types
+        assert "analysis" in event_types
+        assert "saving" in event_types
+        assert "complete" in event_types
 
-            # Проверяем, что события в правильном порядке
-            generating_idx = event_types.index("generating")
-            validating_idx = event_types.index("validating")
-            analysis_idx = event_types.index("analysis")
-            saving_idx = event_types.index("saving")
-            complete_idx = event_types.index("complete")
+        # Проверяем, что события в правильном порядке
+        generating_idx = event_types.index("generating")
+        validating_idx = event_types.index("validating")
+        analysis_idx = event_types.index("analysis")
+        saving_idx = event_types.index("saving")
+        complete_idx = event_types.index("complete")
 
-            assert generating_idx < validating_idx < analysis_idx < saving_idx < complete_idx
+        assert generating_idx < validating_idx < analysis_idx < saving_idx < complete_idx
 
-    async def test_event_sequence_with_enhancement(self, mock_db, mock_redis):
+    async def test_event_sequence_with_enhancement(self, mock_db, mock_redis, streaming_mocks):
         """
         Проверка последовательности событий С enhancement.
 
@@ -166,10 +248,7 @@ class TestStreamingGeneration:
         - enhancing (10%)
         - enhanced (20%)
         """
-        with patch('services.streaming_service.enhance_requirements') as mock_enh, \
-             patch('services.streaming_service.generate_ai_map') as mock_gen, \
-             patch('services.streaming_service.validate_project_map') as mock_val, \
-             patch('services.streaming_service.analyze_similarity') as mock_sim:
+        with patch('services.streaming_service.enhance_requirements') as mock_enh:
 
             # Mock enhancement
             mock_enh.return_value = {
@@ -178,15 +257,6 @@ class TestStreamingGeneration:
                 "fallback": False
             }
 
-            # Mock AI generation
-            mock_gen.return_value = {
-                "productName": "Test Product",
-                "map": {"activities": []}
-            }
-
-            mock_val.return_value = {"overall_score": 90, "issues": []}
-            mock_sim.return_value = {"duplicate_groups": [], "similar_groups": []}
-
             # Собираем события
             events = []
             async for event_str in generate_map_streaming(
@@ -198,20 +268,55 @@ class TestStreamingGeneration:
             ):
                 events.append(event_str)
 
-            parsed_events = [json.loads(e[6:-2]) for e in events]
-            event_types = [e["type"] for e in parsed_events]
+        parsed_events = [_parse_event(e) for e in events]
+        event_types = [e["type"] for e in parsed_events]
+
+        # Проверяем наличие enhancement событий
+        assert "enhancing" in event_types
+        assert "enhanced" in event_types
 
-            # Проверяем наличие enhancement событий
-            assert "enhancing" in event_types
-            assert "enhanced" in event_types
+        # Проверяем, что enhancing раньше всего остального
+        enhancing_idx = event_types.index("enhancing")
+        generating_idx = event_types.index("generating")
 
-            # Проверяем, что enhancing раньше всего остального
-            enhancing_idx = event_types.index("enhancing")
-            generating_idx = event_types.index("generating")
+        assert enhancing_idx < generating_idx
+
+    async def test_yields_to_event_loop_after_each_event(self, mock_db, mock_redis, streaming_mocks):
+        """После каждого события генератор отдает управление event loop - события не склеиваются."""
+        # Патчим хелпер модуля, а не asyncio.sleep: он общий для всего event loop
+        with patch('services.streaming_service._yield_to_event_loop', new_callable=AsyncMock) as mock_yield:
+            events = []
+            async for event_str in generate_map_streaming(
+                requirements_text="Test requirements",
+                use_enhancement=False,
+                use_agent=False,
+                user_id=1,
+                db=mock_db
+            ):
+                # К моменту получения следующего события sleep уже вызван за каждое предыдущее
+                assert mock_yield.await_count == len(events)
+                events.append(event_str)
+
+        assert mock_yield.await_count == len(events)
+
+    async def test_client_disconnect_stops_generation(self, mock_db, mock_redis, streaming_mocks):
+        """Закрытие потока после первого события отменяет генерацию: до БД дело не доходит."""
+        stream = generate_map_streaming(
+            requirements_text="Test requirements",
+            use_enhancement=False,
+            use_agent=False,
+            user_id=1,
+            db=mock_db
+        )
 
-            assert enhancing_idx < generating_idx
+        first = await stream.__anext__()
+        await stream.aclose()
 
-    async def test_analysis_event_data(self, mock_db, mock_redis):
+        assert _parse_event(first)["type"] == "generating"
+        streaming_mocks.val.assert_not_called()
+        mock_db.commit.assert_not_called()
+
+    async def test_analysis_event_data(self, mock_db, mock_redis, streaming_mocks):
         """
         Проверка данных в analysis событии.
 
@@ -223,65 +328,83 @@ class TestStreamingGeneration:
         - total_issues: int
         - progress: 85
         """
-        with patch('services.streaming_service.generate_ai_map') as mock_gen, \
-             patch('services.streaming_service.validate_project_map') as mock_val, \
-             patch('services.streaming_service.analyze_similarity') as mock_sim:
-
-            mock_gen.return_value = {
-                "productName": "Test Product",
-                "map": {"activities": []}
-            }
-
-            # Mock validation с проблемами
-            mock_val.return_value = {
-                "overall_score": 65,
-                "issues": [
-                    "Missing acceptance criteria",
-                    "Too short description",
-                    "No priority set",
-                    "Duplicate title",
-                    "Empty story",
-                    "Another issue"
-                ]
-            }
-
-            # Mock similarity с дубликатами
-            mock_sim.return_value = {
-                "duplicate_groups": [
-                    ["Story 1", "Story 2"],
-                    ["Story 3", "Story 4"],
-                    ["Story 5", "Story 6"]
-                ],
-                "similar_groups": [
-                    ["Story A", "Story B"]
-                ]
-            }
-
-            # Собираем события
-            events = []
-            async for event_str in generate_map_streaming(
-                requirements_text="Test requirements",
-                use_enhancement=False,
-                use_agent=False,
-                user_id=1,
-                db=mock_db
-            ):
-                events.append(event_str)
-
-            parsed_events = [json.loads(e[6:-2]) for e in events]
+        # Mock validation с проблемами
+        streaming_mocks.val.return_value = _validation(65, [
+            "Missing acceptance criteria",
+            "Too short description",
+            "No priority set",
+            "Duplicate title",
+            "Empty story",
+            "Another issue"
+        ])
+
+        # Mock similarity с дубликатами
+        streaming_mocks.sim.return_value = _similarity(duplicates=3, similar=1)
+
+        # Собираем события
+        events = []
+        async for event_str in generate_map_streaming(
+            requirements_text="Test requirements",
+            use_enhancement=False,
+            use_agent=False,
+            user_id=1,
+            db=mock_db
+        ):
+            events.append(event_str)
+
+        parsed_events = [_parse_event(e) for e in events]
+
+        # Находим analysis событие
+        analysis_event = next(e for e in parsed_events if e["type"] == "analysis")
+
+        # Проверяем структуру
+        assert analysis_event["progress"] == 85
+        assert analysis_event["duplicates"] == 3  # 3 группы дубликатов
+        assert analysis_event["similar"] == 1  # 1 группа похожих
+        assert analysis_event["score"] == 65
+        assert analysis_event["issues"][0] == "Missing acceptance criteria"
+        # Обе стадии получают несохраненный Project, валидация - без сессии БД
+        project, db = streaming_mocks.val.call_args.args
+        assert isinstance(project, Project) and db is None
+        assert streaming_mocks.sim.call_args.args == (project,)
+        assert len(analysis_event["issues"]) == 5  # Первые 5 проблем
+        assert analysis_event["total_issues"] == 6
+
+    async def test_analysis_with_real_services(self, mock_db, mock_redis):
+        """
+        Валидация и анализ схожести без моков: стадии получают несохраненный
+        Project (db=None) и возвращают pydantic результаты.
+        """
+        story = {"title": "Вход по email и паролю", "priority": "MVP", "acceptanceCriteria": ["OK"]}
+        map_data = {
+            "activities": [
+                {"title": "Вход", "tasks": [{"title": "Авторизация", "stories": [story, dict(story)]}]},
+                {"title": "Пустая", "tasks": []},
+            ]
+        }
 
-            # Находим analysis событие
-            analysis_event = next(e for e in parsed_events if e["type"] == "analysis")
+        with patch('services.streaming_service.generate_ai_map') as gen:
+            gen.return_value = {"productName": "Real", "map": map_data}
+            events = [
+                _parse_event(e) async for e in generate_map_streaming(
+                    requirements_text="Test requirements",
+                    use_enhancement=False,
+                    use_agent=False,
+                    user_id=1,
+                    db=mock_db
+                )
+            ]
 
-            # Проверяем структуру
-            assert analysis_event["progress"] == 85
-            assert analysis_event["duplicates"] == 3  # 3 группы дубликатов
-            assert analysis_event["similar"] == 1  # 1 группа похожих
-            assert analysis_event["score"] == 65
-            assert len(analysis_event["issues"]) == 5  # Первые 5 проблем
-            assert analysis_event["total_issues"] == 6
+        assert [e["type"] for e in events if e["type"] == "error"] == []
+        analysis_event = next(e for e in events if e["type"] == "analysis")
+        # Две одинаковые истории - группа дубликатов и предупреждение DUPLICATE_TITLE
+        assert analysis_event["duplicates"] == 1
+        assert analysis_event["similar"] == 0
+        assert any("одинаковым названием" in issue for issue in analysis_event["issues"])
+        assert any("Пустая" in issue for issue in analysis_event["issues"])
+        assert 0 < analysis_event["score"] < 100
 
-    async def test_complete_event_data(self, mock_db, mock_redis):
+    async def test_complete_event_data(self, mock_db, mock_redis, streaming_mocks):
         """
         Проверка данных в complete событии.
 
@@ -290,183 +413,171 @@ class TestStreamingGeneration:
         - project_name: str
         - stats: {activities, tasks, stories, score, duplicates}
         """
-        with patch('services.streaming_service.generate_ai_map') as mock_gen, \
-             patch('services.streaming_service.validate_project_map') as mock_val, \
-             patch('services.streaming_service.analyze_similarity') as mock_sim:
-
-            # Mock с реальными данными
-            mock_gen.return_value = {
-                "productName": "Test Product",
-                "map": {
-                    "activities": [
-                        {
-                            "title": "Activity 1",
-                            "tasks": [
-                                {
-                                    "title": "Task 1",
-                                    "stories": [
-                                        {"title": "Story 1", "priority": "MVP"},
-                                        {"title": "Story 2", "priority": "Release 1"}
-                                    ]
-                                },
-                                {
-                                    "title": "Task 2",
-                                    "stories": [
-                                        {"title": "Story 3", "priority": "MVP"}
-                                    ]
-                                }
-                            ]
-                        },
-                        {
-                            "title": "Activity 2",
-                            "tasks": [
-                                {
-                                    "title": "Task 3",
-                                    "stories": [
-                                        {"title": "Story 4", "priority": "Later"}
-                                    ]
-                                }
-                            ]
-                        }
-                    ]
-                }
+        # Mock с реальными данными
+        streaming_mocks.gen.return_value = {
+            "productName": "Test Product",
+            "map": {
+                "activities": [
+                    {
+                        "title": "Activity 1",
+                        "tasks": [
+                            {
+                                "title": "Task 1",
+                                "stories": [
+                                    {"title": "Story 1", "priority": "MVP"},
+                                    {"title": "Story 2", "priority": "Release 1"}
+                                ]
+                            },
+                            {
+                                "title": "Task 2",
+                                "stories": [
+                                    {"title": "Story 3", "priority": "MVP"}
+                                ]
+                            }
+                        ]
+                    },
+                    {
+                        "title": "Activity 2",
+                        "tasks": [
+                            {
+                                "title": "Task 3",
+                                "stories": [
+                                    {"title": "Story 4", "priority": "Later"}
+                                ]
+                            }
+                        ]
+                    }
+                ]
             }
+        }
 
-            mock_val.return_value = {"overall_score": 88, "issues": []}
-            mock_sim.return_value = {"duplicate_groups": [], "similar_groups": []}
+        streaming_mocks.val.return_value = _validation(88)
 
-            # Mock БД для получения project_id
-            mock_project = Mock()
-            mock_project.id = 42
-            mock_db.add.side_effect = lambda obj: setattr(obj, 'id', 42)
+        # Mock БД для получения project_id
+        mock_db.add.side_effect = lambda obj: setattr(obj, 'id', 42)
 
-            # Собираем события
-            events = []
-            async for event_str in generate_map_streaming(
-                requirements_text="Test requirements",
-                use_enhancement=False,
-                use_agent=False,
-                user_id=1,
-                db=mock_db
-            ):
-                events.append(event_str)
+        # Собираем события
+        events = []
+        async for event_str in generate_map_streaming(
+            requirements_text="Test requirements",
+            use_enhancement=False,
+            use_agent=False,
+            user_id=1,
+            db=mock_db
+        ):
+            events.append(event_str)
 
-            parsed_events = [json.loads(e[6:-2]) for e in events]
+        parsed_events = [_parse_event(e) for e in events]
 
-            # Находим complete событие
-            complete_event = next(e for e in parsed_events if e["type"] == "complete")
+        # Находим complete событие
+        complete_event = next(e for e in parsed_events if e["type"] == "complete")
 
-            # Проверяем данные
-            assert complete_event["progress"] == 100
-            assert complete_event["project_id"] == 42
-            assert complete_event["project_name"] == "Test Product"
+        # Проверяем данные
+        assert complete_event["progress"] == 100
+        assert complete_event["project_id"] == 42
+        assert complete_event["project_name"] == "Test Product"
 
-            # Проверяем статистику
-            stats = complete_event["stats"]
-            assert stats["activities"] == 2
-            assert stats["tasks"] == 3
-            assert stats["stories"] == 4
-            assert stats["score"] == 88
-            assert stats["duplicates"] == 0
+        # Проверяем статистику
+        stats = complete_event["stats"]
+        assert stats["activities"] == 2
+        assert stats["tasks"] == 3
+        assert stats["stories"] == 4
+        assert stats["score"] == 88
+        assert stats["duplicates"] == 0
 
-    async def test_error_handling(self, mock_db, mock_redis):
+    async def test_error_handling(self, mock_db, mock_redis, streaming_mocks):
         """
         Проверка обработки ошибок.
 
         При ошибке должно прийти событие:
         {type: "error", message: str, stage: str}
         """
-        with patch('services.streaming_service.generate_ai_map') as mock_gen:
-
-            # Mock ошибки AI
-            mock_gen.side_effect = Exception("AI service unavailable")
-
-            # Собираем события
-            events = []
-            async for event_str in generate_map_streaming(
-                requirements_text="Test requirements",
-                use_enhancement=False,
-                use_agent=False,
-                user_id=1,
-                db=mock_db
-            ):
-                events.append(event_str)
+        # Mock ошибки AI
+        streaming_mocks.gen.side_effect = Exception("AI service unavailable")
+
+        # Собираем события
+        events = []
+        async for event_str in generate_map_streaming(
+            requirements_text="Test requirements",
+            use_enhancement=False,
+            use_agent=False,
+            user_id=1,
+            db=mock_db
+        ):
+            events.append(event_str)
 
-            parsed_events = [json.loads(e[6:-2]) for e in events]
+        parsed_events = [_parse_event(e) for e in events]
 
-            # Должно быть хотя бы одно error событие
-            error_events = [e for e in parsed_events if e["type"] == "error"]
-            assert len(error_events) > 0
+        # Должно быть хотя бы одно error событие
+        error_events = [e for e in parsed_events if e["type"] == "error"]
+        assert len(error_events) > 0
 
-            error_event = error_events[0]
-            assert "message" in error_event
-            assert "AI service unavailable" in error_event["message"]
+        error_event = error_events[0]
+        assert "message" in error_event
+        assert "AI service unavailable" in error_event["message"]
 
-    async def test_progress_monotonic_increase(self, mock_db, mock_redis):
+    async def test_progress_monotonic_increase(self, mock_db, mock_redis, streaming_mocks):
         """
         Проверка монотонного роста progress.
 
         Progress должен только расти: 10% → 20% → 30% → ... → 100%
         """
-        with patch('services.streaming_service.generate_ai_map') as mock_gen, \
-             patch('services.streaming_service.validate_project_map') as mock_val, \
-             patch('services.streaming_service.analyze_similarity') as mock_sim:
+        # Собираем события
+        events = []
+        async for event_str in generate_map_streaming(
+            requirements_text="Test requirements",
+            use_enhancement=False,
+            use_agent=False,
+            user_id=1,
+            db=mock_db
+        ):
+            events.append(event_str)
 
-            mock_gen.return_value = {
-                "productName": "Test",
-                "map": {"activities": []}
-            }
-            mock_val.return_value = {"overall_score": 90, "issues": []}
-            mock_sim.return_value = {"duplicate_groups": [], "similar_groups": []}
+        parsed_events = [_parse_event(e) for e in events]
 
-            # Собираем события
-            events = []
-            async for event_str in generate_map_streaming(
-                requirements_text="Test requirements",
-                use_enhancement=False,
-                use_agent=False,
-                user_id=1,
-                db=mock_db
-            ):
-                events.append(event_str)
+        # Извлекаем progress из событий
+        progress_values = [e.get("progress", 0) for e in parsed_events if "progress" in e]
 
-            parsed_events = [json.loads(e[6:-2]) for e in events]
+        # Проверяем монотонность
+        assert (np.diff(progress_values) >= 0).all(), \
+            f"Progress decreased: {progress_values}"
 
-            # Извлекаем progress из событий
-            progress_values = [e.get("progress", 0) for e in parsed_events if "progress" in e]
+        # Проверяем финальный progress
+        assert progress_values[-1] == 100
 
-            # Проверяем монотонность
-            for i in range(1, len(progress_values)):
-                assert progress_values[i] >= progress_values[i-1], \
-                    f"Progress decreased: {progress_values[i-1]} → {progress_values[i]}"
 
-            # Проверяем финальный progress
-            assert progress_values[-1] == 100
+@pytest.fixture(scope="class")
+def counting_db():
+    """
+    Mock database session с автоинкрементом id в add() (один на класс,
+    сбрасывается после каждого теста в TestSaveProjectToDB._reset_db).
+    """
+    db = _FakeSession()
 
+    # Counter для автоинкремента ID (хранится на сессии, чтобы его сбрасывал _reset_db)
+    db._id_counter = {"value": 1}
 
-class TestSaveProjectToDB:
-    """Тесты сохранения проекта в БД."""
+    def mock_add(obj):
+        obj.id = db._id_counter["value"]
+        db._id_counter["value"] += 1
 
-    @pytest.fixture
-    def mock_db(self):
-        """Mock database session."""
-        db = MagicMock(spec=Session)
+    db.add.side_effect = mock_add
+    db.add_all.side_effect = lambda objs: [mock_add(o) for o in objs]
 
-        # Counter для автоинкремента ID
-        id_counter = {"value": 1}
+    return db
 
-        def mock_add(obj):
-            obj.id = id_counter["value"]
-            id_counter["value"] += 1
 
-        db.add = Mock(side_effect=mock_add)
-        db.add_all = Mock(side_effect=lambda objs: [mock_add(o) for o in objs])
-        db.flush = Mock()
-        db.commit = Mock()
+class TestSaveProjectToDB:
+    """Тесты сохранения проекта в БД."""
 
-        return db
+    @pytest.fixture(autouse=True)
+    def _reset_db(self, counting_db):
+        """Сбрасывает вызовы и счетчик ID; side_effect у add/add_all сохраняются."""
+        yield
+        counting_db.reset_mock()
+        counting_db._id_counter["value"] = 1
 
-    def test_save_basic_project(self, mock_db):
+    def test_save_basic_project(self, counting_db):
         """Проверка сохранения базового проекта."""
         map_data = {
             "activities": [
@@ -495,18 +606,18 @@ class TestSaveProjectToDB:
             map_data=map_data,
             user_id=1,
             enhancement_data=None,
-            db=mock_db
+            db=counting_db
         )
 
         # Проверяем, что проект создан
         assert project_id == 1
 
-        # Проверяем вызовы БД
-        assert mock_db.add.call_count >= 1  # Project
-        assert mock_db.add_all.call_count >= 1  # Releases
-        assert mock_db.commit.called
+        # Проверяем вызовы БД: релизы уходят каскадом вместе с проектом
+        assert counting_db.add.call_count == 1  # Project
+        assert counting_db.flush.call_count == 1
+        assert counting_db.commit.called
 
-    def test_save_with_enhancement(self, mock_db):
+    def test_save_with_enhancement(self, counting_db):
         """Проверка сохранения с enhancement данными."""
         enhancement_data = {
             "enhanced_text": "Enhanced requirements",
@@ -521,16 +632,16 @@ class TestSaveProjectToDB:
             map_data=map_data,
             user_id=1,
             enhancement_data=enhancement_data,
-            db=mock_db
+            db=counting_db
         )
 
         assert project_id == 1
 
         # Проверяем, что Project был создан с enhancement полями
         # (в реальности нужно проверить объект, но в mock это сложно)
-        assert mock_db.add.called
+        assert counting_db.add.called
 
-    def test_save_creates_default_releases(self, mock_db):
+    def test_save_creates_default_releases(self, counting_db):
         """Проверка создания дефолтных релизов: MVP, Release 1, Later."""
         map_data = {"activities": []}
 
@@ -540,12 +651,92 @@ class TestSaveProjectToDB:
             map_data=map_data,
             user_id=1,
             enhancement_data=None,
-            db=mock_db
+            db=counting_db
         )
 
-        # Проверяем, что add_all был вызван (для releases)
-        assert mock_db.add_all.called
+        # Релизы привязаны к проекту через relationship и сохраняются вместе с ним
+        project = counting_db.add.call_args.args[0]
+        assert [(r.title, r.position) for r in project.releases] == [
+            ("MVP", 0), ("Release 1", 1), ("Later", 2)
+        ]
+
+
+class TestSaveProjectToSQLite:
+    """Сохранение карты в реальную in-memory SQLite (транзакция теста откатывается)."""
+
+    MAP_DATA = {
+        "activities": [
+            {
+                "title": "Activity 1",
+                "tasks": [
+                    {
+                        "title": "Task 1.1",
+                        "stories": [
+                            {"title": "Story 1.1.1", "priority": "MVP"},
+                            {"title": "Story 1.1.2", "priority": "Release 1"},
+                        ]
+                    },
+                    {"title": "Task 1.2", "stories": []},
+                ]
+            },
+            {
+                "title": "Activity 2",
+                "tasks": [
+                    {
+                        "title": "Task 2.1",
+                        "stories": [{"title": "Story 2.1.1", "priority": "Later"}]
+                    }
+                ]
+            },
+        ]
+    }
+
+    @pytest.fixture
+    def db(self, db_transaction):
+        """Сессия поверх соединения теста: commit() фиксирует только SAVEPOINT."""
+        with Session(bind=db_transaction, join_transaction_mode="create_savepoint") as session:
+            yield session
+
+    # True - пакетный INSERT ... RETURNING, False - fallback через bulk_save_objects
+    @pytest.mark.parametrize("returning", [True, False])
+    def test_hierarchy_and_releases(self, db, registered_user, monkeypatch, returning):
+        monkeypatch.setattr(
+            db.get_bind().dialect,
+            "insert_executemany_returning_sort_by_parameter_order",
+            returning
+        )
+        user = db.query(User).filter(User.email == registered_user["email"]).one()
 
-        # В реальной БД должны быть созданы 3 релиза
-        # Проверяем хотя бы количество вызовов
-        assert mock_db.add_all.call_count >= 1
+        project_id = _save_project_to_db(
+            product_name="SQLite Product",
+            raw_requirements="Requirements",
+            map_data=self.MAP_DATA,
+            user_id=user.id,
+            enhancement_data=None,
+            db=db
+        )
+        db.expire_all()
+
+        project = db.get(Project, project_id)
+        assert [
+            (activity.title, [task.title for task in activity.tasks])
+            for activity in sorted(project.activities, key=lambda a: a.position)
+        ] == [
+            ("Activity 1", ["Task 1.1", "Task 1.2"]),
+            ("Activity 2", ["Task 2.1"]),
+        ]
+
+        releases = {release.id: release.title for release in project.releases}
+        # Истории, найденные через task_id/activity_id, и их релизы по priority
+        stories = sorted(
+            (story for activity in project.activities for task in activity.tasks for story in task.stories),
+            key=lambda story: story.title
+        )
+        assert [
+            (story.title, story.task.title, story.task.activity.title, releases[story.release_id])
+            for story in stories
+        ] == [
+            ("Story 1.1.1", "Task 1.1", "Activity 1", "MVP"),
+            ("Story 1.1.2", "Task 1.1", "Activity 1", "Release 1"),
+            ("Story 2.1.1", "Task 2.1", "Activity 2", "Later"),
+        ]
@@ -0,0 +1,191 @@
+"""
+Тесты для validation_service.py - валидация структуры User Story Map.
+
+Проверяем:
+1. Фильтр min_severity отсекает только список issues
+2. Score и issues_by_severity считаются по всем уровням
+3. Перезапрос графа проекта, если связи не загружены (без lazy-load на каждую Task)
+"""
+
+import pytest
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import Project, Activity, UserTask, UserStory, Release, User
+from schemas.analysis import IssueSeverity, IssueType
+from services.validation_service import (
+    _ensure_project_graph_loaded,
+    get_validation_summary,
+    validate_project_map,
+)
+
+
+@pytest.fixture
+def db(db_transaction):
+    """Сессия поверх соединения теста: commit() фиксирует только SAVEPOINT."""
+    with Session(bind=db_transaction, join_transaction_mode="create_savepoint") as session:
+        yield session
+
+
+@pytest.fixture
+def project_id(db, registered_user):
+    """
+    Проект с проблемами всех уровней, кроме ERROR:
+    - WARNING: история без criteria, Activity без Tasks, Task без историй
+    - INFO: история без описания
+    """
+    user = db.query(User).filter(User.email == registered_user["email"]).one()
+    mvp = Release(title="MVP", position=0)
+    release_1 = Release(title="Release 1", position=1)
+    project = Project(
+        user_id=user.id,
+        name="Validation",
+        releases=[mvp, release_1],
+        activities=[
+            Activity(title="Вход", position=0, tasks=[
+                UserTask(title="Авторизация", position=0, stories=[
+                    UserStory(title="Login", description="", release=mvp, position=0),
+                    UserStory(
+                        title="Регистрация пользователя",
+                        description="Пользователь создает аккаунт по email",
+                        acceptance_criteria=["Письмо с подтверждением"],
+                        release=release_1,
+                        position=1,
+                    ),
+                ]),
+            ]),
+            Activity(title="Пустая", position=1),
+            Activity(title="Настройки", position=2, tasks=[
+                UserTask(title="Профиль", position=0),
+            ]),
+        ],
+    )
+    db.add(project)
+    db.commit()
+    project_id = project.id
+    # Дальше тесты получают проект без загруженных связей
+    db.expunge_all()
+    return project_id
+
+
+@pytest.fixture
+def count_queries(db_transaction):
+    """Счетчик SQL-запросов на соединении теста."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db_transaction, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(db_transaction, "before_cursor_execute", before_cursor_execute)
+
+
+def _severities(result):
+    return sorted(issue.severity.value for issue in result.issues)
+
+
+class TestMinSeverity:
+    """Фильтр min_severity и подсчет по уровням."""
+
+    # 100 - 3 * 5 (WARNING) - 1 (INFO) + бонус int(0.5 * 5 + 0.5 * 5)
+    EXPECTED_SCORE = 89
+    EXPECTED_COUNTS = {"error": 0, "warning": 3, "info": 1}
+
+    def test_all_issues_by_default(self, db, project_id):
+        result = validate_project_map(db.get(Project, project_id), db)
+
+        assert _severities(result) == ["info", "warning", "warning", "warning"]
+        assert {issue.type for issue in result.issues} == {
+            IssueType.MISSING_DESCRIPTION,
+            IssueType.MISSING_CRITERIA,
+            IssueType.EMPTY_ACTIVITY,
+            IssueType.EMPTY_TASK,
+        }
+        assert result.stats["issues_by_severity"] == self.EXPECTED_COUNTS
+        assert result.score == self.EXPECTED_SCORE
+        assert result.is_valid
+
+    @pytest.mark.parametrize("min_severity, expected", [
+        (IssueSeverity.WARNING, ["warning", "warning", "warning"]),
+        (IssueSeverity.ERROR, []),
+    ])
+    def test_filter_keeps_score_and_counts(self, db, project_id, min_severity, expected):
+        result = validate_project_map(db.get(Project, project_id), db, min_severity=min_severity)
+
+        assert _severities(result) == expected
+        # Отфильтрованные проблемы все равно учитываются
+        assert result.stats["issues_by_severity"] == self.EXPECTED_COUNTS
+        assert result.score == self.EXPECTED_SCORE
+
+    def test_summary_counts_filtered_issues(self, db, project_id):
+        result = validate_project_map(db.get(Project, project_id), db, min_severity=IssueSeverity.ERROR)
+
+        assert "Предупреждений: 3." in get_validation_summary(result)
+
+    def test_error_makes_map_invalid(self, db, registered_user):
+        user = db.query(User).filter(User.email == registered_user["email"]).one()
+        project = Project(user_id=user.id, name="Empty")
+        db.add(project)
+        db.commit()
+
+        result = validate_project_map(project, db, min_severity=IssueSeverity.ERROR)
+
+        assert not result.is_valid
+        assert [issue.type for issue in result.issues] == [IssueType.EMPTY_ACTIVITY]
+        assert result.stats["issues_by_severity"]["error"] == 1
+
+
+class TestEnsureProjectGraphLoaded:
+    """Перезапрос графа проекта одним набором запросов."""
+
+    def test_unloaded_graph_requeried(self, db, project_id, count_queries):
+        project = db.get(Project, project_id)
+        assert "activities" in inspect(project).unloaded
+        count_queries.clear()
+
+        loaded = _ensure_project_graph_loaded(project, db)
+
+        state = inspect(loaded)
+        assert "activities" not in state.unloaded
+        assert "releases" not in state.unloaded
+        # Project + activities + releases одним JOIN, затем tasks и stories
+        assert len(count_queries) == 3
+
+        count_queries.clear()
+        validate_project_map(loaded, db)
+        assert count_queries == []
+
+    def test_validation_without_eager_load_does_not_lazy_load(self, db, project_id, count_queries):
+        project = db.get(Project, project_id)
+        count_queries.clear()
+
+        validate_project_map(project, db)
+
+        assert len(count_queries) == 3
+
+    def test_loaded_graph_returned_as_is(self, db, project_id, count_queries):
+        project = _ensure_project_graph_loaded(db.get(Project, project_id), db)
+        count_queries.clear()
+
+        assert _ensure_project_graph_loaded(project, db) is project
+        assert count_queries == []
+
+    def test_transient_project_without_db(self):
+        """Карта, еще не сохраненная в БД (db=None), валидируется как есть."""
+        mvp = Release(id=1, title="MVP")
+        project = Project(
+            id=None,
+            releases=[mvp],
+            activities=[Activity(title="Вход", tasks=[
+                UserTask(title="Авторизация", stories=[
+                    UserStory(title="Вход по email", release_id=1, acceptance_criteria=["OK"]),
+                ]),
+            ])],
+        )
+
+        assert _ensure_project_graph_loaded(project, None) is project
+
+        result = validate_project_map(project, None)
+        assert result.stats["total_stories"] == 1
+        assert result.stats["stories_per_release"] == {"MVP": 1}
@@ -0,0 +1,112 @@
+"""
+Тесты для wireframe_service.py - постановка задачи генерации wireframe.
+
+Проверяем:
+1. Повторный запрос подсаживается на задачу, ожидающую в очереди
+2. Запущенная или завершенная задача не переиспользуется (новый id)
+3. Запрос, проигравший блокировку, ждет ее и получает задачу победителя
+"""
+
+import pytest
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+from services import wireframe_service
+from services.wireframe_service import enqueue_wireframe_job
+
+
+class _FakeRedis:
+    """Минимальный Redis в памяти: SET (NX/EX), GET, DELETE."""
+
+    def __init__(self):
+        self.store = {}
+        # Вызывается, когда SET NX не удался (ключ занят параллельным запросом)
+        self.on_nx_conflict = None
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.store:
+            if self.on_nx_conflict:
+                self.on_nx_conflict(key)
+            return None
+        self.store[key] = value if isinstance(value, bytes) else str(value).encode()
+        return True
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def delete(self, key):
+        self.store.pop(key, None)
+
+
+def _job(job_id, status):
+    job = Mock()
+    job.id = job_id
+    job.get_status.return_value = status
+    return job
+
+
+@pytest.fixture
+def adapter():
+    """QueueAdapter с фейковым Redis: enqueue создает задачу в статусе queued."""
+    jobs = {}
+
+    def enqueue(func, *args, job_id, **kwargs):
+        jobs[job_id] = _job(job_id, "queued")
+        return jobs[job_id]
+
+    fake = SimpleNamespace(
+        connection=_FakeRedis(),
+        jobs=jobs,
+        get_job=jobs.get,
+        enqueue=Mock(side_effect=enqueue),
+    )
+    with patch.object(wireframe_service, "_get_queue_adapter", return_value=fake):
+        yield fake
+
+
+def test_queued_job_is_reused(adapter):
+    first = enqueue_wireframe_job(1, 7)
+    second = enqueue_wireframe_job(1, 7)
+
+    assert second == first
+    assert adapter.enqueue.call_count == 1
+    # Блокировка снята после постановки
+    assert not any(key.endswith(":enqueue-lock") for key in adapter.connection.store)
+
+
+@pytest.mark.parametrize("status", ["started", "finished", "failed"])
+def test_not_queued_job_gets_new_id(adapter, status):
+    first = enqueue_wireframe_job(1, 7)
+    adapter.jobs[first].get_status.return_value = status
+
+    second = enqueue_wireframe_job(1, 7)
+
+    assert second != first
+    assert adapter.enqueue.call_count == 2
+    assert adapter.connection.get(wireframe_service._latest_job_key(1, 7)) == second.encode()
+
+
+def test_projects_do_not_share_jobs(adapter):
+    assert enqueue_wireframe_job(1, 7) != enqueue_wireframe_job(2, 7)
+
+
+def test_lock_loser_waits_and_reuses_winner_job(adapter):
+    """Пока блокировку держит другой запрос, ждем; затем подсаживаемся на его задачу."""
+    latest_key = wireframe_service._latest_job_key(1, 7)
+    adapter.connection.set(f"{latest_key}:enqueue-lock", b"1")
+
+    conflicts = []
+
+    def winner_finishes(lock_key):
+        # Параллельный запрос поставил задачу и снял блокировку
+        conflicts.append(lock_key)
+        adapter.jobs["winner"] = _job("winner", "queued")
+        adapter.connection.store[latest_key] = b"winner"
+        adapter.connection.delete(lock_key)
+
+    adapter.connection.on_nx_conflict = winner_finishes
+    job_id = enqueue_wireframe_job(1, 7)
+
+    assert job_id == "winner"
+    assert len(conflicts) == 1
+    adapter.enqueue.assert_not_called()
@@ -0,0 +1,227 @@
+"""
+Тесты для workers/wireframe_worker_text.py - генерация text-based wireframes.
+
+Проверяем:
+1. Парсинг секций ответа AI (первое вхождение, список UI элементов)
+2. Подстановку данных story/task/activity в шаблон промпта
+3. Параллельную генерацию: лимит семафора, порядок результатов, ошибки stories
+4. Кеш ответов AI в Redis
+"""
+
+import asyncio
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from workers import wireframe_worker_text
+from workers.wireframe_worker_text import TextWireframeWorker
+
+
+AI_RESPONSE = """```ascii
+┌────────┐
+│ Header │
+└────────┘
+```
+
+## Layout Description
+Header сверху, форма по центру
+
+## UI Elements
+- [Input] Email (placeholder: "user@example.com")
+- [Button] Register
+не элемент списка
+
+## Navigation
+Главная → Регистрация
+
+## Additional Notes
+Показать спиннер при отправке
+"""
+
+
+def _story(story_id, title="Регистрация", criteria=None, task=None):
+    return SimpleNamespace(
+        id=story_id,
+        title=title,
+        description=f"Описание {story_id}",
+        acceptance_criteria=criteria,
+        task=task,
+    )
+
+
+@pytest.fixture
+def worker():
+    return TextWireframeWorker()
+
+
+class TestParseWireframeResponse:
+    """Тесты разбора ответа AI на секции."""
+
+    def test_all_sections(self, worker):
+        result = worker._parse_wireframe_response(AI_RESPONSE)
+
+        assert result["full_text"] == AI_RESPONSE
+        assert result["ascii_wireframe"] == "┌────────┐\n│ Header │\n└────────┘"
+        assert result["layout_description"] == "Header сверху, форма по центру"
+        assert result["ui_elements"] == [
+            '- [Input] Email (placeholder: "user@example.com")',
+            "- [Button] Register",
+        ]
+        assert result["navigation"] == "Главная → Регистрация"
+        assert result["notes"] == "Показать спиннер при отправке"
+
+    def test_first_occurrence_wins(self, worker):
+        response = "## Navigation\nпервая\n## Navigation\nвторая\n"
+
+        assert worker._parse_wireframe_response(response)["navigation"] == "первая"
+
+    def test_missing_sections_are_empty(self, worker):
+        result = worker._parse_wireframe_response("Просто текст без секций")
+
+        assert result["ascii_wireframe"] == ""
+        assert result["ui_elements"] == []
+        assert result["notes"] == ""
+
+
+class TestBuildWireframePrompt:
+    """Тесты подстановки в шаблон промпта."""
+
+    def test_story_context_in_prompt(self, worker):
+        activity = SimpleNamespace(title="Онбординг")
+        task = SimpleNamespace(title="Создать аккаунт", activity=activity)
+        story = _story(1, criteria=["Email валидируется", "Пароль от 8 символов"])
+
+        prompt = worker._build_wireframe_prompt(
+            story=story, task=task, activity=activity, style="high-fidelity", platform="mobile"
+        )
+
+        assert "Название: Регистрация" in prompt
+        assert "Описание: Описание 1" in prompt
+        assert "  • Email валидируется\n  • Пароль от 8 символов" in prompt
+        assert "Activity: Онбординг" in prompt
+        assert "Task: Создать аккаунт" in prompt
+        assert wireframe_worker_text._STYLE_INSTR["high-fidelity"] in prompt
+        assert wireframe_worker_text._PLATFORM_INSTR["mobile"] in prompt
+
+    def test_defaults_without_context(self, worker):
+        prompt = worker._build_wireframe_prompt(
+            story=_story(1), task=None, activity=None, style="unknown", platform="web"
+        )
+
+        assert "  • Нет критериев" in prompt
+        assert "Activity: N/A" in prompt
+        assert "Task: N/A" in prompt
+        # Неизвестный стиль не ломает format
+        assert "Стиль: unknown" in prompt
+
+
+@pytest.mark.anyio
+class TestProcessMessage:
+    """Тесты параллельной генерации wireframes одного job."""
+
+    @pytest.fixture
+    def stories(self):
+        return [_story(i, title=f"Story {i}") for i in range(1, 21)]
+
+    @pytest.fixture
+    def db(self, stories):
+        """SessionLocal, возвращающий stories на query(...).options(...).filter(...).all()."""
+        session = MagicMock()
+        session.query.return_value.options.return_value.filter.return_value.all.return_value = stories
+        with patch.object(wireframe_worker_text, "SessionLocal", return_value=session):
+            yield session
+
+    @pytest.fixture
+    def job_service(self, worker):
+        """JobService и JobStatus вместо нереализованного services.job_service."""
+        statuses = SimpleNamespace(PROCESSING="processing", COMPLETED="completed", FAILED="failed")
+        worker.job_service = AsyncMock()
+        with patch.object(wireframe_worker_text, "JobStatus", statuses):
+            yield worker.job_service
+
+    async def test_concurrency_limited_and_order_kept(self, worker, db, stories, job_service):
+        active = 0
+        max_active = 0
+
+        async def generate(story, **kwargs):
+            nonlocal active, max_active
+            active += 1
+            max_active = max(max_active, active)
+            await asyncio.sleep(0)
+            active -= 1
+            if story.id == 5:
+                raise RuntimeError("AI недоступен")
+            return {"story_id": story.id}
+
+        worker._generate_wireframe_for_story = generate
+        with patch.object(wireframe_worker_text, "WIREFRAME_AI_CONCURRENCY", 3):
+            await worker.process_message({"job_id": "job-1", "story_ids": [s.id for s in stories]})
+
+        assert max_active == 3
+        db.close.assert_called_once()
+
+        final = job_service.update_job_status.call_args_list[-1].kwargs
+        assert final["status"] == "completed"
+        wireframes = final["result"]["wireframes"]
+        assert [w["story_id"] for w in wireframes] == list(range(1, 21))
+        assert wireframes[4] == {
+            "story_id": 5, "story_title": "Story 5", "error": "AI недоступен", "status": "failed"
+        }
+        assert final["result"]["successful"] == 19
+        assert final["result"]["failed"] == 1
+
+    async def test_progress_updates_batched(self, worker, db, stories, job_service):
+        worker._generate_wireframe_for_story = AsyncMock(return_value={})
+
+        await worker.process_message({"job_id": "job-1", "story_ids": [s.id for s in stories]})
+
+        calls = job_service.update_job_status.call_args_list
+        progress = [c.kwargs["result"]["progress"] for c in calls if c.kwargs.get("result", {}).get("progress")]
+        # 20 stories -> обновление каждые 2 готовых, без списка wireframes
+        assert progress == [f"{n}/20" for n in range(2, 21, 2)]
+        assert calls[0].kwargs == {"job_id": "job-1", "status": "processing"}
+
+    async def test_no_stories_marks_job_failed(self, worker, db, job_service):
+        db.query.return_value.options.return_value.filter.return_value.all.return_value = []
+
+        with pytest.raises(ValueError):
+            await worker.process_message({"job_id": "job-1", "story_ids": [99]})
+
+        assert job_service.update_job_status.call_args.kwargs["status"] == "failed"
+        assert worker.failed_count == 1
+        db.close.assert_called_once()
+
+
+@pytest.mark.anyio
+class TestWireframeCache:
+    """Тесты кеша ответов AI для одной story."""
+
+    async def test_cache_miss_calls_ai_and_stores(self, worker):
+        worker.redis_client = AsyncMock()
+        worker.redis_client.get.return_value = None
+
+        with patch.object(wireframe_worker_text, "generate_ai_response", return_value=AI_RESPONSE) as ai:
+            result = await worker._generate_wireframe_for_story(
+                story=_story(1), task=None, activity=None, style="low-fidelity", platform="web"
+            )
+
+        ai.assert_called_once()
+        key, ttl, value = worker.redis_client.setex.call_args.args
+        assert key.startswith("wireframe:")
+        assert ttl == wireframe_worker_text.WIREFRAME_CACHE_TTL
+        assert value == AI_RESPONSE
+        assert result["story_id"] == 1
+        assert result["navigation"] == "Главная → Регистрация"
+
+    async def test_cache_hit_skips_ai(self, worker):
+        worker.redis_client = AsyncMock()
+        worker.redis_client.get.return_value = AI_RESPONSE
+
+        with patch.object(wireframe_worker_text, "generate_ai_response") as ai:
+            result = await worker._generate_wireframe_for_story(
+                story=_story(1), task=None, activity=None, style="low-fidelity", platform="web"
+            )
+
+        ai.assert_not_called()
+        worker.redis_client.setex.assert_not_called()
+        assert result["layout_description"] == "Header сверху, форма по центру"
@@ -2,6 +2,8 @@
 Настройка базы данных и сессий
 """
 import logging
+import os
+import time
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from config import settings
@@ -20,19 +22,21 @@ pool_kwargs = {
 
 # Для PostgreSQL (включая Supabase) устанавливаем ограничения пула
 if not settings.is_sqlite():
-    import os
     # Настройки пула для Supabase
     # Transaction mode (порт 6543) позволяет больше соединений, чем Session mode (порт 5432)
     # Transaction mode рекомендуется для production и stateless приложений
-    # Можно переопределить через переменные окружения DB_POOL_SIZE
-    # По умолчанию используем pool_size=3 для Transaction mode (можно увеличить до 5-10 при необходимости)
-    default_pool_size = int(os.getenv("DB_POOL_SIZE", "3"))  # Для Transaction mode можно использовать больше соединений
+    # Можно переопределить через переменные окружения DB_POOL_SIZE / DB_MAX_OVERFLOW
+    # По умолчанию: Session mode Supabase - 3 соединения без overflow (жесткий лимит),
+    # Transaction mode и обычный PostgreSQL - 10 + 20 overflow (параллельные запросы и воркеры)
+    supabase_session_mode = "pooler.supabase.com" in settings.DATABASE_URL and ":5432" in settings.DATABASE_URL
+    default_pool_size = int(os.getenv("DB_POOL_SIZE", "3" if supabase_session_mode else "10"))
     pool_kwargs.update({
         "pool_size": default_pool_size,
-        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "0")),  # Не создавать дополнительные соединения сверх pool_size
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "0" if supabase_session_mode else "20")),
         "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),  # Переиспользовать соединения каждые 1800 секунд (30 минут)
         "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "20")),  # Таймаут ожидания соединения из пула (20 секунд)
-        "pool_reset_on_return": "commit",  # Сбрасывать транзакции при возврате соединения в пул
+        # LIFO: при небольшой нагрузке работает одно "горячее" соединение, остальные простаивают
+        "pool_use_lifo": os.getenv("DB_POOL_USE_LIFO", "true").lower() == "true",
     })
 
 engine = create_engine(
@@ -45,7 +49,8 @@ engine = create_engine(
 if not settings.is_sqlite():
     logger.info(f"📊 Database pool settings: pool_size={pool_kwargs.get('pool_size')}, "
                 f"max_overflow={pool_kwargs.get('max_overflow')}, "
-                f"pool_recycle={pool_kwargs.get('pool_recycle')}s")
+                f"pool_recycle={pool_kwargs.get('pool_recycle')}s, "
+                f"pool_use_lifo={pool_kwargs.get('pool_use_lifo')}")
     # Проверка режима Supabase
     if "pooler.supabase.com" in settings.DATABASE_URL:
         if ":6543" in settings.DATABASE_URL:
@@ -55,15 +60,40 @@ if not settings.is_sqlite():
             logger.warning("💡 Рекомендуется использовать Transaction mode pooler (порт 6543) для лучшей производительности")
             logger.warning("💡 Измените DATABASE_URL: замените порт 5432 на 6543 и добавьте ?pgbouncer=true")
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: после commit объекты не перечитываются лениво из БД
+# (например, project.id после сохранения); где нужны свежие данные - db.refresh()
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 Base = declarative_base()
 
 
 def get_db():
-    """Dependency для получения DB сессии"""
-    db = SessionLocal()
-    try:
+    """
+    Dependency для получения DB сессии (своя на каждый запрос).
+
+    Не scoped_session: FastAPI может выполнить вход и выход sync-зависимости в
+    разных потоках threadpool, и thread-local remove() закрыл бы чужую сессию.
+    """
+    with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
+
+def prewarm_pool():
+    """
+    Заранее открывает pool_size соединений, чтобы первые запросы не платили
+    за TLS + аутентификацию в Supabase. Для SQLite и при DB_PREWARM=0 ничего не делает.
+    """
+    if settings.is_sqlite() or os.getenv("DB_PREWARM", "1") != "1":
+        return
+
+    started = time.perf_counter()
+    connections = []
+    try:
+        for _ in range(pool_kwargs["pool_size"]):
+            connections.append(engine.connect())
+    except Exception as e:
+        logger.warning(f"⚠️ Database pool prewarm failed after {len(connections)} connection(s): {e}")
+    finally:
+        # Соединения возвращаются в пул открытыми
+        for connection in connections:
+            connection.close()
+    logger.info(f"🔥 Database pool prewarmed: {len(connections)} connection(s) in {time.perf_counter() - started:.2f}s")
@@ -3,10 +3,17 @@
 """
 import re
 import logging
-from typing import Any, Dict, List, Union
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import Response
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Mapping, Tuple, Union
+import orjson
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# google-re2 (опционально): DFA с линейным временем на любом входе - строка лога
+# не может вызвать катастрофический backtracking. Без пакета - стандартный re.
+try:
+    import re2 as _regex
+except ImportError:
+    _regex = re
 
 
 logger = logging.getLogger(__name__)
@@ -24,6 +31,10 @@ SENSITIVE_FIELDS = [
     "bearer",
 ]
 
+# Точные имена - быстрый путь; иначе одна проверка вхождения всех полей сразу
+_SENSITIVE_FIELDS_EXACT = frozenset(SENSITIVE_FIELDS)
+_SENSITIVE_FIELD_PATTERN = re.compile("|".join(map(re.escape, SENSITIVE_FIELDS)))
+
 # Паттерны для маскировки в строках
 SENSITIVE_PATTERNS = [
     # JWT токены (eyJ...)
@@ -31,13 +42,38 @@ SENSITIVE_PATTERNS = [
     # Bearer токены в заголовках
     (r'Bearer\s+[A-Za-z0-9_.-]+', 'Bearer [MASKED]'),
     # API ключи (sk-..., pplx-...)
-    (r'(sk-|pplx-)[A-Za-z0-9]+', '[MASKED_API_KEY]'),
+    (r'(?:sk-|pplx-)[A-Za-z0-9]+', '[MASKED_API_KEY]'),
     # Refresh токены (base64-подобные длинные строки)
     (r'"refresh_token"\s*:\s*"[A-Za-z0-9_-]{20,}"', '"refresh_token": "[MASKED]"'),
     # Пароли в JSON
     (r'"password"\s*:\s*"[^"]*"', '"password": "[MASKED]"'),
 ]
 
+# Литералы, с которых начинается любое совпадение соответствующего паттерна
+# SENSITIVE_PATTERNS: если их нет в строке, паттерн не запускается
+_PATTERN_ANCHORS = [
+    ("eyJ",),
+    ("Bearer",),
+    ("sk-", "pplx-"),
+    ('"refresh_token"',),
+    ('"password"',),
+]
+
+# Паттерны компилируются один раз и применяются по очереди, как и раньше: одна общая
+# альтернация выбирает самое левое совпадение, и API ключ "съедает" начало JWT или
+# Bearer токена, идущего сразу за ним
+_COMPILED_PATTERNS = [
+    (anchors, _regex.compile(pattern), replacement)
+    for anchors, (pattern, replacement) in zip(_PATTERN_ANCHORS, SENSITIVE_PATTERNS)
+]
+
+# Строковое поле JSON, имя которого содержит одно из SENSITIVE_FIELDS (без учета регистра):
+# группа 1 - '"ключ": "', группа 2 - значение (с учетом экранированных кавычек)
+_SENSITIVE_JSON_FIELD_PATTERN = _regex.compile(
+    r'(?i)("[^"\\]*(?:' + "|".join(map(re.escape, SENSITIVE_FIELDS)) + r')[^"\\]*"\s*:\s*")'
+    r'((?:[^"\\]|\\.)*)"'
+)
+
 
 def mask_sensitive_value(value: str) -> str:
     """Маскирует чувствительное значение, оставляя первые 4 символа"""
@@ -46,89 +82,122 @@ def mask_sensitive_value(value: str) -> str:
     return value[:4] + "****" + value[-2:] if len(value) > 10 else value[:4] + "****"
 
 
+@lru_cache(maxsize=1024)
+def _is_sensitive_key(key: str) -> bool:
+    """Содержит ли имя поля/заголовка одно из SENSITIVE_FIELDS (без учета регистра)."""
+    key_lower = key.lower()
+    return key_lower in _SENSITIVE_FIELDS_EXACT or _SENSITIVE_FIELD_PATTERN.search(key_lower) is not None
+
+
 def mask_dict(data: Dict[str, Any], parent_key: str = "") -> Dict[str, Any]:
-    """Рекурсивно маскирует чувствительные поля в словаре"""
+    """
+    Маскирует чувствительные поля во вложенных словарях и списках.
+
+    Обход идет по явному стеку (без рекурсии и лимита глубины); один и тот же
+    вложенный dict (в том числе циклическая ссылка) копируется один раз.
+    """
     masked = {}
-    for key, value in data.items():
-        key_lower = key.lower()
-        
-        # Проверяем, является ли ключ чувствительным
-        is_sensitive = any(sensitive in key_lower for sensitive in SENSITIVE_FIELDS)
-        
-        if is_sensitive and isinstance(value, str):
-            masked[key] = mask_sensitive_value(value)
-        elif isinstance(value, dict):
-            masked[key] = mask_dict(value, key)
-        elif isinstance(value, list):
-            masked[key] = [
-                mask_dict(item, key) if isinstance(item, dict) else item
-                for item in value
-            ]
-        else:
-            masked[key] = value
-    
+    memo = {id(data): masked}
+    stack = [(data, masked)]
+    while stack:
+        source, target = stack.pop()
+        for key, value in source.items():
+            if isinstance(value, str):
+                if _is_sensitive_key(key):
+                    value = mask_sensitive_value(value)
+                target[key] = value
+            elif isinstance(value, dict):
+                target[key] = _masked_copy(value, memo, stack)
+            elif isinstance(value, list):
+                target[key] = [
+                    _masked_copy(item, memo, stack) if isinstance(item, dict) else item
+                    for item in value
+                ]
+            else:
+                target[key] = value
+
     return masked
 
 
+def _masked_copy(source: Dict[str, Any], memo: Dict[int, Dict[str, Any]], stack: List) -> Dict[str, Any]:
+    """Возвращает копию dict для mask_dict; заполнение копии ставится в стек обхода."""
+    copy = memo.get(id(source))
+    if copy is None:
+        copy = memo[id(source)] = {}
+        stack.append((source, copy))
+    return copy
+
+
 def mask_string(text: str) -> str:
     """Маскирует чувствительные данные в строке"""
     result = text
-    for pattern, replacement in SENSITIVE_PATTERNS:
-        result = re.sub(pattern, replacement, result)
+    for anchors, pattern, replacement in _COMPILED_PATTERNS:
+        # Обычная строка лога не содержит ни одного якоря - regex не запускается
+        if any(anchor in result for anchor in anchors):
+            result = pattern.sub(replacement, result)
     return result
 
 
-def mask_headers(headers: Dict[str, str]) -> Dict[str, str]:
-    """Маскирует чувствительные заголовки"""
-    masked = {}
-    for key, value in headers.items():
-        key_lower = key.lower()
-        if any(sensitive in key_lower for sensitive in SENSITIVE_FIELDS):
-            masked[key] = mask_sensitive_value(value) if value else value
-        else:
-            masked[key] = value
-    return masked
+def mask_headers(headers: Union[Mapping[str, str], Iterable[Tuple[str, str]]]) -> Dict[str, str]:
+    """Маскирует чувствительные заголовки (dict или пары (имя, значение))"""
+    items = headers.items() if isinstance(headers, Mapping) else headers
+    return {
+        key: mask_sensitive_value(value) if value and _is_sensitive_key(key) else value
+        for key, value in items
+    }
 
 
-class SecureLoggingMiddleware(BaseHTTPMiddleware):
+class SecureLoggingMiddleware:
     """
     Middleware для безопасного логирования запросов.
     Маскирует пароли, токены и другие чувствительные данные.
     
     ВАЖНО: НЕ читает тела запросов чтобы не ломать их обработку!
     Логируется только метод, путь и маскированные заголовки.
+    
+    Чистый ASGI (без BaseHTTPMiddleware): когда DEBUG выключен, запрос
+    передается приложению напрямую, без лишних задач и оберток.
     """
     
-    def __init__(self, app, log_bodies: bool = False):
-        super().__init__(app)
+    def __init__(self, app: ASGIApp, log_bodies: bool = False):
+        self.app = app
         # log_bodies отключён принудительно - чтение body ломает запросы
         self.log_bodies = False  # Игнорируем параметр для безопасности
     
-    async def dispatch(self, request: Request, call_next) -> Response:
-        # Пропускаем OPTIONS запросы (CORS preflight) без логирования
-        if request.method == "OPTIONS":
-            return await call_next(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # Пропускаем не-HTTP, OPTIONS запросы (CORS preflight) и все запросы без DEBUG
+        # (isEnabledFor кэшируется в logging и учитывает смену уровня на лету)
+        if (scope["type"] != "http"
+                or scope["method"] == "OPTIONS"
+                or not logger.isEnabledFor(logging.DEBUG)):
+            await self.app(scope, receive, send)
+            return
         
-        # Логируем запрос с маскированными заголовками (только в DEBUG)
-        if logger.isEnabledFor(logging.DEBUG):
-            masked_headers = mask_headers(dict(request.headers))
-            logger.debug(
-                f"Request: {request.method} {request.url.path} "
-                f"Headers: {masked_headers}"
-            )
+        method, path = scope["method"], scope["path"]
+        # Сырые заголовки ASGI маскируются за один проход, без промежуточного dict
+        masked_headers = mask_headers(
+            (key.decode("latin-1"), value.decode("latin-1")) for key, value in scope["headers"]
+        )
+        logger.debug(f"Request: {method} {path} Headers: {masked_headers}")
         
         # НЕ читаем body - это сломает обработку запроса!
-        # Body можно прочитать только один раз в Starlette
+        # Статус ответа берем из сообщения http.response.start
+        status_code = None
         
-        response = await call_next(request)
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
         
-        if logger.isEnabledFor(logging.DEBUG):
-            logger.debug(
-                f"Response: {request.method} {request.url.path} "
-                f"Status: {response.status_code}"
-            )
+        await self.app(scope, receive, send_wrapper)
         
-        return response
+        logger.debug(f"Response: {method} {path} Status: {status_code}")
+
+
+def _mask_json_field(match) -> str:
+    """Замена для _SENSITIVE_JSON_FIELD_PATTERN: значение маскируется как в mask_dict."""
+    return f'{match.group(1)}{mask_sensitive_value(match.group(2))}"'
 
 
 def get_safe_log_message(message: str, data: Any = None) -> str:
@@ -140,7 +209,13 @@ def get_safe_log_message(message: str, data: Any = None) -> str:
     
     if data is not None:
         if isinstance(data, dict):
-            masked_data = mask_dict(data)
+            try:
+                # Маскируем уже сериализованный JSON: без обхода dict и его копии
+                serialized = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode()
+            except TypeError:
+                # Несериализуемые значения - маскируем через обход словаря
+                return f"{masked_message} | Data: {mask_dict(data)}"
+            masked_data = mask_string(_SENSITIVE_JSON_FIELD_PATTERN.sub(_mask_json_field, serialized))
             return f"{masked_message} | Data: {masked_data}"
         elif isinstance(data, str):
             return f"{masked_message} | {mask_string(data)}"
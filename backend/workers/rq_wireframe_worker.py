@@ -2,13 +2,16 @@
 """
 RQ worker for wireframe generation.
 
-Runs: rq worker wireframes --path backend
+Runs: python workers/rq_wireframe_worker.py
+(RQ_NUM_WORKERS - число процессов-воркеров, по умолчанию 4)
 """
 import logging
+import os
 import sys
 from pathlib import Path
 
 from rq import Worker, Queue, Connection  # type: ignore
+from rq.worker_pool import WorkerPool  # type: ignore
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
@@ -17,6 +20,9 @@ from config import settings  # noqa: E402
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
+# Задачи wireframes ждут ответа AI (I/O), поэтому по умолчанию несколько воркеров
+RQ_NUM_WORKERS = int(os.getenv("RQ_NUM_WORKERS", "4"))
+
 
 def main() -> None:
     import redis  # type: ignore
@@ -25,7 +31,16 @@ def main() -> None:
     conn = redis.from_url(redis_url)
 
     listen_queues = ["wireframes"]
-    logger.info(f"Starting RQ worker for queues: {listen_queues}, redis={redis_url}")
+    logger.info(
+        f"Starting RQ worker for queues: {listen_queues}, "
+        f"workers={RQ_NUM_WORKERS}, redis={redis_url}"
+    )
+
+    if RQ_NUM_WORKERS > 1:
+        # Пул форкнутых воркеров: каждый берет свою задачу из очереди
+        pool = WorkerPool(queues=listen_queues, connection=conn, num_workers=RQ_NUM_WORKERS)
+        pool.start()
+        return
 
     with Connection(conn):
         worker = Worker(map(Queue, listen_queues))
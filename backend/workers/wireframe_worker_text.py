@@ -16,6 +16,8 @@ RabbitMQ Consumer для генерации Text-based Wireframes
 """
 import asyncio
 import logging
+import os
+import re
 import signal
 import sys
 from pathlib import Path
@@ -24,25 +26,130 @@ from datetime import datetime
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload, load_only
 
 from config import settings
 from utils.database import SessionLocal
-from services.rabbitmq_service import rabbitmq_service
-from services.ai_service import generate_ai_response
-from services.job_service import JobService, JobStatus
+from services.ai_service import generate_ai_response, get_cache_key
 from models import UserStory, UserTask, Activity
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('logs/wireframe_worker.log')
-    ]
-)
 logger = logging.getLogger(__name__)
 
+# Lazy import для очереди RabbitMQ и статусов job: сервисы описаны в
+# RABBITMQ_IMPLEMENTATION_PLAN.md и пока не реализованы. Без них модуль
+# импортируется (генерация и парсинг wireframe работают), но start() не запустится
+RABBITMQ_AVAILABLE = False
+rabbitmq_service = None
+JobService = None
+JobStatus = None
+
+try:
+    from services.rabbitmq_service import rabbitmq_service
+    from services.job_service import JobService, JobStatus
+    RABBITMQ_AVAILABLE = True
+except ImportError as e:
+    logger.warning(f"RabbitMQ services not available (ImportError): {e}")
+
+# Сколько wireframes одного job генерируется одновременно (параллельные запросы к AI)
+WIREFRAME_AI_CONCURRENCY = int(os.getenv("WIREFRAME_AI_CONCURRENCY", "4"))
+
+# Сколько хранится ответ AI для одного и того же промпта (секунд)
+WIREFRAME_CACHE_TTL = 86400  # 24 часа
+
+# Секции ответа AI (см. _build_wireframe_prompt): одна регулярка с именованными
+# группами, ответ сканируется один раз
+_SECTIONS_RE = re.compile(
+    r'```ascii\n(?P<ascii_wireframe>.*?)```'
+    r'|## Layout Description\n(?P<layout_description>.*?)(?=##|$)'
+    r'|## UI Elements\n(?P<ui_elements>.*?)(?=##|$)'
+    r'|## Navigation\n(?P<navigation>.*?)(?=##|$)'
+    r'|## Additional Notes\n(?P<notes>.*?)$',
+    re.DOTALL
+)
+
+# Инструкции промпта по стилю и платформе wireframe
+_STYLE_INSTR = {
+    "low-fidelity": "Простая ASCII схема с базовыми блоками, минимум деталей",
+    "high-fidelity": "Детальная ASCII схема с конкретными элементами и labels",
+    "component": "Фокус на одном UI компоненте с детальным описанием"
+}
+
+_PLATFORM_INSTR = {
+    "web": "Desktop web интерфейс (navbar, cards, sidebar)",
+    "mobile": "Mobile app интерфейс (portrait, bottom navigation, swipe gestures)",
+    "desktop": "Native desktop приложение (menu bar, toolbar, panels)"
+}
+
+# Шаблон промпта (см. _build_wireframe_prompt): собирается один раз при импорте,
+# на каждую story остается только format
+_PROMPT_TEMPLATE = """Создай text-based wireframe (ASCII схема + описание) для следующей User Story:
+
+
+User Story:
+Название: {title}
+Описание: {description}
+
+Acceptance Criteria:
+{criteria}
+
+Контекст:
+Activity: {activity}
+Task: {task}
+
+Параметры:
+Стиль: {style}
+Платформа: {platform}
+
+
+ТРЕБОВАНИЯ:
+
+1. **ASCII Wireframe:**
+   - Используй box-drawing characters: ┌─┐│└┘├┤┬┴┼
+   - Покажи структуру экрана визуально
+   - Обозначь основные UI блоки: Header, Content, Footer
+   - Стиль: {style_instr}
+   - Платформа: {platform_instr}
+
+2. **Описание Layout:**
+   - Опиши структуру экрана текстом
+   - Перечисли все разделы (Header, Main, Sidebar, Footer)
+   - Укажи их назначение
+
+3. **UI Элементы:**
+   Список всех UI компонентов в формате:
+   - [Type] Label/Text (placeholder, если есть)
+
+   Примеры:
+   - [Input] Email (placeholder: "user@example.com")
+   - [Button] Register (primary, top-right)
+   - [Link] Forgot password? (below password field)
+
+4. **Навигация:**
+   - Откуда попадаем на этот экран
+   - Куда можно перейти с этого экрана
+   - Основные user flows
+
+ФОРМАТ ОТВЕТА (СТРОГО СОБЛЮДАЙ):
+
+```ascii
+[ASCII wireframe схема здесь]
+```
+
+## Layout Description
+[Текстовое описание структуры]
+
+## UI Elements
+[Список всех элементов]
+
+## Navigation
+[Описание навигации]
+
+## Additional Notes
+[Дополнительные замечания по UX, если есть]
+
+Будь конкретным, детальным и профессиональным. Опиши экран так, чтобы фронтенд-разработчик мог его реализовать.
+"""
+
 
 class TextWireframeWorker:
     """Worker для генерации text-based wireframes из User Stories"""
@@ -50,7 +157,7 @@ class TextWireframeWorker:
     def __init__(self):
         self.running = False
         self.redis_client = None
-        self.job_service: Optional[JobService] = None
+        self.job_service = None
         self.processed_count = 0
         self.failed_count = 0
 
@@ -63,6 +170,10 @@ class TextWireframeWorker:
         logger.info(f"   Model: {settings.API_MODEL}")
         logger.info("="*60)
 
+        if not RABBITMQ_AVAILABLE:
+            logger.error("❌ RabbitMQ services not available (see RABBITMQ_IMPLEMENTATION_PLAN.md)")
+            sys.exit(1)
+
         # Redis
         try:
             import redis.asyncio as aioredis
@@ -111,7 +222,8 @@ class TextWireframeWorker:
         logger.info("="*60)
 
         self.running = False
-        await rabbitmq_service.disconnect()
+        if rabbitmq_service:
+            await rabbitmq_service.disconnect()
 
         if self.redis_client:
             await self.redis_client.close()
@@ -157,8 +269,23 @@ class TextWireframeWorker:
         wireframes = []
 
         try:
-            # Load stories from DB
+            # Load stories from DB: одним запросом вместе с Task и Activity,
+            # только колонки, которые нужны для промпта
             stories = db.query(UserStory)\
+                .options(
+                    load_only(
+                        UserStory.id,
+                        UserStory.title,
+                        UserStory.description,
+                        UserStory.acceptance_criteria,
+                        UserStory.task_id
+                    ),
+                    joinedload(UserStory.task)
+                        .load_only(UserTask.id, UserTask.title, UserTask.activity_id),
+                    joinedload(UserStory.task)
+                        .joinedload(UserTask.activity)
+                        .load_only(Activity.id, Activity.title)
+                )\
                 .filter(UserStory.id.in_(story_ids))\
                 .all()
 
@@ -167,44 +294,60 @@ class TextWireframeWorker:
 
             logger.info(f"📚 Loaded {len(stories)} stories from database")
 
-            # Generate wireframe for each story
-            for idx, story in enumerate(stories, 1):
-                logger.info(f"\n{'─'*60}")
-                logger.info(f"🎨 Wireframe {idx}/{len(stories)}: {story.title}")
-                logger.info(f"{'─'*60}")
-
-                try:
-                    wireframe_data = await self._generate_wireframe_for_story(
-                        story=story,
-                        style=style,
-                        platform=platform,
-                        db=db
-                    )
-
-                    wireframes.append(wireframe_data)
-
-                    # Update progress
-                    if self.job_service:
-                        await self.job_service.update_job_status(
-                            job_id=job_id,
-                            status=JobStatus.PROCESSING,
-                            result={
-                                "progress": f"{idx}/{len(stories)}",
-                                "completed_wireframes": wireframes
-                            }
+            # Generate wireframes concurrently: вызовы AI - это I/O, ждем их параллельно
+            semaphore = asyncio.Semaphore(WIREFRAME_AI_CONCURRENCY)
+            completed = 0
+            # Прогресс пишем в Redis пачками (~10 обновлений на job), без самих wireframes:
+            # полный список уходит один раз в финальном статусе
+            progress_every = max(1, len(stories) // 10)
+
+            async def generate_one(idx: int, story: UserStory) -> Dict:
+                nonlocal completed
+                async with semaphore:
+                    logger.info(f"🎨 Wireframe {idx}/{len(stories)}: {story.title}")
+
+                    task = story.task
+                    activity = task.activity if task else None
+
+                    try:
+                        wireframe_data = await self._generate_wireframe_for_story(
+                            story=story,
+                            task=task,
+                            activity=activity,
+                            style=style,
+                            platform=platform
                         )
 
-                    logger.info(f"✅ Wireframe {idx} completed")
-
-                except Exception as e:
-                    logger.error(f"❌ Failed to generate wireframe {idx}: {e}")
-                    # Continue with next story
-                    wireframes.append({
-                        "story_id": story.id,
-                        "story_title": story.title,
-                        "error": str(e),
-                        "status": "failed"
-                    })
+                        completed += 1
+
+                        # Update progress
+                        if self.job_service and completed % progress_every == 0:
+                            await self.job_service.update_job_status(
+                                job_id=job_id,
+                                status=JobStatus.PROCESSING,
+                                result={
+                                    "progress": f"{completed}/{len(stories)}",
+                                    "completed_count": completed
+                                }
+                            )
+
+                        logger.info(f"✅ Wireframe {idx} completed")
+                        return wireframe_data
+
+                    except Exception as e:
+                        logger.error(f"❌ Failed to generate wireframe {idx}: {e}")
+                        # Continue with other stories
+                        return {
+                            "story_id": story.id,
+                            "story_title": story.title,
+                            "error": str(e),
+                            "status": "failed"
+                        }
+
+            # gather сохраняет порядок stories в результате
+            wireframes = await asyncio.gather(*(
+                generate_one(idx, story) for idx, story in enumerate(stories, 1)
+            ))
 
             # Calculate stats
             successful = len([w for w in wireframes if "error" not in w])
@@ -261,29 +404,24 @@ class TextWireframeWorker:
     async def _generate_wireframe_for_story(
         self,
         story: UserStory,
+        task: Optional[UserTask],
+        activity: Optional[Activity],
         style: str,
-        platform: str,
-        db: Session
+        platform: str
     ) -> Dict:
         """
         Генерация text-based wireframe для одной User Story
 
         Pipeline:
-        1. Load context (Activity, Task)
-        2. Generate ASCII wireframe + UI description with AI
-        3. Return structured data
+        1. Generate ASCII wireframe + UI description with AI
+           (контекст Task/Activity загружен вместе со story в process_message)
+        2. Return structured data
 
         Returns:
             Dict with wireframe data (ascii_wireframe, ui_description, elements, etc.)
         """
 
-        # Step 1: Load context
-        task = db.query(UserTask).filter(UserTask.id == story.task_id).first()
-        activity = None
-        if task:
-            activity = db.query(Activity).filter(Activity.id == task.activity_id).first()
-
-        # Step 2: Generate wireframe with AI
+        # Step 1: Generate wireframe with AI
         logger.info("   📝 Generating text wireframe with AI...")
 
         prompt = self._build_wireframe_prompt(
@@ -294,12 +432,36 @@ class TextWireframeWorker:
             platform=platform
         )
 
-        # Use existing AI service (works with Gemini/Groq/Perplexity)
-        ai_response = generate_ai_response(
-            prompt=prompt,
-            redis_client=self.redis_client,
-            temperature=0.7
-        )
+        # Проверяем кеш: повторный job для неизмененной story дает тот же промпт
+        ai_response = None
+        cache_key = get_cache_key(prompt, prefix="wireframe")
+        if self.redis_client:
+            try:
+                ai_response = await self.redis_client.get(cache_key)
+                if ai_response:
+                    logger.info("   Using cached wireframe response")
+            except Exception as e:
+                logger.warning(f"Redis cache read failed: {e}")
+
+        if not ai_response:
+            # Use existing AI service (works with Gemini/Groq/Perplexity).
+            # Вызов синхронный - уводим в поток, чтобы не блокировать event loop
+            ai_response = await asyncio.to_thread(
+                generate_ai_response,
+                prompt=prompt,
+                temperature=0.7
+            )
+
+            # Кешируем ответ
+            if self.redis_client:
+                try:
+                    await self.redis_client.setex(
+                        cache_key,
+                        WIREFRAME_CACHE_TTL,
+                        ai_response
+                    )
+                except Exception as e:
+                    logger.warning(f"Redis cache write failed: {e}")
 
         logger.info(f"   ✅ Wireframe generated ({len(ai_response)} chars)")
 
@@ -327,88 +489,21 @@ class TextWireframeWorker:
     ) -> str:
         """Формирование промпта для генерации text-based wireframe"""
 
-        context = f"""
-User Story:
-Название: {story.title}
-Описание: {story.description}
-
-Acceptance Criteria:
-{chr(10).join(f"  • {c}" for c in (story.acceptance_criteria or ['Нет критериев']))}
-
-Контекст:
-Activity: {activity.title if activity else 'N/A'}
-Task: {task.title if task else 'N/A'}
-
-Параметры:
-Стиль: {style}
-Платформа: {platform}
-"""
-
-        style_instructions = {
-            "low-fidelity": "Простая ASCII схема с базовыми блоками, минимум деталей",
-            "high-fidelity": "Детальная ASCII схема с конкретными элементами и labels",
-            "component": "Фокус на одном UI компоненте с детальным описанием"
-        }
-
-        platform_instructions = {
-            "web": "Desktop web интерфейс (navbar, cards, sidebar)",
-            "mobile": "Mobile app интерфейс (portrait, bottom navigation, swipe gestures)",
-            "desktop": "Native desktop приложение (menu bar, toolbar, panels)"
-        }
-
-        prompt = f"""Создай text-based wireframe (ASCII схема + описание) для следующей User Story:
-
-{context}
-
-ТРЕБОВАНИЯ:
-
-1. **ASCII Wireframe:**
-   - Используй box-drawing characters: ┌─┐│└┘├┤┬┴┼
-   - Покажи структуру экрана визуально
-   - Обозначь основные UI блоки: Header, Content, Footer
-   - Стиль: {style_instructions.get(style, '')}
-   - Платформа: {platform_instructions.get(platform, '')}
-
-2. **Описание Layout:**
-   - Опиши структуру экрана текстом
-   - Перечисли все разделы (Header, Main, Sidebar, Footer)
-   - Укажи их назначение
-
-3. **UI Элементы:**
-   Список всех UI компонентов в формате:
-   - [Type] Label/Text (placeholder, если есть)
-
-   Примеры:
-   - [Input] Email (placeholder: "user@example.com")
-   - [Button] Register (primary, top-right)
-   - [Link] Forgot password? (below password field)
-
-4. **Навигация:**
-   - Откуда попадаем на этот экран
-   - Куда можно перейти с этого экрана
-   - Основные user flows
-
-ФОРМАТ ОТВЕТА (СТРОГО СОБЛЮДАЙ):
-
-```ascii
-[ASCII wireframe схема здесь]
-```
-
-## Layout Description
-[Текстовое описание структуры]
-
-## UI Elements
-[Список всех элементов]
-
-## Navigation
-[Описание навигации]
-
-## Additional Notes
-[Дополнительные замечания по UX, если есть]
+        criteria = "\n".join(
+            f"  • {c}" for c in (story.acceptance_criteria or ['Нет критериев'])
+        )
 
-Будь конкретным, детальным и профессиональным. Опиши экран так, чтобы фронтенд-разработчик мог его реализовать.
-"""
-        return prompt
+        return _PROMPT_TEMPLATE.format(
+            title=story.title,
+            description=story.description,
+            criteria=criteria,
+            activity=activity.title if activity else 'N/A',
+            task=task.title if task else 'N/A',
+            style=style,
+            platform=platform,
+            style_instr=_STYLE_INSTR.get(style, ''),
+            platform_instr=_PLATFORM_INSTR.get(platform, '')
+        )
 
     def _parse_wireframe_response(self, ai_response: str) -> Dict:
         """
@@ -432,33 +527,22 @@ Task: {task.title if task else 'N/A'}
             "notes": ""
         }
 
-        # Extract ASCII wireframe
-        import re
-        ascii_match = re.search(r'```ascii\n(.*?)```', ai_response, re.DOTALL)
-        if ascii_match:
-            result["ascii_wireframe"] = ascii_match.group(1).strip()
-
-        # Extract sections
-        layout_match = re.search(r'## Layout Description\n(.*?)(?=##|$)', ai_response, re.DOTALL)
-        if layout_match:
-            result["layout_description"] = layout_match.group(1).strip()
-
-        elements_match = re.search(r'## UI Elements\n(.*?)(?=##|$)', ai_response, re.DOTALL)
-        if elements_match:
-            elements_text = elements_match.group(1).strip()
-            # Parse elements list
-            result["ui_elements"] = [
-                line.strip() for line in elements_text.split('\n')
-                if line.strip() and line.strip().startswith('-')
-            ]
-
-        nav_match = re.search(r'## Navigation\n(.*?)(?=##|$)', ai_response, re.DOTALL)
-        if nav_match:
-            result["navigation"] = nav_match.group(1).strip()
-
-        notes_match = re.search(r'## Additional Notes\n(.*?)$', ai_response, re.DOTALL)
-        if notes_match:
-            result["notes"] = notes_match.group(1).strip()
+        # Extract sections: берем первое вхождение каждой секции
+        found = set()
+        for match in _SECTIONS_RE.finditer(ai_response):
+            section = match.lastgroup
+            if section in found:
+                continue
+            found.add(section)
+            text = match.group(section).strip()
+            if section == "ui_elements":
+                # Parse elements list
+                result["ui_elements"] = [
+                    line.strip() for line in text.split('\n')
+                    if line.strip() and line.strip().startswith('-')
+                ]
+            else:
+                result[section] = text
 
         return result
 
@@ -493,6 +577,14 @@ async def main():
 
 if __name__ == "__main__":
     Path("logs").mkdir(exist_ok=True)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(sys.stdout),
+            logging.FileHandler('logs/wireframe_worker.log')
+        ]
+    )
 
     try:
         asyncio.run(main())